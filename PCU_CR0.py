@@ -3,7 +3,10 @@
 import os
 import struct
 from textwrap import wrap
-import bitstruct
+import bitfield
+import layouts
+import energy
+import stats
 
 from useful_stuff import *
 from msr import rdmsr
@@ -17,8 +20,7 @@ from msr import rdmsr
 ###################################################################################################
 def decode_VID_1_30_0_CFG(reg):
   comment="assigned by PCI-SIG to Intel"  
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -27,8 +29,7 @@ def decode_VID_1_30_0_CFG(reg):
 
 def decode_SVID_1_30_0_CFG(reg):
   comment="specifies Intel but can be set to any value once after reset"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -43,47 +44,28 @@ def decode_PACKAGE_POWER_SKU_CFG(reg):
     comment=""
 
   comment+="Defines allowed SKU power and timing parameters"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,pgk_max_win_x,pkg_max_win_y,_,pkg_max_pwr,_,pkg_min_pwr,_,pkg_tdp= \
-          bitstruct.unpack("u9 u2 u5 b1 u15 b1 u15 b1 u15", reg)
-  max_win=(1+pgk_max_win_x/10)*2**pkg_max_win_y
-
+  sku=layouts.scale(layouts.PACKAGE_POWER_SKU_CFG, layouts.decode(layouts.PACKAGE_POWER_SKU_CFG, reg))
 
   return "\t\t{0}\n  \u251C PKG_MAX_WIN\t: {1}s\t\t\t{2}\n  \u251C PKG_MAX_PWR\t: {3:4.0f}W\t\t\t{4}\n  \u251C PKG_MIN_PWR\t: {5:4.0f}W\t\t\t{6}\n  \u2514 PKG_TDP\t: {7:4.0f}W\t\t\t{8}".format(
           blue(comment),
-          max_win*pcu["time_unit"],    blue("maximal time window allowed for the SKU"),
-          pkg_max_pwr*pcu["pwr_unit"], blue("Maximal package power setting allowed for the SKU"),
-          pkg_min_pwr*pcu["pwr_unit"], blue("Minimal package power setting for this part"),
-          pkg_tdp*pcu["pwr_unit"],     blue("The TPD package power setting allowed for the SKU"))
+          sku["max_win"], blue("maximal time window allowed for the SKU"),
+          sku["max_pwr"], blue("Maximal package power setting allowed for the SKU"),
+          sku["min_pwr"], blue("Minimal package power setting for this part"),
+          sku["tdp"],     blue("The TPD package power setting allowed for the SKU"))
 
 
-PRIP_NRG_STTS_CFG_a=0
-PRIP_NRG_STTS_CFG_laps=0
+# the energy counters are integrated by energy.py, fed with timestamped samples by the collector :
+# the decoders only report the power of the socket on display, and its statistics (see stats.py)
 def decode_PRIP_NRG_STTS_CFG(reg):
-  global PRIP_NRG_STTS_CFG_a
-  global PRIP_NRG_STTS_CFG_laps
   comment="Total energy consumed"  
-  a=PRIP_NRG_STTS_CFG_a
-
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  b=bitstruct.unpack("u32", reg)[0]
-  if b==a:
-    PRIP_NRG_STTS_CFG_laps+=1   
+  eps=energy.power(energy.displayed, "pp0")
+  if eps is None:
     return "--- W\t{0}".format(blue(comment))
-  if b>a:
-    difference=b-a
-  else:
-    difference=(2**32-1-a)+b  
-  deltat=.1*(1+PRIP_NRG_STTS_CFG_laps)
-  eps=difference/deltat*pcu["energy_unit"]
-  PRIP_NRG_STTS_CFG_a=b
-  PRIP_NRG_STTS_CFG_laps=0   
-  return "{0:3.0f} W\t{1}".format(eps, blue(comment))
+  return "{0:3.0f} W\t{1}  {2}".format(eps, blue(comment), stats.brief(energy.displayed, "pp0 power", "W"))
   
 
 def decode_PACKAGE_POWER_SKU_UNIT_CFG(reg):
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,time_unit,_,energy_unit,_,pwr_unit = bitstruct.unpack("u12 u4 u4 u4 u4 u4", reg)
+  _,time_unit,_,energy_unit,_,pwr_unit = bitfield.unpack("u12 u4 u4 u4 u4 u4", reg)
   pcu["time_unit"]=1/2**time_unit
   pcu["energy_unit"]=1/2**energy_unit
   pcu["pwr_unit"]=1/2**pwr_unit
@@ -91,16 +73,18 @@ def decode_PACKAGE_POWER_SKU_UNIT_CFG(reg):
   energy_unit="{0:.0f}".format(pcu["energy_unit"]*1000000)
   pwr_unit   ="{0:.3f}".format(pcu["pwr_unit"])
 
-  # let's read the MSR_RAPL_POWER_UNIT to compare
-  msr=rdmsr(0x606, 4)
-  msr=bitstruct.byteswap("{}".format(len(msr)),msr)
-  _,msr_time_unit,_,msr_energy_unit,_,msr_pwr_unit = bitstruct.unpack("u12 u4 u4 u4 u4 u4", msr)
-  msr_time_unit=1/2**msr_time_unit
-  msr_energy_unit=1/2**msr_energy_unit
-  msr_pwr_unit=1/2**msr_pwr_unit
-  msr_time_unit  ="{0:.0f}".format(msr_time_unit*1000000)
-  msr_energy_unit="{0:.0f}".format(msr_energy_unit*1000000)
-  msr_pwr_unit   ="{0:.3f}".format(msr_pwr_unit)
+  # let's read the MSR_RAPL_POWER_UNIT to compare. not available when replaying a capture
+  try:
+    msr=rdmsr(0x606, 4)
+    _,msr_time_unit,_,msr_energy_unit,_,msr_pwr_unit = bitfield.unpack("u12 u4 u4 u4 u4 u4", msr)
+    msr_time_unit=1/2**msr_time_unit
+    msr_energy_unit=1/2**msr_energy_unit
+    msr_pwr_unit=1/2**msr_pwr_unit
+    msr_time_unit  ="{0:.0f}".format(msr_time_unit*1000000)
+    msr_energy_unit="{0:.0f}".format(msr_energy_unit*1000000)
+    msr_pwr_unit   ="{0:.3f}".format(msr_pwr_unit)
+  except OSError:
+    msr_time_unit=msr_energy_unit=msr_pwr_unit="n/a"
 
   text= "MSR_RAPL_POWER_UNIT\n"
 
@@ -119,33 +103,16 @@ def decode_PACKAGE_POWER_SKU_UNIT_CFG(reg):
   return text + "\n".join([ labels[i] + CSR[i] + MSR[i] for i in range(3) ]) 
 
 
-PACKAGE_ENERGY_STATUS_CFG_a=0
-PACKAGE_ENERGY_STATUS_CFG_laps=0
 def decode_PACKAGE_ENERGY_STATUS_CFG(reg):
-  global PACKAGE_ENERGY_STATUS_CFG_a
-  global PACKAGE_ENERGY_STATUS_CFG_laps
   comment="Package energy consumed by the entire CPU (including IA, Uncore)"
-  a=PACKAGE_ENERGY_STATUS_CFG_a
-
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  b=bitstruct.unpack("u32", reg)[0]
-  if b==a:
-    PACKAGE_ENERGY_STATUS_CFG_laps+=1   
+  eps=energy.power(energy.displayed, "package")
+  if eps is None:
     return "--- W\t{0}".format(blue(comment))
-  if b>a:
-    difference=b-a
-  else:
-    difference=(2**32-1-a)+b  
-  deltat=.1*(1+PACKAGE_ENERGY_STATUS_CFG_laps)
-  eps=difference/deltat*pcu["energy_unit"]
-  PACKAGE_ENERGY_STATUS_CFG_a=b
-  PACKAGE_ENERGY_STATUS_CFG_laps=0   
-  return "{0:3.0f} W\t\t{1}".format(eps, blue(comment))
+  return "{0:3.0f} W\t\t{1}  {2}".format(eps, blue(comment), stats.brief(energy.displayed, "package power", "W"))
 
 
 def decode_PLATFORM_ID_CFG(reg):
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,platform_id,_ = bitstruct.unpack("u11 u3 u50", reg)
+  _,platform_id,_ = bitfield.unpack("u11 u3 u50", reg)
   if platform_id==0:
     return "1S/2S (shelf 1, 2)"
   elif platform_id==1:
@@ -161,7 +128,6 @@ def decode_PLATFORM_ID_CFG(reg):
 
 
 def decode_PLATFORM_INFO_CFG(reg):
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   config_tdp_ext_en,       \
   _,                       \
   _,                       \
@@ -191,7 +157,7 @@ def decode_PLATFORM_INFO_CFG(reg):
   smm_save_cap,            \
   max_non_turbo_lim_ratio, \
   _ =                      \
-    bitstruct.unpack("b1 u2 b1 b1 b1 b1 b1 u8 u8 b1 b1 b1 b1 b1 u2 b1 b1 b1 b1 b1 b1 u2 b1 b1 u4 b1 b1 u8 u8", reg)
+    bitfield.unpack("b1 u2 b1 b1 b1 b1 b1 u8 u8 b1 b1 b1 b1 b1 u2 b1 b1 b1 b1 b1 b1 u2 b1 b1 u4 b1 b1 u8 u8", reg)
 
   flags=["{0}MHz {1}MHz".format( min_operating_ratio*100,
                              max_efficiency_ratio*100) ]
@@ -225,8 +191,7 @@ def decode_PLATFORM_INFO_CFG(reg):
 
 
 def decode_TURBO_ACTIVATION_RATIO_CFG(reg):
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  turbo_activation_ratio_lock,_,max_non_turbo_ratio = bitstruct.unpack("b1 u23 u8", reg)
+  turbo_activation_ratio_lock,_,max_non_turbo_ratio = bitfield.unpack("b1 u23 u8", reg)
   if turbo_activation_ratio_lock:
     lock="LOCKED"
   else:
@@ -244,9 +209,8 @@ def decode_PACKAGE_TEMPERATURE_CFG(reg):
   else:
     comment=""
   comment+="Package temperature, updated by FW"   
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,temperature = bitstruct.unpack("u24 u8", reg)
-  return "{0:3d}°C\t\t{1}".format(temperature, blue(comment))
+  temperature=layouts.decode(layouts.PACKAGE_TEMPERATURE_CFG, reg)["temperature"]
+  return "{0:3d}°C\t\t{1}  {2}".format(temperature, blue(comment), stats.brief(energy.displayed, "package temperature", "°C"))
 
 
 def decode_PP0_TEMPERATURE_CFG(reg):
@@ -256,15 +220,13 @@ def decode_PP0_TEMPERATURE_CFG(reg):
   else:
     comment=""
   comment+="PP0 temperature, updated by FW"   
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,temperature = bitstruct.unpack("u24 u8", reg)
-  return "{0:3d}°C\t\t{1}".format(temperature, blue(comment))
+  temperature=layouts.decode(layouts.PP0_TEMPERATURE_CFG, reg)["temperature"]
+  return "{0:3d}°C\t\t{1}  {2}".format(temperature, blue(comment), stats.brief(energy.displayed, "pp0 temperature", "°C"))
 
 
 def decode_P_STATE_LIMTS_CFG(reg):
   comment="maximum IA frequency limit allowed during run-time"   
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  pstt_lock,_,pstt_lim = bitstruct.unpack("b1 u23 u8", reg)
+  pstt_lock,_,pstt_lim = bitfield.unpack("b1 u23 u8", reg)
   if pstt_lock:
     lock=red("LOCKED")
   else:
@@ -289,8 +251,7 @@ def decode_PACKAGE_THERM_MARGIN_CFG(reg):
 "                                        If the socket is an MCP, then this parameter represents the\n" \
 "                                        min temperature margin to the throttling set point temperature\n" \
 "                                        among all the dies in the MCP."
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,margin = bitstruct.unpack("u18 s14", reg)
+  margin=layouts.decode(layouts.PACKAGE_THERM_MARGIN_CFG, reg)["margin"]
   return "{0} °C\t{1}".format(margin, blue(comment))
 
 
@@ -303,9 +264,13 @@ def decode_TEMPERATURE_TARGET_CFG(reg):
     line0="\t\t"
   line0+=blue("Legacy register holding temperature related constants")
 
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  lock,_,tj_max_tcc_offset,ref_temp,fan_temp_target_ofst,tcc_offset_clamping_bit,tcc_offset_time_window= \
-    bitstruct.unpack("b1 b1 u6 u8 u8 b1 u7", reg)
+  target=layouts.decode(layouts.TEMPERATURE_TARGET_CFG, reg)
+  lock=target["lock"]
+  tj_max_tcc_offset=target["tj_max_tcc_offset"]
+  ref_temp=target["ref_temp"]
+  fan_temp_target_ofst=target["fan_temp_target_ofst"]
+  tcc_offset_clamping_bit=target["tcc_offset_clamping_bit"]
+  tcc_offset_time_window=target["tcc_offset_time_window"]
   if lock:
     lock=red("LOCKED")
   else:
@@ -338,55 +303,50 @@ def decode_PACKAGE_RAPL_LIMIT_CFG(reg):
 "                                        the power budget between the Primary Power Plane (IA) and the\n" \
 "                                        Secondary Power Plane (GT) via PRIMARY_PLANE_TURBO_POWER_LIMIT_MSR\n" \
 "                                        and SECONDARY_PLANE_TURBO_POWER_LIMIT_MSR"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  lim_lock,_,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,_,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 = \
-    bitstruct.unpack("b1 u7 u2 u5 b1 b1 u15 u8 u2 u5 b1 b1 u15", reg)
-  if lim_lock:
+  limit=layouts.scale(layouts.PACKAGE_RAPL_LIMIT_CFG, layouts.decode(layouts.PACKAGE_RAPL_LIMIT_CFG, reg))
+  if limit["lim_lock"]:
     lock=red("LOCKED")
   else:
     lock=green("UNLOCKED")
 
-  if clmp_lim_2:
+  if limit["clmp_lim_2"]:
     clamp2=green("can go below P1")
   else:
     clamp2=red("is limited between P0 and P1")
 
-  if clmp_lim_1:
+  if limit["clmp_lim_1"]:
     clamp1=green("can go below P1")
   else:
     clamp1=red("is limited between P0 and P1")
 
-  if lim_2_en:
+  if limit["lim_2_en"]:
     pl2enable=red("ENABLED")
   else:
     pl2enable=green("DISABLED")
 
-  if lim_1_en:
+  if limit["lim_1_en"]:
     pl1enable=red("ENABLED")
   else:
     pl1enable=green("DISABLED")
 
-  time_window2=(1+lim_2_time_x/10)*2**lim_2_time_y
-  time_window1=(1+lim_1_time_x/10)*2**lim_1_time_y
   return "{0}\n" \
   "  PKG_PWR_LIM_2_TIME : {1:7.2f} s\tTime window over which Power_Limit_2 should be maintained\n" \
   "  PKG_PWR_LIM_2      : {2:3.0f} W ({3})\tPPL2/Package Power Limitation 2, always on\n" \
   "  PBM2               : {4}\n" \
   "  PKG_PWR_LIM_1_TIME : {5:7.2f} s\t{6}\n" \
   "  PKG_PWR_LIM_1      : {7:3.0f} W ({8})\t{9}\n" \
-  "  PBM1               : {10}".format(lock,time_window2*pcu["time_unit"],
-                                            lim_2       *pcu["pwr_unit"], pl2enable, clamp2,
-                                            time_window1*pcu["time_unit"], blue("The maximal time window is bounded by PKG_PWR_SKU_MSR[PKG_MAX_WIN]"),
-                                            lim_1       *pcu["pwr_unit"], pl1enable, blue("PPL1/Package Power Limitation 1"),
+  "  PBM1               : {10}".format(lock,limit["time_window_2"],
+                                            limit["lim_2"], pl2enable, clamp2,
+                                            limit["time_window_1"], blue("The maximal time window is bounded by PKG_PWR_SKU_MSR[PKG_MAX_WIN]"),
+                                            limit["lim_1"], pl1enable, blue("PPL1/Package Power Limitation 1"),
                                             clamp1)
 
 
 def decode_VR_CURRENT_CONFIG_CFG(reg):
   comment="Limitation on the maximum current consumption of the primary power plane"
 
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   psi3_threshold,psi2_threshold,psi1_threshold,lock,current_limit= \
-    bitstruct.unpack("p2 u10 u10 u10 b1 p18 u13", reg)
+    bitfield.unpack("p2 u10 u10 u10 b1 p18 u13", reg)
   if lock:
     lock=red("LOCKED")
   else:
@@ -437,3 +397,20 @@ registers= [
   (0xF4, "PCU BAR"                  , 4, ""),
   (0xF8, "VR CURRENT CONFIGURATION" , 8, decode_VR_CURRENT_CONFIG_CFG)
 ]
+
+# sampling interval (s) of the registers that don't move at the collector's default pace, by offset.
+# the collector backs off further while a value stays the same
+sampling= {
+  0x80: 10,     # PACKAGE POWER SKU
+  0x88: .001,   # PRIMARY PLANE ENERGY STATUS, updated every ms
+  0x8C: 10,     # PACKAGE POWER SKU UNIT
+  0x90: .001,   # PACKAGE ENERGY STATUS, updated every ms
+  0xA0: 10,     # PLATFORM ID
+  0xA8: 10,     # PLATFORM INFO
+  0xB0: 1,      # TURBO ACTIVATION RATIO
+  0xD0: 1,      # MRC ODT POWER SAVING CFG
+  0xE4: 1,      # TEMPERATURE TARGET
+  0xE8: 1,      # PACKAGE RAPL LIMIT CFG
+  0xF4: 10,     # PCU BAR
+  0xF8: 1,      # VR CURRENT CONFIGURATION
+}
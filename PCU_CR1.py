@@ -4,7 +4,7 @@ import os
 import sys
 import struct
 from textwrap import wrap
-import bitstruct
+import bitfield
 
 from useful_stuff import *
 
@@ -51,8 +51,7 @@ CLOS_PM_QOS_CONFIG       = 0x2
 ###################################################################################################
 def decode_VID_1_30_1_CFG(reg):
   comment="assigned by PCI-SIG to Intel"  
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -61,8 +60,7 @@ def decode_VID_1_30_1_CFG(reg):
 
 def decode_SVID_1_30_1_CFG(reg):
   comment="specifies Intel® but can be set to any value once after reset"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -71,9 +69,8 @@ def decode_SVID_1_30_1_CFG(reg):
 
 def decode_STAT_TEMPTRIP_CFG(reg):
   comment="logs the status of thermtrip and memtrip sources"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,stat_earlydts_cpu_thermtrip,stat_cpu_thermtrip,stat_memtrip1,stat_memtrip0=\
-    bitstruct.unpack("u28 b1 b1 b1 b1", reg)
+    bitfield.unpack("u28 b1 b1 b1 b1", reg)
   line0="\t\t"+blue(comment)
   line1="  flags : "
   if stat_earlydts_cpu_thermtrip: line1+=" " + red("STAT_EARLYDTS_CPU_THERMTRIP")
@@ -85,8 +82,7 @@ def decode_STAT_TEMPTRIP_CFG(reg):
 
 def decode_STAT_TEMPHOT_CFG(reg):
   comment="logs the status of memhot and prochot sources"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,stat_memhot1_out,stat_memhot0_out= bitstruct.unpack("u30 b1 b1", reg)
+  _,stat_memhot1_out,stat_memhot0_out= bitfield.unpack("u30 b1 b1", reg)
   line0="\t\t"+blue(comment)
   line1="  flags : "
   if stat_memhot1_out: line1+=" " + red("STAT_MEMHOT1_OUT")
@@ -96,8 +92,7 @@ def decode_STAT_TEMPHOT_CFG(reg):
 
 def decode_MC_BIOS_REQUEST(reg):
   comment="Memory Controller clock frequency (requested by BIOS)"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,req_type,_,req_data = bitstruct.unpack("u20 u4 u2 u6", reg)
+  _,req_type,_,req_data = bitfield.unpack("u20 u4 u2 u6", reg)
   
   ro=red("RO")
  
@@ -110,8 +105,7 @@ def decode_MC_BIOS_REQUEST(reg):
 
 def decode_M_COMP_CFG(reg):
   comment="Memory compensation control"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,comp_force,_,comp_interval,comp_disable = bitstruct.unpack("u22 b1 u3 u4 b1", reg)
+  _,comp_force,_,comp_interval,comp_disable = bitfield.unpack("u22 b1 u3 u4 b1", reg)
   
   ro=red("RO")
   
@@ -128,8 +122,7 @@ def decode_CSR_DESIRED_CORES_CFG(reg):
   comment="Single bits that were part of CSR_DESIRED_CORES_CFG broken out to this register to "\
           "keep CSR_DESIRED_CORES_CFG to have a core mask only."
   comment=wrap(comment, 65)
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  lock,smt_disable,_,max_cores= bitstruct.unpack("b1 b1 u22 u8", reg)
+  lock,smt_disable,_,max_cores= bitfield.unpack("b1 b1 u22 u8", reg)
   if lock: lock=red("LOCKED")
   else:    lock=green("UNLOCKED")
 
@@ -151,8 +144,7 @@ def decode_CSR_DESIRED_CORES_MASK0(reg):
           "by PWRGOOD."
   wrapped=wrap(comment, 65)
   justified=[ "\t"*5 + s for s in wrapped[1:] ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  core_off_mask= bitstruct.unpack("u32", reg)[0]
+  core_off_mask= bitfield.unpack("u32", reg)[0]
   
   ro=red("RO")
 
@@ -167,8 +159,7 @@ def decode_SSKPD_CFG(reg):
   comment="This register holds 64 writable bits with no functionality behind them. It is for the "\
           "convenience of BIOS. Address shouldnPLA has hardcoded address for this."
   comment=wrap(comment, 65)
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  d,c,b,a= bitstruct.unpack("u16 u16 u16 u16", reg)
+  d,c,b,a= bitfield.unpack("u16 u16 u16 u16", reg)
   return "{0} {1}h\t{2}\n\t\t\t\u251C {0} {3}h\t{4}\n\t\t\t\u251C {0} {5}h\t{6}\n\t\t\t\u2514 {0} {7}h".format(
           red("RO"),
           blue("{0:04X}".format(a)), blue(comment[0]),
@@ -187,8 +178,7 @@ def decode_C2_DDR_TT(reg):
   wrapped=wrap(comment, 65)
   justified=[ "\t"*5 + s for s in wrapped[1:] ]
   comment=[wrapped[0],] + justified
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,ddr_timer_value= bitstruct.unpack("u19 u13", reg)
+  _,ddr_timer_value= bitfield.unpack("u19 u13", reg)
   return "{0} {1:3d}\t{2}".format(red("RO"), ddr_timer_value,blue("\n".join(comment)))
 
 
@@ -201,24 +191,21 @@ def decode_C2C3TT_CFG(reg):
           "IMPH_CR_SNP_RELOAD[LIM] with this value."
   wrapped=wrap(comment, 65)
   justified=[ "\t"*5 + s for s in wrapped[1:] ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   comment=[wrapped[0],] + justified
-  _,ppdn_init= bitstruct.unpack("u20 u12", reg)
+  _,ppdn_init= bitfield.unpack("u20 u12", reg)
   return "{0} {1:3d}\t{2}".format(red("RO"), ppdn_init,blue("\n".join(comment)))
 
 
 def decode_TSOD_CONTROL_CFG(reg):
   comment="Polling interval for TSOD (Thermal Sensor On Dimm), set by BIOS"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,tsod_polling_interval= bitstruct.unpack("u27 u5", reg)
+  _,tsod_polling_interval= bitfield.unpack("u27 u5", reg)
   return "{0} {1}s\t{2}".format(red("RO"), tsod_polling_interval/8,blue(comment))
 
 
 def decode_PCIe_ILTR_OVERRIDE_CFG(reg):
   comment="Override parameters for received LTR messages from PCI Express"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   sxl_v,force_sxl,_,sxlm,sxl,nl_v,force_nl,_,multiplier,nstl= \
-          bitstruct.unpack("b1 b1 b1 u3 u10 b1 b1 b1 u3 u10", reg)
+          bitfield.unpack("b1 b1 b1 u3 u10 b1 b1 b1 u3 u10", reg)
 
   if not sxl_v:
     result="\n  \u251C {0} {1} the snoop latency override value".format(green("RW"), bold("Ignore")) 
@@ -289,3 +276,19 @@ registers= [
   (0xE0, "TSOD CONTROL"             , 4, decode_TSOD_CONTROL_CFG),
   (0xFC, "PCIe ILTR OVERRIDE CFG"   , 4, decode_PCIe_ILTR_OVERRIDE_CFG),
 ]
+
+# sampling interval (s) by offset, like PCU_CR0.sampling
+sampling= {
+  0x94: 10,     # BIOS RESET CPL CFG
+  0xB8: 1,      # MEMORY COMP CONTROL
+  0xBC: 1,      # CSR DESIRED CORES CFG
+  0xC0: 1,      # CSR DESIRED CORES MASK0
+  0xC4: 1,      # CSR DESIRED CORES MASK1
+  0xC8: 1,      # CSR DESIRED CORES MASK2
+  0xCC: 1,      # CSR DESIRED CORES MASK3
+  0xD0: 1,      # SSKPD CFG
+  0xD8: 1,      # C2 DDR TT
+  0xDC: 1,      # C2C3TT CFG
+  0xE0: 1,      # TSOD CONTROL
+  0xFC: 1,      # PCIe ILTR OVERRIDE CFG
+}
@@ -3,7 +3,9 @@
 import os
 import struct
 from textwrap import wrap
-import bitstruct
+import bitfield
+import layouts
+import energy
 
 from useful_stuff import *
 
@@ -16,8 +18,7 @@ from useful_stuff import *
 ###################################################################################################
 def decode_VID_1_30_2_CFG(reg):
   comment="assigned by PCI-SIG to Intel"  
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -26,8 +27,7 @@ def decode_VID_1_30_2_CFG(reg):
 
 def decode_SVID_1_30_2_CFG(reg):
   comment="specifies Intel® but can be set to any value once after reset"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -42,29 +42,31 @@ def decode_PACKAGE_RAPL_PERF_STATUS(reg):
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
   justified=[ "\t\t"+blued[0] ] + [ "\t"*5 + s for s in blued[1:] ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  pwr_limit_throttle_ctr= bitstruct.unpack("u32", reg)[0]
-  time="{0:<8.3f}".format(pwr_limit_throttle_ctr*pcu["time_unit"]/2 )
+  perf=layouts.decode(layouts.PACKAGE_RAPL_PERF_STATUS, reg)
+  time="{0:<8.3f}".format(perf["throttled"]*pcu["time_unit"] )   # the same unit as energy.throttled()
   justified[2]=justified[2].replace('\t\t\t', "\t{0} {1}s\t".format(red("RO"), blue(time) ) )
+  # the share of time throttled of the socket on display, and its power over the same window
+  throttled=energy.throttled(energy.displayed)
+  if throttled is not None:
+    justified[1]=justified[1].replace('\t\t\t', "\t{0:5.1f}% at {1:3.0f} W\t".format(
+                 throttled, energy.power(energy.displayed, "package") or 0), 1)
   return "\n".join(justified)
 
 
 def decode_DRAM_POWER_INFO_CFG(reg):
   comment="Power allowed for DRAM"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  lock,_,dram_max_win_x,dram_max_win_y,_,dram_max_pwr,_,dram_min_pwr,_,dram_tdp= \
-    bitstruct.unpack("b1 u8 u2 u5 b1 u15 b1 u15 b1 u15", reg)
+  info=layouts.scale(layouts.DRAM_POWER_INFO_CFG, layouts.decode(layouts.DRAM_POWER_INFO_CFG, reg))
   ro=red("RO")  
   line0="\t\t{0}\n".format(blue(comment))
   line1="  \u251C {0} DRAM MAX WIN = {1} s\t\t{2}\n".format(
-           ro, (1+dram_max_win_x/10)*2**dram_max_win_y*pcu["time_unit"], 
+           ro, info["max_win"], 
            blue("Higher value will be clamped to this value") )
   line2="  \u251C {0} DRAM MAX PWR = {1:3.0f} W\t\t{2}\n".format( 
-           ro, dram_max_pwr*pcu["pwr_unit"], blue("Higher value will be clamped to this value") )
+           ro, info["max_pwr"], blue("Higher value will be clamped to this value") )
   line3="  \u251C {0} DRAM MIN PWR = {1:3.0f} W\t\t{2}\n".format( 
-           ro, dram_min_pwr*pcu["pwr_unit"], blue("Reserved, user should ignore this value") )
+           ro, info["min_pwr"], blue("Reserved, user should ignore this value") )
   line4="  \u2514 {0} DRAM TDP     = {1:3.0f} W\t\t{2}".format(
-           ro, dram_tdp*pcu["pwr_unit"], blue("From specifications, not garanteed in real life") )
+           ro, info["tdp"], blue("From specifications, not garanteed in real life") )
   return line0+line1+line2+line3+line4
 
 
@@ -79,9 +81,10 @@ def decode_MEM_TRML_TEMPERATURE_REPORT0(reg):
           "temperature field is used to report the maximal temperature of all ranks"
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,channel2_max_temperature,channel1_max_temperature,channel0_max_temperature= \
-          struct.unpack("<BBBB", reg)
+  report=layouts.decode(layouts.MEM_TRML_TEMPERATURE_REPORT0, reg)
+  channel2_max_temperature=report["channel2_temperature"]
+  channel1_max_temperature=report["channel1_temperature"]
+  channel0_max_temperature=report["channel0_temperature"]
   ro=red("RO")
   line0="\t\t"+blued[0]+"\n"
   value="{0:>2d}".format(channel2_max_temperature)
@@ -98,9 +101,10 @@ def decode_MEM_TRML_TEMPERATURE_REPORT1(reg):
           "temperature field is used to report the maximal temperature of all ranks"
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,channel2_max_temperature,channel1_max_temperature,channel0_max_temperature= \
-          bitstruct.unpack("u8 u8 u8 u8", reg)
+  report=layouts.decode(layouts.MEM_TRML_TEMPERATURE_REPORT1, reg)
+  channel2_max_temperature=report["channel2_temperature"]
+  channel1_max_temperature=report["channel1_temperature"]
+  channel0_max_temperature=report["channel0_temperature"]
   ro=red("RO")
   line0="\t\t"+blued[0]+"\n"
   value="{0:>2d}".format(channel2_max_temperature)
@@ -117,9 +121,10 @@ def decode_MEM_TRML_TEMPERATURE_REPORT2(reg):
           "temperature field is used to report the maximal temperature of all ranks"
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,channel2_max_temperature,channel1_max_temperature,channel0_max_temperature= \
-          bitstruct.unpack("u8 u8 u8 u8", reg)
+  report=layouts.decode(layouts.MEM_TRML_TEMPERATURE_REPORT2, reg)
+  channel2_max_temperature=report["channel2_temperature"]
+  channel1_max_temperature=report["channel1_temperature"]
+  channel0_max_temperature=report["channel0_temperature"]
   ro=red("RO")
   line0="\t\t"+blued[0]+"\n"
   value="{0:>2d}".format(channel2_max_temperature)
@@ -136,9 +141,8 @@ def decode_MEM_TRML_TEMPERATURE_REPORT3(reg):
           "temperature field is used to report the maximal temperature of all ranks"
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,channel2_max_temperature,channel1_max_temperature,channel0_max_temperature= \
-          bitstruct.unpack("u8 u8 u8 u8", reg)
+          bitfield.unpack("u8 u8 u8 u8", reg)
   ro=red("RO")
   line0="\t\t"+blued[0]+"\n"
   value="{0:>2d}".format(channel2_max_temperature)
@@ -198,9 +202,8 @@ def decode_MEM_TRML_TEMPERATURE_REPORT0123(reg):
 
 def decode_DYNAMIC_PERF_POWER_CTL_CFG(reg):
   comment="Governs all major power saving engines and heuristics on the die"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,uncore_perf_plimit_override_enable,active_idle_efficiency_mode,_,imc_apm_override_enable,_= \
-    bitstruct.unpack("u11 b1 b1 u8 b1 u10", reg)
+    bitfield.unpack("u11 b1 b1 u8 b1 u10", reg)
   rw=green("RW")  
   if uncore_perf_plimit_override_enable:
     uncore_perf_plimit_override=yellow("Uncore perf limit override ENABLED")
@@ -227,9 +230,8 @@ def decode_PERF_P_LIMIT_CONTROL_CFG(reg):
           "guaranteed frequency + 1, if turbo related actions are needed in slave sockets"
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,perf_plimit_differential,_,perf_plimit_clip,_,perf_plimit_threshold,perf_plimit_enable= \
-          bitstruct.unpack("u14 u3 u3 u5 b1 u5 b1", reg)
+          bitfield.unpack("u14 u3 u3 u5 b1 u5 b1", reg)
   rw=green("RW")
   if perf_plimit_enable:
     perf_plimit_enable="{}".format(yellow("ENABLED performance P-limit feature"))
@@ -292,3 +294,15 @@ registers= [
   (0xF8, "THERMTRIP CONFIGURATION"  , 4, ""),
   (0xFC, "PERFMON PCODE FILTER"     , 4, ""),
 ]
+
+# sampling interval (s) by offset, like PCU_CR0.sampling
+sampling= {
+  0x80: .001,   # DRAM ENERGY STATUS, updated every ms
+  0x94: 1,      # DTS CONFIGURATION 1
+  0x98: 1,      # DTS CONFIGURATION 2
+  0x9C: 1,      # DTS CONFIGURATION 3
+  0xA4: 10,     # GLOBAL NID SOCKET 0-3 MAP
+  0xA8: 10,     # DRAM POWER INFORMATION
+  0xF0: 1,      # DRAM PLANE PWR LIMIT CONF
+  0xF8: 10,     # THERMTRIP CONFIGURATION
+}
@@ -4,7 +4,7 @@ import os
 import struct
 from textwrap import wrap
 import argparse
-import bitstruct
+import bitfield
 
 from useful_stuff import *
 
@@ -17,8 +17,7 @@ from useful_stuff import *
 ###################################################################################################
 def decode_VID_1_30_3_CFG(reg):
   comment="assigned by PCI-SIG to Intel"  
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -27,8 +26,7 @@ def decode_VID_1_30_3_CFG(reg):
 
 def decode_SVID_1_30_3_CFG(reg):
   comment="specifies Intel® but can be set to any value once after reset"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -37,9 +35,8 @@ def decode_SVID_1_30_3_CFG(reg):
 
 def decode_CONFIG_TDP_LEVEL1(reg):
   comment="Level 1 configurable TDP settings"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,pkg_min_pwr,pkg_max_pwr,_,tdp_ratio,_,pkg_tdp= \
-    bitstruct.unpack("b1 u16 u15 u8 u8 b1 u15", reg)
+    bitfield.unpack("b1 u16 u15 u8 u8 b1 u15", reg)
   ro=red("RO")  
   line0="\t\t{0}\n".format(blue(comment))
   value="{0}".format(pkg_min_pwr*pcu["pwr_unit"])         
@@ -59,9 +56,8 @@ def decode_CONFIG_TDP_LEVEL1(reg):
 
 def decode_CONFIG_TDP_LEVEL2(reg):
   comment="Level 2 configurable TDP settings"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,pkg_min_pwr,pkg_max_pwr,_,tdp_ratio,_,pkg_tdp= \
-    bitstruct.unpack("b1 u16 u15 u8 u8 b1 u15", reg)
+    bitfield.unpack("b1 u16 u15 u8 u8 b1 u15", reg)
   ro=red("RO")  
   line0="\t\t{0}\n".format(blue(comment))
   value="{0}".format(pkg_min_pwr*pcu["pwr_unit"])         
@@ -81,8 +77,7 @@ def decode_CONFIG_TDP_LEVEL2(reg):
 
 def decode_CONFIG_TDP_NOMINAL_CFG(reg):
   comment="Nominal TDP configuration"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  _,tdp_ratio= bitstruct.unpack("u24 u8", reg)
+  _,tdp_ratio= bitfield.unpack("u24 u8", reg)
   ro=red("RO")  
   value="{0}".format(tdp_ratio)         
   line0="\t\t{0}\n".format(blue(comment))
@@ -99,9 +94,8 @@ def decode_FLEX_RATIO(reg):
           "the value of FLEX_EN"
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,oc_lock,oc_bins,enable,flex_ratio,oc_extra_voltage = \
-          bitstruct.unpack("u43 b1 u3 b1 u8 u8", reg)
+          bitfield.unpack("u43 b1 u3 b1 u8 u8", reg)
   ro=red("RO")  
   if oc_lock:
     line1="  \u251C "+ro+" OVERCLOCKING LOCK = " + red("LOCKED") + \
@@ -163,3 +157,14 @@ registers= [
   (0xE8, "FUSED CORES HIGH"         , 8, ""),
   (0xF0, "FLEX RATIO"               , 8, decode_FLEX_RATIO),
 ]
+
+# sampling interval (s) by offset, like PCU_CR0.sampling
+sampling= { offset: 10 for offset in (0x84, 0x88, 0x8C, 0x90, 0x94, 0x98, 0x9C, 0xA0, 0xAC, 0xB0, 0xBC) }   # CAPABILITY REGISTERS
+sampling.update( {
+  0xC0: 10,     # CONFIG TDP LEVEL1
+  0xC8: 10,     # CONFIG TDP LEVEL2
+  0xDC: 1,      # CONFIG TDP NOMINAL
+  0xE0: 10,     # FUSED CORES LOW
+  0xE8: 10,     # FUSED CORES HIGH
+  0xF0: 1,      # FLEX RATIO
+} )
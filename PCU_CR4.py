@@ -4,7 +4,7 @@ import os
 import struct
 from textwrap import wrap
 import argparse
-import bitstruct
+import bitfield
 
 from useful_stuff import *
 
@@ -17,8 +17,7 @@ from useful_stuff import *
 ###################################################################################################
 def decode_VID_1_30_4_CFG(reg):
   comment="assigned by PCI-SIG to Intel"  
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -27,8 +26,7 @@ def decode_VID_1_30_4_CFG(reg):
 
 def decode_SVID_1_30_4_CFG(reg):
   comment="specifies Intel® but can be set to any value once after reset"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -37,9 +35,8 @@ def decode_SVID_1_30_4_CFG(reg):
 
 def decode_CONFIG_TDP_LEVEL1(reg):
   comment="Level 1 configurable TDP settings"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,pkg_min_pwr,pkg_max_pwr,_,tdp_ratio,_,pkg_tdp= \
-    bitstruct.unpack("b1 u16 u15 u8 u8 b1 u15", reg)
+    bitfield.unpack("b1 u16 u15 u8 u8 b1 u15", reg)
   ro=red("RO")  
   line0="\t\t{0}\n".format(blue(comment))
   value="{0}".format(pkg_min_pwr*pcu["pwr_unit"])         
@@ -59,9 +56,8 @@ def decode_CONFIG_TDP_LEVEL1(reg):
 
 def decode_MCP_THERMAL_REPORT_2_CFG(reg):
   comment="the hottest absolute temp. of any component in the multi-chip package"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   package_absolute_max_temperature_high,package_absolute_max_temperature_low = \
-     bitstruct.unpack("p16 u10 s6", reg)
+     bitfield.unpack("p16 u10 s6", reg)
   ro=red("RO")  
   return "{0} {1}\t{2}".format(package_absolute_max_temperature_high,
                                package_absolute_max_temperature_low,blue(comment))
@@ -69,8 +65,7 @@ def decode_MCP_THERMAL_REPORT_2_CFG(reg):
 
 def decode_UNC_TSC_SNAPSHOT(reg):
   comment="Value of the captured Uncore TSC on internal rising edge of TSC_SYNC"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  uncore_tsc_snapshot= bitstruct.unpack("p1 u63", reg)[0]
+  uncore_tsc_snapshot= bitfield.unpack("p1 u63", reg)[0]
   ro=red("RO")  
   hexa="{0:08X}".format(uncore_tsc_snapshot)
   return "{0} {1}h\t{2}".format(ro, blue(hexa), blue(comment))
@@ -78,8 +73,7 @@ def decode_UNC_TSC_SNAPSHOT(reg):
 
 def decode_TSC_HP_OFFSET(reg):
   comment="BIOS may write here to update the TSC in the hot plugged socket"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  tsc_update,tsc_offset= bitstruct.unpack("b1 u63", reg)
+  tsc_update,tsc_offset= bitfield.unpack("b1 u63", reg)
   ro=red("RO")  
   if tsc_update:
     tsc=green("SET")
@@ -102,9 +96,8 @@ def decode_FLEX_RATIO(reg):
           "the value of FLEX_EN"
   wrapped=wrap(comment, 65)
   blued=[ blue(s) for s in wrapped ]
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
   _,oc_lock,oc_bins,enable,flex_ratio,oc_extra_voltage = \
-          bitstruct.unpack("u43 b1 u3 b1 u8 u8", reg)
+          bitfield.unpack("u43 b1 u3 b1 u8 u8", reg)
   ro=red("RO")  
   if oc_lock:
     line1="  \u251C "+ro+" OVERCLOCKING LOCK = " + red("LOCKED") + \
@@ -173,3 +166,15 @@ registers= [
   (0xF8, "PCU FIRST MCERR TSC LO"   , 4, "Low  4B of TSC snapshot taken on first internal MCERR"),
   (0xFC, "PCU FIRST MCERR TSC HI"   , 4, "High 4B of TSC snapshot taken on first internal MCERR"),
 ]
+
+# sampling interval (s) by offset, like PCU_CR0.sampling
+sampling= {
+  0x80: 10,     # GLOBAL NID SOCKET 4to7 MAP
+  0x84: 1,      # VIRAL CONTROL CFG
+  0x88: 1,      # PCU FIRST RMCA TSC LO
+  0x8C: 1,      # PCU FIRST RMCA TSC HI
+  0xF0: 1,      # PCU FIRST IERR TSC LO
+  0xF4: 1,      # PCU FIRST IERR TSC HI
+  0xF8: 1,      # PCU FIRST MCERR TSC LO
+  0xFC: 1,      # PCU FIRST MCERR TSC HI
+}
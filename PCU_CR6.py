@@ -4,7 +4,8 @@ import os
 import struct
 from textwrap import wrap
 import argparse
-import bitstruct
+import bitfield
+import layouts
 
 from useful_stuff import *
 
@@ -17,8 +18,7 @@ from useful_stuff import *
 ###################################################################################################
 def decode_VID_1_30_6_CFG(reg):
   comment="assigned by PCI-SIG to Intel"  
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -27,8 +27,7 @@ def decode_VID_1_30_6_CFG(reg):
 
 def decode_SVID_1_30_6_CFG(reg):
   comment="specifies Intel® but can be set to any value once after reset"
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  vendor_id = bitstruct.unpack("u16", reg)[0]
+  vendor_id = bitfield.unpack("u16", reg)[0]
   if vendor_id==0x8086:
     return "{0}\t\t{1}".format( bold(green("INTEL")), blue(comment) )
   else:
@@ -36,46 +35,42 @@ def decode_SVID_1_30_6_CFG(reg):
 
 
 def decode_PLATFORM_RAPL_LIMIT(reg):
-  reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-  lim_lock,_,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,_,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 = \
-    bitstruct.unpack("b1 u7 u2 u5 b1 b1 u15 u8 u2 u5 b1 b1 u15", reg)
-  if lim_lock:
+  limit=layouts.scale(layouts.PLATFORM_RAPL_LIMIT, layouts.decode(layouts.PLATFORM_RAPL_LIMIT, reg))
+  if limit["lim_lock"]:
     lock=red("LOCKED")
   else:
     lock=green("UNLOCKED")
 
-  if clmp_lim_2:
+  if limit["clmp_lim_2"]:
     clamp2=green("can go below P1")
   else:
     clamp2=red("is limited between P0 and P1")
 
-  if clmp_lim_1:
+  if limit["clmp_lim_1"]:
     clamp1=green("can go below P1")
   else:
     clamp1=red("is limited between P0 and P1")
 
-  if lim_2_en:
+  if limit["lim_2_en"]:
     pl2enable=red("ENABLED")
   else:
     pl2enable=green("DISABLED")
 
-  if lim_1_en:
+  if limit["lim_1_en"]:
     pl1enable=red("ENABLED")
   else:
     pl1enable=green("DISABLED")
 
-  time_window2=(1+lim_2_time_x/10)*2**lim_2_time_y
-  time_window1=(1+lim_1_time_x/10)*2**lim_1_time_y
   return "{0}\n" \
   "  PKG_PWR_LIM_2_TIME : {1:2.0f} s\t\tTime window over which Power_Limit_2 should be maintained\n" \
   "  PKG_PWR_LIM_2      : {2:3.0f} W ({3})\tPPL2/Package Power Limitation 2, always on\n" \
   "  PBM2               : {4}\n" \
   "  PKG_PWR_LIM_1_TIME : {5:2.1f} ms\t\tThe maximal time window is bounded by PKG_PWR_SKU_MSR[PKG_MAX_WIN]\n" \
   "  PKG_PWR_LIM_1      : {6:3.0f} W ({7})\tPPL1/Package Power Limitation 1\n" \
-  "  PBM1               : {8}".format(lock,time_window2*pcu["time_unit"],
-                                           lim_2       *pcu["pwr_unit"], pl2enable, clamp2,
-                                           time_window1*pcu["time_unit"]*1000,
-                                           lim_1       *pcu["pwr_unit"], pl1enable, clamp1)
+  "  PBM1               : {8}".format(lock,limit["time_window_2"],
+                                           limit["lim_2"], pl2enable, clamp2,
+                                           limit["time_window_1"]*1000,
+                                           limit["lim_1"], pl1enable, clamp1)
 
 
 registers= [
@@ -97,3 +92,8 @@ registers= [
   (0x3F, "Maximum latency"          , 1, "PCU has no specific requirements for how often it accesses PCI"),
   (0xA8, "PLATFORM RAPL LIMIT"      , 8, decode_PLATFORM_RAPL_LIMIT),
 ]
+
+# sampling interval (s) by offset, like PCU_CR0.sampling
+sampling= {
+  0xA8: 1,      # PLATFORM RAPL LIMIT
+}
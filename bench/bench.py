@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import struct
+import tempfile
+import argparse
+import threading
+import contextlib
+
+# the tools are flat scripts, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from useful_stuff import *
+import msr
+import pcu
+import mailboxes
+import ring
+import collector
+import topology
+import simulator
+import rate_analysis
+
+###################################################################################################
+#
+#  0. Benchmarks of the hot paths, against the simulated device tree (see simulator.py)
+#       config reads    : samples per second of 256 bytes reads, and of the collector read plan, per CR
+#       decodes         : decodes per second of each PCU_CR*.registers table
+#       display         : frames per second of pcu.update_display
+#       ring            : samples per second a collector worker publishes in place, and latest() reads
+#       mailbox         : mailboxes.command round trip latency per transport, p50 and p99
+#       sweep           : all CRs of all sockets, msr.snapshot of all CPUs and msr.package_snapshot,
+#                         for 1 to 16 sockets
+#
+###################################################################################################
+def rate(fn, duration):
+  """calls fn() for about duration seconds. returns calls per second"""
+  count=0
+  start=time.perf_counter()
+  end=start+duration
+  now=start
+  while now<end:
+    fn()
+    count+=1
+    now=time.perf_counter()
+  return count/(now-start)
+
+
+def percentile(samples, p):
+  ordered=sorted(samples)
+  return ordered[min(len(ordered)-1, int(p/100*len(ordered)))]
+
+
+def use_tree(sysroot):
+  """points every tool to sysroot. descriptors opened on the previous tree are dropped"""
+  backend["sysroot"]=sysroot
+  msr.close_msr_fds()
+  mailboxes.close_cr_fds()
+  mailboxes.clear_cache()
+  topology.forget()
+
+
+@contextlib.contextmanager
+def ticking(sysroot, rate_hz):
+  """keeps the simulated tree alive in a background thread"""
+  msr_fds,cr_fds=simulator.open_tree(sysroot)
+  stop=threading.Event()
+  def loop():
+    energy={}
+    last=time.monotonic()
+    while not stop.wait(1/rate_hz):
+      now=time.monotonic()
+      simulator.tick(msr_fds, cr_fds, energy, now-last)
+      last=now
+  t=threading.Thread(target=loop)
+  t.start()
+  try:
+    yield
+  finally:
+    stop.set()
+    t.join()
+    for fd in msr_fds+list(cr_fds.values()): os.close(fd)
+
+
+###################################################################################################
+#
+#  1. benchmarks
+#
+###################################################################################################
+def bench_reads(PCUTable, nCR, duration):
+  print(bold("config reads") + " (samples/s, one CR of socket 0)")
+  for cr in range(nCR):
+    path=sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(PCUTable[0], cr))
+    with open(path, "rb", buffering=0) as f:
+      def seek_read():
+        f.seek(0)
+        f.read(256)
+      legacy=rate(seek_read, duration)
+    fd=os.open(path, os.O_RDONLY)
+    pread=rate(lambda: os.pread(fd, 256, 0), duration)
+    plan=collector.read_plan(pcu.CRTable[cr], pcu.CRSampling[cr])
+    buffer=bytearray(256)
+    view=memoryview(buffer)
+    def planned():
+      for offset,size,interval in plan:
+        os.preadv(fd, [view[offset:offset+size]], offset)
+    planned_rate=rate(planned, duration)
+    os.close(fd)
+    print("  CR{0}   seek+read {1:10.0f}   pread {2:10.0f}   read plan {3:10.0f} ({4:3d} bytes, {5} preads)".format(
+          cr, legacy, pread, planned_rate, collector.plan_size(plan), len(plan)))
+
+
+def bench_decodes(PCUTable, nCR, duration):
+  print(bold("decodes") + " (decodes/s of the whole table, slowest register)")
+  for cr in range(nCR):
+    with open(sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(PCUTable[0], cr)), "rb") as f:
+      config=f.read(256)
+    decoders=[ (text, comment, bytearray(config[offset:offset+size]))
+               for offset,text,size,comment in pcu.CRTable[cr] if not isinstance(comment, str) ]
+    if not decoders:
+      continue
+    def decode_all():
+      for _,decoder,reg in decoders:
+        decoder(reg)
+    table=rate(decode_all, duration)
+    slowest=min( (rate(lambda: decoder(reg), duration/len(decoders)), text)
+                 for text,decoder,reg in decoders )
+    print("  CR{0}   {1:3d} decoders {2:10.0f}   slowest {3:10.0f}  {4}".format(
+          cr, len(decoders), table, slowest[0], slowest[1].strip()))
+
+
+def bench_display(PCUTable, nCR, duration):
+  print(bold("display") + " (frames/s of update_display, output to /dev/null)")
+  with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    results=[]
+    for cr in range(nCR):
+      with open(sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(PCUTable[0], cr)), "rb") as f:
+        config=f.read(256)
+      results.append( rate(lambda: pcu.update_display(config, pcu.CRTable[cr]), duration) )
+  for cr,frames in enumerate(results):
+    print("  CR{0}   {1:10.0f}".format(cr, frames))
+
+
+def bench_ring(PCUTable, duration):
+  print(bold("ring") + " (operations/s, CR0 of socket 0 into a {0} slots ring)".format(ring.NSLOT))
+  r=ring.create()
+  with open(sysfs("/sys/bus/pci/devices/{0}.0/config".format(PCUTable[0])), "rb", buffering=0) as f:
+    def publish():
+      seq,view=ring.begin(r)
+      f.seek(0)
+      f.readinto(view)
+      ring.commit(r, seq)
+    published=rate(publish, duration)
+  latest=rate(lambda: ring.latest(r), duration)
+  copied=rate(lambda: ring.copy(r), duration)
+  print("  publish {0:10.0f}   latest {1:10.0f}   copy {2:10.0f}".format(published, latest, copied))
+
+
+def bench_mailbox(sysroot, PCUTable, count, tick_rate):
+  print(bold("mailbox") + " (round trip per transport, simulator ticking at {0:g} Hz)".format(tick_rate))
+  targets={ "oc": 0, "bios": 0, "os": PCUTable[0], "bios_cr": PCUTable[0] }
+  # real round trips : no answer from the mailbox cache
+  caching=mailboxes.caching
+  mailboxes.caching=False
+  try:
+    with ticking(sysroot, tick_rate):
+      for transport,target in targets.items():
+        latencies=[]
+        for i in range(count):
+          start=time.perf_counter()
+          mailboxes.command(transport, 0x01, target=target)
+          latencies.append(time.perf_counter()-start)
+        print("  {0:7s} {1} round trips   p50 {2:9.3f} ms   p99 {3:9.3f} ms".format(
+              transport, count, percentile(latencies, 50)*1000, percentile(latencies, 99)*1000))
+  finally:
+    mailboxes.caching=caching
+  print("  "+msr.mailbox_report().replace("\n", "\n  "))
+
+
+def bench_sweep(root, sockets, cpus_per_socket, nCR, duration):
+  print(bold("sweep") + " (full passes/s : all CRs of all sockets, msr.snapshot of all CPUs, one CPU per package)")
+  for n in sockets:
+    sysroot=os.path.join(root, "sweep{}".format(n))
+    PCUTable=simulator.build(sysroot, n, n*cpus_per_socket, nCR)
+    use_tree(sysroot)
+    fds=[ os.open(sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(device, cr)), os.O_RDONLY)
+          for device in PCUTable for cr in range(nCR) ]
+    def sweep():
+      for fd in fds:
+        os.pread(fd, 256, 0)
+    configs=rate(sweep, duration)
+    for fd in fds: os.close(fd)
+    cpus=list(range(n*cpus_per_socket))
+    snapshots=rate(lambda: msr.snapshot(rate_analysis.ENERGY_MSRS, cpus), duration)
+    packages=rate(lambda: msr.package_snapshot(rate_analysis.ENERGY_MSRS), duration)
+    print("  {0:2d} sockets {1:5d} cpus   config {2:10.0f} ({3:8.0f} reads/s)   msr {4:8.0f}   per package {5:8.0f}".format(
+          n, len(cpus), configs, configs*len(fds), snapshots, packages))
+
+
+###################################################################################################
+#
+#  2. main
+#
+###################################################################################################
+def main():
+  parser = argparse.ArgumentParser(description="Benchmarks sampling, decoding and rendering against a simulated device tree.",
+           epilog="(c) 2023 HA Quoc Viet" )
+  parser.add_argument("--duration", type=float, default=.5, help="seconds per measurement")
+  parser.add_argument("--sockets",              default="1,2,4,8,16", help="socket counts of the sweep")
+  parser.add_argument("--cpus-per-socket", type=int, default=64)
+  parser.add_argument("--ncr",      type=int,   default=8)
+  parser.add_argument("--mailbox",  type=int,   default=20, help="number of mailbox round trips")
+  parser.add_argument("--tick",     type=float, default=1000, help="simulator tick rate, in Hz")
+  args=parser.parse_args()
+
+  with tempfile.TemporaryDirectory(prefix="pcu-bench-") as root:
+    sysroot=os.path.join(root, "base")
+    PCUTable=simulator.build(sysroot, 2, 2*args.cpus_per_socket, args.ncr)
+    use_tree(sysroot)
+    # the decoders need the RAPL units, as the live display would have them
+    PCU_CR0=pcu.PCU_CR0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+      with open(sysfs("/sys/bus/pci/devices/{0}.0/config".format(PCUTable[0])), "rb") as f:
+        PCU_CR0.decode_PACKAGE_POWER_SKU_UNIT_CFG(f.read(256)[0x8C:0x90])
+
+    bench_reads(PCUTable, args.ncr, args.duration)
+    bench_decodes(PCUTable, args.ncr, args.duration)
+    bench_display(PCUTable, args.ncr, args.duration)
+    bench_ring(PCUTable, args.duration)
+    bench_mailbox(sysroot, PCUTable, args.mailbox, args.tick)
+    bench_sweep(root, [ int(n) for n in args.sockets.split(",") ], args.cpus_per_socket, args.ncr, args.duration)
+    use_tree("")
+
+
+if __name__ == '__main__':
+  main()
@@ -17,11 +17,12 @@ import math
 import struct
 from textwrap import wrap
 import argparse
-import subprocess
-import bitstruct
+import bitfield
 
 from useful_stuff import *
 import msr
+import topology
+import mailboxes
 
 ###################################################################################################
 #
@@ -32,9 +33,7 @@ import msr
 debug=None
 NCPU=msr.count_cores()
 
-# MMIO interface ; currently not understood / unused
-BIOS_MAILBOX_DATA=0x8C
-BIOS_MAILBOX_INTERFACE=0x90
+# MMIO interface ; PCU CR1 8Ch data, 90h interface : mailboxes.TRANSPORTS["bios_cr"]
 
 # completion codes
 PASS                = 0x00
@@ -55,8 +54,7 @@ SVID_VR      = 0x18
 OC_INTERFACE = 0x37
 
 ############## OS MAILBOX ########################################################################
-OS_MAILBOX_DATA=0xA0
-OS_MAILBOX_INTERFACE=0xA4
+# PCU CR1 A0h data, A4h interface : mailboxes.TRANSPORTS["os"]
 
 # command codes for the OS MAILBOX
 CONFIG_TDP     = 0x7F
@@ -102,39 +100,19 @@ CLOS_PM_QOS_CONFIG       = 0x2
 
 def read(core=0):
   """
+     Waits for the command in flight at MSR 607h to complete.
      Read command, param1, param2 at MSR 607h
      data at 608h
      MSR are speudo files, where the user is supposed to seek to the msr number as offset,
-     then read a chunk of 8 bytes. Reading less can lead to an error. 
-     the msr number are not really offsets into a file, as 64 bit registers can follow
-     sequencially (example MSR 580h and 581h, all the while 32 bits MSR can also follow
-     sequentially. Hence, follow stricly the protocol : seek(msr), read(8).
-     returns the bytes straight from fd.read(4)
+     then read a chunk of 8 bytes. Reading less can lead to an error. mailboxes.py does so.
+     returns the low 4 bytes of each MSR
   """
-  mailbox_interface = 0x607                    # hardcoded interface MSR
-  mailbox_data      = 0x608                    # hardcoded data MSR
-  msrfile="/dev/cpu/{0:d}/msr".format(core)    # where is it mapped
-
-  with open(msrfile, "rb") as fd:
-    # we poll on the last bit
-    count=0
-    while count<20:
-      fd.seek(mailbox_interface)               # absolute positioning by default
-      chunk=fd.read(4)
-      if int.from_bytes(chunk, "little", signed=False)>>31 :
-        time.sleep(.1)                         # typical latency is 3 micro second per request
-      else: break
-      count+=1
-    # end while  
-    if count>=20:
-      sys.stderr.write("Could not read the BIOS_MAILBOX, leaving.\n")
-      sys.exit(1)
-    # general case  
-    chunk_interface=chunk
-    fd.seek(mailbox_data)
-    chunk_data=fd.read(4)
-      
-  return chunk_interface, chunk_data
+  try:
+    _,data,interface=mailboxes.complete("bios", core)
+  except Exception:
+    sys.stderr.write("Could not read the BIOS_MAILBOX, leaving.\n")
+    sys.exit(1)
+  return struct.pack("I", interface & 0xFFFFFFFF), struct.pack("I", data)
 
 
 
@@ -142,39 +120,17 @@ def write(param2, param1, command, data, core=0):
   """
      Write command, param1, param2 at MSR 607h
      Write data at 608h
-     MSR are speudo files, where the user is supposed to seek to the msr number as offset,
-     then read a chunk of 8 bytes. Reading less can lead to an error. 
-     the msr number are not really offsets into a file, as 64 bit registers can follow
-     sequencially (example MSR 580h and 581h, all the while 32 bits MSR can also follow
-     sequentially. Hence, follow stricly the protocol : seek(msr), read(size).
+     once the mailbox is idle. see read() for the completion
   """
-  mailbox_interface = 0x607                    # hardcoded interface MSR
-  mailbox_data      = 0x608                    # hardcoded data MSR
-  msrfile="/dev/cpu/{0:d}/msr".format(core)    # where is it mapped
-
-  with open(msrfile, "r+b") as fd:             # w+ erases, then opens. r+ opens for reading and writing 
-    # we poll on the last bit
-    count=0
-    while count<20:
-      fd.seek(mailbox_interface)
-      chunk=fd.read(4)                         # 4 fails. 8 fails. am giving up on the BIOS_MAILBOX, until i find out how to "unlock" it
-      if int.from_bytes(chunk, "little", signed=False)>>31 : time.sleep(.1)
-      else: break
-      count+=1
-    # end while  
-    if count>=20:
-      sys.stderr.write("Could not write {} to BIOS_MAILBOX, leaving.\n".format(buffer))
-      sys.exit(1)
-    # general case  
-    buffer=struct.pack("I", data)
-    fd.seek(mailbox_data)                      # absolute positioning to mailbox data MSR
-    fd.write(buffer)
-    buffer=struct.pack("BBBB", command, param1, param2, 0b10000000)
-    fd.seek(mailbox_interface)                 # absolute positioning to mailbox interface MSR
-    fd.write(buffer)
+  try:
+    interface=mailboxes.submit("bios", core, command, param1, param2, data)
+  except Exception:
+    sys.stderr.write("Could not write command {0:02X}h to BIOS_MAILBOX, leaving.\n".format(command))
+    sys.exit(1)
 
   # some debug on the terminal
   if debug:
+    buffer=struct.pack("<Q", interface)
     a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", buffer)
     hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
     sys.stdout.write("debug : write to BIOS_MAILBOX {0}h ( param2={1:02X} "\
@@ -184,37 +140,12 @@ def write(param2, param1, command, data, core=0):
 
 
 
-def wr_biosmailbox(param2, param1, command, data, core=0):
-  # 63 read busy
-  # 55-48 param2
-  # 47-40 param1
-  # 39-32 command / return code
-  # 31-00 data
-  # "I" is unsigned int size 4 bytes, for data
-  buffer =struct.pack("BBBBI", command, param1, param2, 0b10000000, data)
-  try:
-    msr.write_mailbox(0x607, 8, buffer, core)
-  except:
-    sys.stderr.write("Could not write {} to OC_MAILBOX, leaving.\n".format(buffer))
-    sys.exit(1)
-
-
-def rd_biosmailbox(core=0):
-  # 63 read busy
-  # 55-48 param2
-  # 47-40 param1
-  # 39-32 command / return code
-  # 31-00 data
-  try:
-    chunk=msr.read_mailbox(0x607, 8, core)
-  except:
-    sys.stderr.write("Could not read the BIOS_MAILBOX, leaving.\n")
-    sys.exit(1)
-  if debug:
-    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", chunk)
-    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
-    sys.stdout.write("debug : read frm BIOS_MAILBOX {0}h\n".format( blue(hexa)) )
-  return chunk
+def bios_command(command, sub_command, device):
+  """runs one BIOS mailbox command through PCU CR1 (8Ch data, 90h interface).
+  returns (interface written, interface read back, data read back)"""
+  mailbox_interface=mailboxes.submit("bios_cr", device, command, sub_command)
+  _,data,interface=mailboxes.complete("bios_cr", device)
+  return mailbox_interface, interface, data
 
 
 ###################################################################################################
@@ -230,22 +161,11 @@ def rd_biosmailbox(core=0):
 # 627270 Alder Lake, Raptor Lake, Twin Lake, Core and Uncore BIOS specification, rev 1.0.5i, page 45
 
 # SVID VR handler command 0x18 : sub command 0x0
-def GET_STRAP_CONFIGURATION(fd):
-  buffer=bitstruct.pack("b1 p2 p13 u8 u8", True, 0, SVID_VR)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( BIOS_MAILBOX_INTERFACE )
-  fd.write(mailbox_interface) ; fd.flush()
-  time.sleep(.01)
-
-  fd.seek( BIOS_MAILBOX_INTERFACE )
-  rd_chunk_interface=bitstruct.byteswap("4",fd.read(4))
+def GET_STRAP_CONFIGURATION(device):
+  mailbox_interface,rd_chunk_interface,rd_chunk_data=bios_command(SVID_VR, 0, device)
+  return_code=rd_chunk_interface & 0xFF
   # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-  return_code=struct.unpack("xxxB", rd_chunk_interface)[0]
-
-  fd.seek( BIOS_MAILBOX_DATA )
-  rd_chunk_data=bitstruct.byteswap("4",fd.read(4))
-  # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-  strap_config=bitstruct.unpack("p30 u2", rd_chunk_data)[0]
+  strap_config=bitfield.unpack_int("p30 u2", rd_chunk_data)[0]
 
 
   # special exit cases first
@@ -263,9 +183,9 @@ def GET_STRAP_CONFIGURATION(fd):
   print( "{0:24s} {1}:{2:08X} → {3:08X}:{4:08X} strap_config={5} ({6})".format(
             "GET_STRAP_CONFIGURATION",
             "--------",
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(rd_chunk_data,     'little',signed=False),
-            int.from_bytes(rd_chunk_interface,'little',signed=False),
+            mailbox_interface,
+            rd_chunk_data,
+            rd_chunk_interface,
             strap_config,
             result
             )
@@ -274,22 +194,11 @@ def GET_STRAP_CONFIGURATION(fd):
 
 
 # SVID VR handler command 0x18 : sub command 0x1
-def GET_ACDC_LOADLINE(fd):
-  buffer=bitstruct.pack("b1 p2 p13 u8 u8", True, 1, SVID_VR)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( BIOS_MAILBOX_INTERFACE )
-  fd.write(mailbox_interface) ; fd.flush()
-  time.sleep(.01)
-
-  fd.seek( BIOS_MAILBOX_INTERFACE )
-  rd_chunk_interface=bitstruct.byteswap("4",fd.read(4))
-  # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-  return_code=struct.unpack("xxxB", rd_chunk_interface)[0]
-
-  fd.seek( BIOS_MAILBOX_DATA )
-  rd_chunk_data=bitstruct.byteswap("4",fd.read(4))
+def GET_ACDC_LOADLINE(device):
+  mailbox_interface,rd_chunk_interface,rd_chunk_data=bios_command(SVID_VR, 1, device)
+  return_code=rd_chunk_interface & 0xFF
   # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-  dc_loadline,ac_loadline=bitstruct.unpack("u16 u16", rd_chunk_data)
+  dc_loadline,ac_loadline=bitfield.unpack_int("u16 u16", rd_chunk_data)
 
   factor=math.pow(2,20)
   dc_loadline/=factor
@@ -298,8 +207,8 @@ def GET_ACDC_LOADLINE(fd):
   print( "{0:24s} {1}:{2:08X} → {3:08X}:{4} ac_loadline={5}mΩ dc_loadline={6}mΩ".format(
             "GET_ACDC_LOADLINE",
             "--------",
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(rd_chunk_data,     'little',signed=False),
+            mailbox_interface,
+            rd_chunk_data,
             "--------",
             ac_loadline,
             dc_loadline
@@ -308,35 +217,22 @@ def GET_ACDC_LOADLINE(fd):
   return ac_loadline,dc_loadline
 
 # SVID VR blindly launch all functions, looking for non zero output
-def SVIDVRloop(fd):
+def SVIDVRloop(device):
   for n in [ (SVID_VR,0),(SVID_VR,1), (SVID_VR,5), (SVID_VR,7), (SVID_VR,9), (SVID_VR,0xA), (SVID_VR,0x13), (SVID_VR,0x18), (SVID_VR,0x1C), (SVID_VR,0x24),
              (0x19,0), ( 0x19,1),( 0x19,2),( 0x19,3),( 0x19,4),( 0x19,5),( 0x19,6),( 0x19,7),( 0x19,8),
              (0x37,4),
              (0x50,0), (0x1C, 0), (0x1F,0),
              (0x2E,0),(0x2E,1),(0x2E,2),(0x2E,3)]:  
     command,sub_command = n  
-    buffer=bitstruct.pack("b1 p2 p13 u8 u8", True, sub_command, command)
-    mailbox_interface=bitstruct.byteswap("4",buffer)
-    fd.seek( BIOS_MAILBOX_INTERFACE )
-    fd.write(mailbox_interface) ; fd.flush()
-    time.sleep(.01)
-  
-    fd.seek( BIOS_MAILBOX_INTERFACE )
-    rd_chunk_interface=bitstruct.byteswap("4",fd.read(4))
-    # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-    return_code=struct.unpack("xxxB", rd_chunk_interface)[0]
-  
-    fd.seek( BIOS_MAILBOX_DATA )
-    rd_chunk_data=bitstruct.byteswap("4",fd.read(4))
-    # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-    # dc_loadline,ac_loadline=bitstruct.unpack("u16 u16", rd_chunk_data)
+    mailbox_interface,rd_chunk_interface,rd_chunk_data=bios_command(command, sub_command, device)
+    return_code=rd_chunk_interface & 0xFF
   
     print( "{0:24s} {1}:{2:08X} → {3:08X}:{4:08X}".format(
               "READ [{},{}]".format(command,sub_command),
               "--------",
-              int.from_bytes(mailbox_interface, 'little',signed=False),
-              int.from_bytes(rd_chunk_data,     'little',signed=False),
-              int.from_bytes(rd_chunk_interface,'little',signed=False)
+              mailbox_interface,
+              rd_chunk_data,
+              rd_chunk_interface
               )
          )
   return
@@ -347,30 +243,17 @@ def SVIDVRloop(fd):
 # 819915 Arrow Lake PTG June 2024
 
 # OC_INTERFACE command 0x37 : sub command 0x0
-def READ_OC_MISC_CONFIG(fd):
+def READ_OC_MISC_CONFIG(device):
   for sub_command in [ 0, 2, 4, 6, 8, 0x12, 0x16, 0x18, 0x1A ]:
-    buffer=bitstruct.pack("b1 p2 p13 u8 u8", True, sub_command, OC_INTERFACE)
-    mailbox_interface=bitstruct.byteswap("4",buffer)
-    fd.seek( BIOS_MAILBOX_INTERFACE )
-    fd.write(mailbox_interface) ; fd.flush()
-    time.sleep(.01)
-  
-    fd.seek( BIOS_MAILBOX_INTERFACE )
-    rd_chunk_interface=bitstruct.byteswap("4",fd.read(4))
-    # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-    return_code=struct.unpack("xxxB", rd_chunk_interface)[0]
-  
-    fd.seek( BIOS_MAILBOX_DATA )
-    rd_chunk_data=bitstruct.byteswap("4",fd.read(4))
-    # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-    # dc_loadline,ac_loadline=bitstruct.unpack("u16 u16", rd_chunk_data)
+    mailbox_interface,rd_chunk_interface,rd_chunk_data=bios_command(OC_INTERFACE, sub_command, device)
+    return_code=rd_chunk_interface & 0xFF
   
     print( "{0:24s} {1}:{2:08X} → {3:08X}:{4:08X}".format(
               "READ_OC-{}".format(sub_command),
               "--------",
-              int.from_bytes(mailbox_interface, 'little',signed=False),
-              int.from_bytes(rd_chunk_data,     'little',signed=False),
-              int.from_bytes(rd_chunk_interface,'little',signed=False)
+              mailbox_interface,
+              rd_chunk_data,
+              rd_chunk_interface
               )
          )
   return
@@ -381,17 +264,12 @@ def READ_OC_MISC_CONFIG(fd):
 #
 ###################################################################################################
 
-def os_mailbox_GET_LEVELS_INFO(fd):
+def os_mailbox_GET_LEVELS_INFO(device):
   # This command allows software to discover Intel® SST-PP information.
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_LEVELS_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( OS_MAILBOX_INTERFACE )
-  fd.write(mailbox_interface) ; fd.flush()
-  time.sleep(.1)
-  fd.seek(OS_MAILBOX_DATA)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_LEVELS_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_LEVELS_INFO, target=device)
   config_tdpe,_,lock,current_config_tdp_level,config_tdp_levels,version=\
-          bitstruct.unpack("b1 u6 b1 u8 u8 u8", chunk0)
+          bitfield.unpack_int("b1 u6 b1 u8 u8 u8", chunk0)
   result=""       
   if config_tdpe: result=green("CONFIG_TDP is supported")
   else:           result=red  ("CONFIG_TDP is not supported")
@@ -400,8 +278,8 @@ def os_mailbox_GET_LEVELS_INFO(fd):
   print( "{0:24s} {1}:{2:08X} → {3:08X}:-------- level={4}/{5} {6}".format(
             "GET_LEVELS_INFO",
             "--------",
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0, 'little',signed=False),
+            mailbox_interface,
+            chunk0,
             current_config_tdp_level,
             config_tdp_levels,
             result
@@ -409,148 +287,95 @@ def os_mailbox_GET_LEVELS_INFO(fd):
         )
 
 
-def os_mailbox_GET_TDP_INFO(tdp_level, fd):
-  fd.seek( OS_MAILBOX_DATA)
-
-  buffer=bitstruct.pack("u24 u8", 0, tdp_level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_data)
-
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_TDP_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_interface)
-
-  time.sleep(.1)
-  fd.seek(OS_MAILBOX_DATA)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
-  _,tdp_ratio,pkg_tdp=bitstruct.unpack("u9 u8 u15", chunk0)
+def os_mailbox_GET_TDP_INFO(tdp_level, device):
+  mailbox_data=tdp_level
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_TDP_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_TDP_INFO, data=mailbox_data, target=device)
+  _,tdp_ratio,pkg_tdp=bitfield.unpack_int("u9 u8 u15", chunk0)
   print( "{0:24s} {1:08X}:{2:08X} → {3:08X}:-------- TDP_RATIO={4} PKG_TDP={5}W".format( "GET_TDP_INFO[{}]".format(tdp_level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0, 'little',signed=False),
+            mailbox_data,
+            mailbox_interface,
+            chunk0,
             tdp_ratio,
             pkg_tdp
             )
         )
   
 
-def os_mailbox_SET_LEVEL(tdp_lock, level, fd):
+def os_mailbox_SET_LEVEL(tdp_lock, level, device):
   # Selects Intel® SST-PP level. BIOS and software must use this mailbox command to
   # select an Intel® SST-PP config level. Activates a specified ConfigTDP level (0, 3 or 4).
   # CPU returns error if the LOCK bit is set in the CONFIG_TDP_CONTROL MSR/CFG
   # register
-  buffer=bitstruct.pack("u7 b1 u16 u8", 0, tdp_lock, 0, level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, SET_LEVEL, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( OS_MAILBOX_DATA )
-  fd.write(mailbox_data)
-  fd.write(mailbox_interface)
-  time.sleep(.1)
-  fd.seek(OS_MAILBOX_DATA)
-  print( "{0:24s} {1:08X}:{2:08X} → {3:016X} No output".format( "SET_LEVEL({})".format(level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(fd.read(8), 'little',signed=False) ) )
-
-
-def os_mailbox_GET_PWR_INFO(tdp_level, fd):  
+  mailbox_data=int.from_bytes(bitfield.pack("u7 b1 u16 u8", 0, tdp_lock, 0, level), "little")
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, SET_LEVEL)
+  return_code,chunk0=mailboxes.command("os", CONFIG_TDP, SET_LEVEL, data=mailbox_data, target=device)
+  print( "{0:24s} {1:08X}:{2:08X} → {3:08X}:{4:08X} No output ({5})".format( "SET_LEVEL({})".format(level),
+            mailbox_data,
+            mailbox_interface,
+            chunk0,
+            return_code,
+            mailboxes.completion("os", return_code) ) )
+
+
+def os_mailbox_GET_PWR_INFO(tdp_level, device):  
   # Although there are no new definitions of SKUs for min and max power associated with
   # the new Intel® SST-PP levels, pcode defaults them to the legacy values and supports a
   # notion of min and max power with the new Intel® SST-PP levels.
-  fd.seek( OS_MAILBOX_DATA)
-
-  buffer=bitstruct.pack("u24 u8", 0, tdp_level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_data)
-
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_PWR_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_interface)
-
-  time.sleep(.1)
-
-  fd.seek(OS_MAILBOX_DATA)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
-  _,MIN_PWR,MAX_PWR=bitstruct.unpack("u2 u15 u15", chunk0)
+  mailbox_data=tdp_level
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_PWR_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_PWR_INFO, data=mailbox_data, target=device)
+  _,MIN_PWR,MAX_PWR=bitfield.unpack_int("u2 u15 u15", chunk0)
   print( "{0:24s} {1:08X}:{2:08X} → {3:08X}:-------- MIN_PWR={4:3.0f}W MAX_PWR={5:3.0f}W".format(
             "GET_PWR_INFO({})".format(tdp_level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0, 'little',signed=False),
+            mailbox_data,
+            mailbox_interface,
+            chunk0,
             MIN_PWR/8,
             MAX_PWR/8) )
 
 
-def os_mailbox_GET_TJMAX_INFO(tdp_level,fd):  
+def os_mailbox_GET_TJMAX_INFO(tdp_level,device):  
   # This command allows software to discover the DTS max (also referred as Tprochot or
   # Tjmax) of the selected SST-PP level.
-  fd.seek( OS_MAILBOX_DATA)
-
-  buffer=bitstruct.pack("u24 u8", 0, tdp_level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_data) ; fd.flush()
-
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_TJMAX_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_interface)
-
-  time.sleep(.1)
-  fd.seek(OS_MAILBOX_DATA)
-  tjmax=fd.read(1)
+  mailbox_data=tdp_level
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_TJMAX_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_TJMAX_INFO, data=mailbox_data, target=device)
+  tjmax=chunk0 & 0xFF
   print( "{0:24s} {1:08X}:{2:08X} → ------{3:02X}:-------- {3}°C".format(
             "GET_TJMAX_INFO({})".format(tdp_level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(tjmax, 'little',signed=False)
+            mailbox_data,
+            mailbox_interface,
+            tjmax
             )
         )
 
 
-
-def READ_TJMAX_OVERRIDE(fd):  
+def READ_TJMAX_OVERRIDE(device):  
   # A new knob for Tjmax temp to be programmable. This will allow BIOS mailbox command
   # to program Tjmax temp via BIOS knob.
   # New BIOS mailbox command required. BIOS will use the BIOS to pCode mail box
   # command to change the Tjmax temp value. 
   # 751210 SPR PTG 3.1.1.2.1 Tjmax temp overide
-  buffer=bitstruct.pack("b1 p2 p13 u8 u8", True, 0, 0xA5)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( BIOS_MAILBOX_INTERFACE )
-  fd.write(mailbox_interface) ; fd.flush()
-  time.sleep(.01)
-
-  fd.seek( BIOS_MAILBOX_INTERFACE )
-  rd_chunk_interface=bitstruct.byteswap("4",fd.read(4))
-  # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-  return_code=struct.unpack("xxxB", rd_chunk_interface)[0]
-
-  fd.seek( BIOS_MAILBOX_DATA )
-  rd_chunk_data=bitstruct.byteswap("4",fd.read(4))
-  # <<<HSB       p padding   b boolean   u unsigned int   s signed int    LSB<<<
-  # dc_loadline,ac_loadline=bitstruct.unpack("u16 u16", rd_chunk_data)
+  mailbox_interface,rd_chunk_interface,rd_chunk_data=bios_command(0xA5, 0, device)
+  return_code=rd_chunk_interface & 0xFF
 
   print( "{0:24s} {1}:{2:08X} → {3:08X}:{4:08X}".format(
             "READ TJMAX_OVERRIDE",
             "--------",
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(rd_chunk_data,     'little',signed=False),
-            int.from_bytes(rd_chunk_interface,'little',signed=False)
+            mailbox_interface,
+            rd_chunk_data,
+            rd_chunk_interface
             )
        )
 
 
 
-def os_mailbox_READ_PM_CONFIG(pm_feature, fd):
+def os_mailbox_READ_PM_CONFIG(pm_feature, device):
   """This command allows software to discover Intel® SST-CP capability and current state."""  
-  buffer=bitstruct.pack("b1 u2 p13 u8 u8", True, 0, pm_feature, READ_PM_CONFIG)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( OS_MAILBOX_INTERFACE )
-  fd.write(mailbox_interface) ; fd.flush()
-  time.sleep(.1)
-  fd.seek(OS_MAILBOX_DATA)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
-  sst_cp_state,sst_cp_capability=bitstruct.unpack("u16 u16", chunk0)
+  mailbox_interface=mailboxes.interface_word("os", READ_PM_CONFIG, pm_feature)
+  _,chunk0=mailboxes.command("os", READ_PM_CONFIG, pm_feature, target=device)
+  sst_cp_state,sst_cp_capability=bitfield.unpack_int("u16 u16", chunk0)
   if sst_cp_state==1:
     CP_STATE=green("SST CP is enabled")
   else:    
@@ -562,8 +387,8 @@ def os_mailbox_READ_PM_CONFIG(pm_feature, fd):
   print( "{0:24s} {1}:{2:08X} → {3:08X}:-------- {4} {5}".format(
             "READ_PM_CONFIG({})".format(pm_feature),
             "--------",
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0,'little',signed=False),
+            mailbox_interface,
+            chunk0,
             CP_STATE,
             CP_CAPABILITY
             )
@@ -571,6 +396,75 @@ def os_mailbox_READ_PM_CONFIG(pm_feature, fd):
 
 
 
+###################################################################################################
+#
+#  2ter. Intel® SST-PP inventory of all the sockets
+#        every command of every socket is queued at once (mailboxes.queue) : each PCU works on
+#        its own queue, in parallel with the others
+#
+###################################################################################################
+SST_PP_LEVELS=[ 0, 3, 4 ]
+
+def os_mailbox_inventory(PCUTable, levels=SST_PP_LEVELS):
+  """GET_LEVELS_INFO of each socket, then GET_TDP_INFO, GET_PWR_INFO and GET_TJMAX_INFO of each level.
+  prints one line per socket and level, returns { device: { "current_level", "lock", "levels" } }"""
+  start=time.perf_counter()
+  futures={}
+  for device in PCUTable:
+    futures[device]=mailboxes.queue("os", CONFIG_TDP, GET_LEVELS_INFO, target=device)
+    for level in levels:
+      for sub_command in [ GET_TDP_INFO, GET_PWR_INFO, GET_TJMAX_INFO ]:
+        futures[device, level, sub_command]=mailboxes.queue("os", CONFIG_TDP, sub_command, data=level, target=device)
+
+  inventory={}
+  print( "{0:6s} {1:12s} {2:5s} {3:>9s} {4:>9s} {5:>9s} {6:>9s} {7:>6s}".format(
+         "socket", "PCU", "level", "TDP_RATIO", "PKG_TDP", "MIN_PWR", "MAX_PWR", "TJMAX") )
+  for socket,device in enumerate(PCUTable):
+    try:
+      return_code,chunk0=futures[device].result()
+    except Exception as e:
+      print( "{0:<6d} {1:12s} {2}".format(socket, device, red(str(e))) )
+      continue
+    if return_code!=PASS:
+      print( "{0:<6d} {1:12s} {2}".format(socket, device, red(mailboxes.completion("os", return_code))) )
+      continue
+    config_tdpe,_,lock,current_config_tdp_level,config_tdp_levels,version=\
+            bitfield.unpack_int("b1 u6 b1 u8 u8 u8", chunk0)
+    inventory[device]={ "current_level": current_config_tdp_level, "lock": lock, "levels": {} }
+
+    for level in levels:
+      # a level that times out or does not PASS is reported, not decoded
+      answers=[]
+      error=None
+      for sub_command in [ GET_TDP_INFO, GET_PWR_INFO, GET_TJMAX_INFO ]:
+        try:
+          return_code,chunk=futures[device, level, sub_command].result()
+        except Exception as e:
+          error=str(e)
+          break
+        if return_code!=PASS:
+          error="sub command {0:02X}h : {1}".format(sub_command, mailboxes.completion("os", return_code))
+          break
+        answers.append(chunk)
+      if error is not None:
+        print( "{0:<6d} {1:12s} {2:5d} {3}".format(socket, device, level, red(error)) )
+        continue
+      tdp,pwr,tjmax=answers
+      _,tdp_ratio,pkg_tdp=bitfield.unpack_int("u9 u8 u15", tdp)
+      _,MIN_PWR,MAX_PWR=bitfield.unpack_int("u2 u15 u15", pwr)
+      inventory[device]["levels"][level]={ "tdp_ratio": tdp_ratio, "pkg_tdp": pkg_tdp,
+                                           "min_pwr": MIN_PWR/8, "max_pwr": MAX_PWR/8, "tjmax": tjmax & 0xFF }
+      line="{0:<6d} {1:12s} {2:5d} {3:9d} {4:8d}W {5:8.0f}W {6:8.0f}W {7:5d}°C".format(
+           socket, device, level, tdp_ratio, pkg_tdp, MIN_PWR/8, MAX_PWR/8, tjmax & 0xFF )
+      if level==current_config_tdp_level: line=bold(line)
+      print(line)
+
+  print( "{0} sockets, {1} commands in {2:.1f} ms".format(
+         len(PCUTable), len(futures), (time.perf_counter()-start)*1000) )
+  return inventory
+
+
+
 # note pour plus tard  
   """
     # discover the intel sst_pp level
@@ -582,7 +476,7 @@ def os_mailbox_READ_PM_CONFIG(pm_feature, fd):
     fd.seek(OS_MAILBOX_DATA)
     print( "{0:24s} {1:08X}:{2:08X} → {3:016X}".format( "GET_CONFIG_TDP_CONTROL",
               int.from_bytes(mailbox_data, 'little',signed=False),
-              int.from_bytes(mailbox_interface, 'little',signed=False),
+              mailbox_interface,
               int.from_bytes(fd.read(8), 'little',signed=False) ) )
 
     # enable/disable SST-BF and/or SST-TF
@@ -596,7 +490,7 @@ def os_mailbox_READ_PM_CONFIG(pm_feature, fd):
     fd.seek(OS_MAILBOX_DATA)
     print( "{0:24s} {1:08X}:{2:08X} → {3:016X}".format( "GET_LEVELS_INFO",
               int.from_bytes(mailbox_data, 'little',signed=False),
-              int.from_bytes(mailbox_interface, 'little',signed=False),
+              mailbox_interface,
               int.from_bytes(fd.read(8), 'little',signed=False) ) )
 """
 ###################################################################################################
@@ -616,6 +510,11 @@ def init():
                   "HA Quoc Viet <quoc-viet.ha@eviden.com>" )
 
   parser.add_argument("--debug",  "-g", action="store_true", default=False)
+  parser.add_argument("--cache",  "-c", action="store_true", default=False,
+           help="keeps the fused and SKU answers of the mailboxes on disk until the next reboot "
+                "(see mailboxes.CACHE_FILE)")
+  parser.add_argument("--inventory", "-i", action="store_true", default=False,
+           help="prints the SST-PP levels of all the sockets, then leaves")
   parser.add_argument("--device", "-d",                      default="0000:7f:1e",
            help="Device to read. Defaults to first module, first socket. "\
            "Use \"lspci -n | grep 3258\" to find yours. "
@@ -624,24 +523,9 @@ def init():
   # let's read the MSR_RAPL_POWER_UNIT to initialize the fundamental units
   msr.init()
 
-  # discover where the PCUs are
-  # dirty version using lspci. don't blame me, I have 10min before a meeting
-  PCUTable=[]
-  commande=[ "lspci", "-s", "1e.0" ] 
-  p=subprocess.Popen( commande, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, universal_newlines=True )
-  # typical output, here on 8S :
-  #0000:3f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:7f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:bf:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:ff:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:3f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:7f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:bf:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:ff:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  for dataline in p.stdout:
-    if dataline.strip("\n ") == "": continue
-    PCUTable.append( dataline.split()[0][:-2] )  # cutting ".0" out
+  # discover where the PCUs are, from sysfs (see topology.py)
   # [ "0000:3f:1e", "0000:7f:1e", .... ]
+  PCUTable=topology.pcus()
   return parser.parse_args(),PCUTable
 
 
@@ -654,63 +538,69 @@ if __name__ == '__main__':
 
   args,PCUTable=init()
   debug = args.debug
+  mailboxes.debug = debug
+  if args.cache: mailboxes.persist_cache()
+
+  if args.inventory:
+    os_mailbox_inventory(PCUTable)
+    sys.exit(0)
 
   # hardcoded to CPU0 and RC1
-  with open("/sys/bus/pci/devices/{0}.1/config".format(PCUTable[0]),"r+b", buffering=0) as fd:
-    """
-    os_mailbox_GET_LEVELS_INFO(fd)
-    os_mailbox_GET_TDP_INFO(0, fd)
-    # get info for each TDP levels
-    os_mailbox_GET_TJMAX_INFO(0,fd)  
-    os_mailbox_GET_PWR_INFO(0,fd)
-    os_mailbox_GET_PWR_INFO(3,fd)
-    os_mailbox_GET_PWR_INFO(4,fd)
-    os_mailbox_SET_LEVEL(False, 0, fd)
-    os_mailbox_GET_LEVELS_INFO(fd)
-    os_mailbox_GET_PWR_INFO(0,fd)
-    os_mailbox_GET_PWR_INFO(3,fd)
-    os_mailbox_GET_PWR_INFO(4,fd)
-    os_mailbox_SET_LEVEL(False, 3, fd)
-    os_mailbox_GET_LEVELS_INFO(fd)
-    os_mailbox_GET_PWR_INFO(0,fd)
-    os_mailbox_GET_PWR_INFO(3,fd)
-    os_mailbox_GET_PWR_INFO(4,fd)
-    os_mailbox_SET_LEVEL(False, 4, fd)
-    os_mailbox_GET_LEVELS_INFO(fd)
-    os_mailbox_GET_PWR_INFO(0,fd)
-    os_mailbox_GET_PWR_INFO(3,fd)
-    os_mailbox_GET_PWR_INFO(4,fd)
-
-    print('-'*15 + " second take " + '-'*15)
+  device=PCUTable[0]
+  """
+  os_mailbox_GET_LEVELS_INFO(device)
+  os_mailbox_GET_TDP_INFO(0, device)
+  # get info for each TDP levels
+  os_mailbox_GET_TJMAX_INFO(0,device)  
+  os_mailbox_GET_PWR_INFO(0,device)
+  os_mailbox_GET_PWR_INFO(3,device)
+  os_mailbox_GET_PWR_INFO(4,device)
+  os_mailbox_SET_LEVEL(False, 0, device)
+  os_mailbox_GET_LEVELS_INFO(device)
+  os_mailbox_GET_PWR_INFO(0,device)
+  os_mailbox_GET_PWR_INFO(3,device)
+  os_mailbox_GET_PWR_INFO(4,device)
+  os_mailbox_SET_LEVEL(False, 3, device)
+  os_mailbox_GET_LEVELS_INFO(device)
+  os_mailbox_GET_PWR_INFO(0,device)
+  os_mailbox_GET_PWR_INFO(3,device)
+  os_mailbox_GET_PWR_INFO(4,device)
+  os_mailbox_SET_LEVEL(False, 4, device)
+  os_mailbox_GET_LEVELS_INFO(device)
+  os_mailbox_GET_PWR_INFO(0,device)
+  os_mailbox_GET_PWR_INFO(3,device)
+  os_mailbox_GET_PWR_INFO(4,device)
+
+  print('-'*15 + " second take " + '-'*15)
 # EDS p182 10.6.2 Config TDP 1 and 2 functionality
 # 1. The BIOS/SW discovers Intel® SST-PP capability via GET_LEVELS_INFO mailbox
-    os_mailbox_GET_LEVELS_INFO(fd)
+  os_mailbox_GET_LEVELS_INFO(device)
 # 2. The BIOS/SW can discover the P1 ratios via GET_P1_INFO mailbox. Note that the
 #    configuration index supported are 0, 3 and 4. (the 0, 1 and 2 performance levels
 #    previously used are now combined to provided ratios for SSE, Intel® AVX2 and
 #    Intel® AVX3)
-    os_mailbox_GET_PWR_INFO(0,fd)
+  os_mailbox_GET_PWR_INFO(0,device)
 # 3. The BIOS/SW writes the P1 ratio via FLEX_RATIO MSR.
-    msr.read_VR_CURRENT_CONFIG(core=0)
-    msr.read_FLEX_RATIO(core=0)
-    # OC_lock=False ocbins=0 flexenable=True flexratio=23  246mV 
-    msr.write_FLEX_RATIO(False,0,True,23,246,core=0)
-    msr.read_FLEX_RATIO(core=0)
+  msr.read_VR_CURRENT_CONFIG(core=0)
+  msr.read_FLEX_RATIO(core=0)
+  # OC_lock=False ocbins=0 flexenable=True flexratio=23  246mV 
+  msr.write_FLEX_RATIO(False,0,True,23,246,core=0)
+  msr.read_FLEX_RATIO(core=0)
 # 4. The BIOS/SW writes the min ICCP [SST-CP] license to pre-grant a license using the
 #    WRITE_PM_CONFIG mailbox.
-    os_mailbox_READ_PM_CONFIG(0, fd)
-    os_mailbox_READ_PM_CONFIG(1, fd)
-    os_mailbox_READ_PM_CONFIG(2, fd)
-    os_mailbox_READ_PM_CONFIG(3, fd)
-    """
+  os_mailbox_READ_PM_CONFIG(0, device)
+  os_mailbox_READ_PM_CONFIG(1, device)
+  os_mailbox_READ_PM_CONFIG(2, device)
+  os_mailbox_READ_PM_CONFIG(3, device)
+  """
 # 5. Investigating the BIOS mailbox
-    GET_STRAP_CONFIGURATION(fd)
-    GET_ACDC_LOADLINE(fd)
-    READ_OC_MISC_CONFIG(fd)
-    SVIDVRloop(fd)
-    print("RPL PTG 747256 : read/write tjmaxoffset p79 9.26.2 BIOS MAIL BOX COMMAND")
-    READ_TJMAX_OVERRIDE(fd)
-    # CF RPL PTG 747256 page 79 9.26.2
-    # i am trying to change tj max offset 
-    # for which msr 1A2h will show the actual effect of the bios_mailbox
-    msr.read_TEMPERATURE_TARGET(0)
+  GET_STRAP_CONFIGURATION(device)
+  GET_ACDC_LOADLINE(device)
+  READ_OC_MISC_CONFIG(device)
+  SVIDVRloop(device)
+  print("RPL PTG 747256 : read/write tjmaxoffset p79 9.26.2 BIOS MAIL BOX COMMAND")
+  READ_TJMAX_OVERRIDE(device)
+  # CF RPL PTG 747256 page 79 9.26.2
+  # i am trying to change tj max offset 
+  # for which msr 1A2h will show the actual effect of the bios_mailbox
+  msr.read_TEMPERATURE_TARGET(0)
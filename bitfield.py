@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+import re
+
+try:
+  import numpy
+except ImportError:
+  numpy=None
+
+###################################################################################################
+#
+#  0. Precompiled bitfield layouts
+#     A layout is written the bitstruct way, most significant field first :
+#        "b1 u7 u2 u5 b1 b1 u15 u8 u2 u5 b1 b1 u15"
+#     but it is parsed only once, into a table of (kind, shift, mask), and cached by format.
+#     Registers are then decoded from a plain int, with shifts and masks, instead of
+#     bitstruct.byteswap() + bitstruct.unpack() re-parsing the format on every refresh.
+#
+###################################################################################################
+
+# format string -> (number of bits, ( (kind, shift, mask), ... ))
+layouts={}
+
+
+def layout(fmt):
+  """returns the compiled layout of fmt, compiling it on first use.
+  supported kinds : p (padding), u (unsigned), s (signed), b (boolean)"""
+  compiled=layouts.get(fmt)
+  if compiled is not None:
+    return compiled
+
+  if re.sub(r"[pubs]\d+", "", fmt).strip()!="":
+    raise ValueError("unsupported bitfield format \"{}\"".format(fmt))
+
+  widths=[ (kind, int(width)) for kind,width in re.findall(r"([pubs])(\d+)", fmt) ]
+  nbits=sum( width for _,width in widths )
+  fields=[]
+  position=nbits
+  for kind,width in widths:
+    position-=width
+    if kind!="p":
+      fields.append( (kind, position, (1<<width)-1) )
+
+  compiled=(nbits, tuple(fields))
+  layouts[fmt]=compiled
+  return compiled
+
+
+def unpack_int(fmt, value):
+  """decodes an int holding exactly the bits of fmt. returns a tuple, padding excluded"""
+  _,fields=layout(fmt)
+  result=[]
+  for kind,shift,mask in fields:
+    field=(value>>shift)&mask
+    if kind=="b":
+      field=bool(field)
+    elif kind=="s" and field>(mask>>1):
+      field-=mask+1
+    result.append(field)
+  return tuple(result)
+
+
+def unpack(fmt, reg):
+  """decodes reg, the little endian bytes read from a register.
+  same result as bitstruct.unpack(fmt, bitstruct.byteswap(str(len(reg)), reg)) :
+  when fmt is shorter than reg, the fields are taken from the most significant bits"""
+  nbits,_=layout(fmt)
+  value=int.from_bytes(reg, "little", signed=False)
+  return unpack_int(fmt, value>>(8*len(reg)-nbits))
+
+
+def unpack_named(fmt, names, value):
+  """decodes an int into a dict { name: field }. names skips the padding fields"""
+  return dict(zip(names, unpack_int(fmt, value)))
+
+
+def pack(fmt, *values):
+  """encodes values into little endian bytes, ready to be written to a register.
+  same result as bitstruct.byteswap(str(n), bitstruct.pack(fmt, *values))"""
+  nbits,fields=layout(fmt)
+  value=0
+  for (kind,shift,mask),field in zip(fields, values):
+    value|=(int(field)&mask)<<shift
+  nbytes=(nbits+7)//8
+  return (value<<(8*nbytes-nbits)).to_bytes(nbytes, "little", signed=False)
+
+
+def unpack_array(fmt, words, nbytes=8):
+  """decodes N samples at once. words holds the raw registers of nbytes bytes, as integers
+  (e.g. a numpy uint64 array). returns a tuple of numpy arrays, one per field, padding excluded"""
+  if numpy is None:
+    raise ImportError("bitfield.unpack_array() needs numpy")
+  nbits,fields=layout(fmt)
+  words=numpy.asarray(words, dtype=numpy.uint64)>>numpy.uint64(8*nbytes-nbits)
+  result=[]
+  for kind,shift,mask in fields:
+    field=(words>>numpy.uint64(shift))&numpy.uint64(mask)
+    if kind=="b":
+      field=field.astype(bool)
+    elif kind=="s":
+      field=field.astype(numpy.int64)
+      field=numpy.where(field>(mask>>1), field-(mask+1), field)
+    result.append(field)
+  return tuple(result)
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+import os
+import mmap
+import struct
+
+try:
+  import numpy
+except ImportError:
+  numpy=None
+
+###################################################################################################
+#
+#  0. Capture file : raw config space snapshots, appended one after the other
+#     header (4 KiB)  : magic, version, nCR, nPCU, record size, RAPL units, then PCUTable
+#     one record      : monotonic timestamp (ns), socket index in PCUTable, CR number, 256 raw bytes
+#     records are 272 bytes long, so that the timestamps stay 8 bytes aligned. Since the header
+#     is one page, the records can be mapped with mmap and read with numpy.frombuffer, no copy.
+#
+###################################################################################################
+MAGIC=b"PCUCAPT\0"
+VERSION=1
+HEADER_SIZE=4096
+HEADER=struct.Struct("<8sHHHHddd")
+CONFIG_SIZE=256
+RECORD=struct.Struct("<QHH4x{}s".format(CONFIG_SIZE))
+
+if numpy is not None:
+  RECORD_DTYPE=numpy.dtype( [ ("timestamp", "<u8"),
+                              ("socket"   , "<u2"),
+                              ("cr"       , "<u2"),
+                              (""         , "V4"),
+                              ("config"   , "u1", (CONFIG_SIZE,)) ] )
+
+
+def pack_header(nCR, PCUTable, units):
+  """returns the header bytes. units is a dict like useful_stuff.pcu"""
+  header=HEADER.pack(MAGIC, VERSION, nCR, len(PCUTable), RECORD.size,
+                     units["energy_unit"], units["time_unit"], units["pwr_unit"])
+  header+="\n".join(PCUTable).encode("ascii")
+  if len(header)>HEADER_SIZE:
+    raise ValueError("capture header : PCUTable too long")
+  return header+bytes(HEADER_SIZE-len(header))
+
+
+def unpack_header(data):
+  """decodes the header bytes into a dict { nCR, PCUTable, units }"""
+  magic,version,nCR,nPCU,record_size,energy_unit,time_unit,pwr_unit=HEADER.unpack_from(data)
+  if magic!=MAGIC:
+    raise ValueError("not a PCU capture file")
+  if version!=VERSION or record_size!=RECORD.size:
+    raise ValueError("unsupported capture version {0} (record size {1})".format(version, record_size))
+  PCUTable=data[HEADER.size:HEADER_SIZE].rstrip(b"\0").decode("ascii").split("\n")[:nPCU]
+  return { "nCR": nCR,
+           "PCUTable": PCUTable,
+           "units": { "energy_unit": energy_unit, "time_unit": time_unit, "pwr_unit": pwr_unit } }
+
+
+def open_writer(path, nCR, PCUTable, units, buffering=1<<20):
+  """opens path for appending records. writes the header of a new file,
+  checks that an existing file was recorded on the same PCUs"""
+  f=open(path, "ab", buffering=buffering)
+  size=f.tell()
+  if size==0:
+    f.write(pack_header(nCR, PCUTable, units))
+    return f
+  try:
+    with open(path, "rb") as g:
+      data=g.read(HEADER_SIZE)
+    if size<HEADER_SIZE:
+      # a header cut short by a crash : start over, but only on a capture file
+      if not data.startswith(MAGIC):
+        raise ValueError("{} is not a PCU capture file".format(path))
+      f.truncate(0)
+      f.write(pack_header(nCR, PCUTable, units))
+      return f
+    header=unpack_header(data)
+    if header["nCR"]!=nCR or header["PCUTable"]!=list(PCUTable):
+      raise ValueError("{} was recorded on other PCUs".format(path))
+  except:
+    f.close()
+    raise
+  # a record cut short by a crash or Ctrl+C would shift every record appended after it
+  f.truncate(size-(size-HEADER_SIZE)%RECORD.size)
+  return f
+
+
+def pack_record(buffer, index, timestamp, socket, cr, config):
+  """writes one record at position index (counted in records) of buffer"""
+  RECORD.pack_into(buffer, index*RECORD.size, timestamp, socket, cr, config)
+
+
+def iter_records(f):
+  """yields (timestamp, socket, cr, config) for each record of an opened capture file"""
+  f.seek(HEADER_SIZE)
+  while True:
+    data=f.read(RECORD.size)
+    if len(data)<RECORD.size:
+      return
+    yield RECORD.unpack(data)
+
+
+###################################################################################################
+#
+#  1. memory mapped reader. needs numpy
+#
+###################################################################################################
+def load(path):
+  """maps a capture file. returns (header, records), records being a numpy structured array
+  (timestamp, socket, cr, config) that reads straight from the page cache.
+  a partially written last record is ignored"""
+  if numpy is None:
+    raise ImportError("capture.load() needs numpy")
+  with open(path, "rb") as f:
+    size=os.fstat(f.fileno()).st_size
+    if size<HEADER_SIZE:
+      raise ValueError("{} : truncated capture header".format(path))
+    mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  header=unpack_header(mm[:HEADER_SIZE])
+  count=(size-HEADER_SIZE)//RECORD.size
+  # the array keeps a reference on mm : the mapping lives as long as the records
+  records=numpy.frombuffer(mm, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE)
+  return header, records
+
+
+def series(records, socket, cr, offset, size):
+  """slices one register across time. returns (timestamps in ns, raw values as uint64),
+  ready for layouts.decode_array()"""
+  selected=records[ (records["socket"]==socket) & (records["cr"]==cr) ]
+  raw=numpy.zeros( (len(selected), 8), dtype=numpy.uint8 )
+  raw[:, :size]=selected["config"][:, offset:offset+size]
+  return selected["timestamp"], raw.view("<u8").ravel()
+
+
+def frame_count(header, records):
+  """number of complete frames. one frame = one record per CR of each PCU, PCU major"""
+  return len(records)//(header["nCR"]*len(header["PCUTable"]))
+
+
+def frame_timestamps(header, records):
+  """timestamp of the first record of each frame"""
+  n=header["nCR"]*len(header["PCUTable"])
+  return records["timestamp"][:frame_count(header, records)*n:n]
+
+
+def frame(header, records, index, socket):
+  """the nCR*256 bytes of config space of one PCU in frame #index, laid out like pcu.py config"""
+  nCR=header["nCR"]
+  base=(index*len(header["PCUTable"])+socket)*nCR
+  return records["config"][base:base+nCR].tobytes()
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+import os
+import time
+import threading
+
+from useful_stuff import *
+import ring
+
+###################################################################################################
+#
+#  0. Collector : samples the config space of every CR of every PCU, all the time, into one ring
+#     per (socket, CR) (see ring.py). The display only picks which ring to decode : switching
+#     sockets shows warm data, and every socket keeps a history.
+#     The (socket, CR) pairs are dealt round robin to a few worker threads, in the calling process :
+#     a pread of the config space releases the GIL, no need for processes. A worker opens its
+#     config files once, then reads them in place into the rings, every period seconds.
+#     The rings are still RawArrays, so that a child process can consume them as well.
+#
+###################################################################################################
+PERIOD=.02   # 50Hz, for the registers without a sampling interval of their own
+WORKERS=4    # threads, by default
+
+
+def config_path(device, cr):
+  return sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(device, cr))
+
+
+###################################################################################################
+#
+#  1. Read plan : the kernel turns a config space read into one PCI config cycle per dword, so
+#     each tick only reads the dwords a register table decodes, in as few preads as possible.
+#     The PCI header (below 0x40 : vendor and device ID, class, header type, ...) is fixed, but for
+#     COMMAND and STATUS : it's read once, with the rest of the config space, into every slot of
+#     the ring when the worker starts. Offsets no table decodes keep that first value too.
+#     Each register is read at its own interval : the sampling dict of its PCU_CR* module, else
+#     period. Only registers of the same interval are coalesced.
+#
+###################################################################################################
+HEADER_END=0x40
+HEADER_VOLATILE=[ (0x04, 4) ]   # COMMAND, STATUS
+DWORD=4
+MAX_GAP=8       # two ranges closer than this are read at once : a dword cycle is cheaper than a pread
+
+
+def read_plan(registers, sampling=None, period=PERIOD):
+  """[ (offset, size, interval), ... ] : the dword aligned, coalesced ranges to read, each every
+  interval seconds. registers is a PCU_CR*.registers table, sampling its { offset: interval }"""
+  sampling=sampling or {}
+  ranges=[]
+  for offset,text,size,comment in registers:
+    if size==0:
+      continue
+    if offset<HEADER_END and not any( start<=offset<start+length for start,length in HEADER_VOLATILE ):
+      continue
+    start=offset//DWORD*DWORD
+    end=-(-(offset+size)//DWORD)*DWORD
+    ranges.append( (sampling.get(offset, period), start, min(end, ring.SLOT_SIZE)) )
+
+  plan=[]
+  for interval,start,end in sorted(ranges):
+    if plan and plan[-1][2]==interval and start-plan[-1][1]<=MAX_GAP:
+      plan[-1][1]=max(plan[-1][1], end)
+    else:
+      plan.append([start, end, interval])
+  return sorted( (start, end-start, interval) for start,end,interval in plan )
+
+
+def plan_size(plan):
+  """bytes read when every range is due"""
+  return sum( size for offset,size,interval in plan )
+
+
+def plan_rate(plan):
+  """bytes read per second, before any back off"""
+  return sum( size/interval for offset,size,interval in plan )
+
+
+###################################################################################################
+#
+#  2. Workers : adaptive scheduler
+#     every range has a due date. A worker wakes up for the earliest one, then publishes a new
+#     sample for each (socket, CR) with ranges due : a copy of the previous sample, with the due
+#     ranges read again on top. A range that read the same bytes as last time waits twice as
+#     long next time, up to BACKOFF times its interval ; any change brings it back to its interval.
+#
+###################################################################################################
+BACKOFF=8
+
+
+def schedule(plan, now):
+  """the mutable state of a plan : [ [ offset, size, interval, current interval, due ], ... ]"""
+  return [ [ offset, size, interval, interval, now ] for offset,size,interval in plan ]
+
+
+def sample(fd, r, ranges, now):
+  """reads the ranges due at now into a new sample of ring r.
+  returns (seq, view, [ (offset, size) read, ... ]), None when none was due"""
+  due=[ entry for entry in ranges if entry[4]<=now ]
+  if not due:
+    return None
+  seq,view=ring.begin(r)
+  previous=ring.slot_view(r, (seq-1)%r["nslot"])
+  view[:]=previous
+  for entry in due:
+    offset,size,interval,current,_=entry
+    os.preadv(fd, [view[offset:offset+size]], offset)   # straight into the slot, no seek
+    if view[offset:offset+size]==previous[offset:offset+size]:
+      current=min(current*2, interval*BACKOFF)
+    else:
+      current=interval
+    entry[3]=current
+    entry[4]=max(entry[4]+current, now)    # when late, skip the missed periods
+  return seq, view, [ (entry[0], entry[1]) for entry in due ]
+
+
+def worker(pairs, done, period, on_sample=None):
+  """pairs : [ (socket, device, cr, ring, plan), ... ] sampled until done is set.
+  plan None : the whole config space, every period seconds.
+  on_sample(socket, cr, view, timestamp, ranges) is called with each new sample, before it's
+  published, e.g. energy.feed"""
+  fds=[]
+  now=time.monotonic()
+  for socket,device,cr,r,plan in pairs:
+    fd=os.open(config_path(device, cr), os.O_RDONLY)
+    # the static part of each slot, once
+    config=os.pread(fd, ring.SLOT_SIZE, 0)
+    for slot in range(r["nslot"]):
+      ring.slot_view(r, slot)[:len(config)]=config
+    # published as the first sample : a CR without a plan has that one only
+    seq,view=ring.begin(r)
+    timestamp=time.monotonic_ns()
+    if on_sample is not None: on_sample(socket, cr, view, timestamp, None)
+    ring.commit(r, seq, timestamp)
+    fds.append( (socket, cr, fd, r, schedule([ (0, ring.SLOT_SIZE, period) ] if plan is None else plan, now)) )
+
+  while True:
+    now=time.monotonic()
+    for socket,cr,fd,r,ranges in fds:
+      new=sample(fd, r, ranges, now)
+      if new is None:
+        continue
+      seq,view,read=new
+      timestamp=time.monotonic_ns()
+      if on_sample is not None: on_sample(socket, cr, view, timestamp, read)
+      ring.commit(r, seq, timestamp)
+    wakeup=min( [ entry[4] for _,_,_,_,ranges in fds for entry in ranges ] or [ now+period ] )
+    if done.wait(max(0, wakeup-time.monotonic())):
+      break
+  for _,_,fd,_,_ in fds: os.close(fd)
+
+
+def start(PCUTable, nCR, period=PERIOD, workers=None, tables=None, sampling=None, on_sample=None):
+  """creates the rings and starts the workers. tables : the register table of each CR, e.g.
+  pcu.CRTable, to read only what they decode ; None reads the whole config space. sampling :
+  the { offset: interval } of each CR, e.g. pcu.CRSampling. on_sample : see worker. returns :
+     { "rings": [ [ ring of CR0, ... ] of socket 0, ... ], "done": Event, "workers": [ Thread, ... ],
+       "plans": [ plan of CR0, ... ] }"""
+  rings=[ [ ring.create() for cr in range(nCR) ] for device in PCUTable ]
+  plans=[ None if tables is None else read_plan(tables[cr], sampling and sampling[cr], period) for cr in range(nCR) ]
+  pairs=[ (socket, device, cr, rings[socket][cr], plans[cr]) for socket,device in enumerate(PCUTable) for cr in range(nCR) ]
+  workers=max(1, min(workers or WORKERS, len(pairs)))
+
+  done=threading.Event()
+  threads=[ threading.Thread( target=worker, args=(pairs[w::workers], done, period, on_sample), daemon=True )
+            for w in range(workers) ]
+  for t in threads: t.start()
+  return { "rings": rings, "done": done, "workers": threads, "plans": plans }
+
+
+def stop(collector):
+  collector["done"].set()
+  for t in collector["workers"]: t.join()
@@ -6,10 +6,12 @@ import time
 import struct
 from textwrap import wrap
 import argparse
-import subprocess
 import bitstruct
+import bitfield
 
 import msr
+import topology
+import mailboxes
 
 ###################################################################################################
 #
@@ -19,8 +21,7 @@ import msr
 
 debug=None
 
-MAILBOX_DATA_OFFSET=0xA0
-MAILBOX_INTERFACE_OFFSET=0xA4
+# PCU CR1 A0h data, A4h interface : mailboxes.TRANSPORTS["os"]
 
 # command codes for the OS MAILBOX
 CONFIG_TDP     = 0x7F
@@ -102,17 +103,12 @@ def rdmsr(offset, size ):
     return msrfile.read(size)
 
 
-def mailbox_GET_LEVELS_INFO(fd):
+def mailbox_GET_LEVELS_INFO(device):
   # This command allows software to discover Intel® SST-PP information.
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_LEVELS_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( MAILBOX_INTERFACE_OFFSET )
-  fd.write(mailbox_interface) ; fd.flush()
-  time.sleep(.1)
-  fd.seek(MAILBOX_DATA_OFFSET)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_LEVELS_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_LEVELS_INFO, target=device)
   config_tdpe,_,lock,current_config_tdp_level,config_tdp_levels,version=\
-          bitstruct.unpack("b1 u6 b1 u8 u8 u8", chunk0)
+          bitfield.unpack_int("b1 u6 b1 u8 u8 u8", chunk0)
   result=""       
   if config_tdpe: result=green("CONFIG_TDP is supported")
   else:           result=red  ("CONFIG_TDP is not supported")
@@ -121,8 +117,8 @@ def mailbox_GET_LEVELS_INFO(fd):
   print( "{0:24s} {1}:{2:08X} -> {3:08X}:-------- level={4}/{5} {6}".format(
             "GET_LEVELS_INFO",
             "--------",
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0, 'little',signed=False),
+            mailbox_interface,
+            chunk0,
             current_config_tdp_level,
             config_tdp_levels,
             result
@@ -130,114 +126,75 @@ def mailbox_GET_LEVELS_INFO(fd):
         )
 
 
-def mailbox_GET_TDP_INFO(tdp_level, fd):
-  fd.seek( MAILBOX_DATA_OFFSET)
-
-  buffer=bitstruct.pack("u24 u8", 0, tdp_level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_data)
-
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_TDP_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_interface)
-
-  time.sleep(.1)
-  fd.seek(MAILBOX_DATA_OFFSET)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
-  _,tdp_ratio,pkg_tdp=bitstruct.unpack("u9 u8 u15", chunk0)
+def mailbox_GET_TDP_INFO(tdp_level, device):
+  mailbox_data=tdp_level
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_TDP_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_TDP_INFO, data=mailbox_data, target=device)
+  _,tdp_ratio,pkg_tdp=bitfield.unpack_int("u9 u8 u15", chunk0)
   print( "{0:24s} {1:08X}:{2:08X} -> {3:08X}:-------- TDP_RATIO={4} PKG_TDP={5}W".format( "GET_TDP_INFO[{}]".format(tdp_level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0, 'little',signed=False),
+            mailbox_data,
+            mailbox_interface,
+            chunk0,
             tdp_ratio,
             pkg_tdp
             )
         )
   
 
-def mailbox_SET_LEVEL(tdp_lock, level, fd):
+def mailbox_SET_LEVEL(tdp_lock, level, device):
   # Selects Intel® SST-PP level. BIOS and software must use this mailbox command to
   # select an Intel® SST-PP config level. Activates a specified ConfigTDP level (0, 3 or 4).
   # CPU returns error if the LOCK bit is set in the CONFIG_TDP_CONTROL MSR/CFG
   # register
-  buffer=bitstruct.pack("u7 b1 u16 u8", 0, tdp_lock, 0, level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, SET_LEVEL, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( MAILBOX_DATA_OFFSET )
-  fd.write(mailbox_data)
-  fd.write(mailbox_interface)
-  time.sleep(.1)
-  fd.seek(MAILBOX_DATA_OFFSET)
-  print( "{0:24s} {1:08X}:{2:08X} -> {3:016X} No output".format( "SET_LEVEL({})".format(level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(fd.read(8), 'little',signed=False) ) )
-
-
-def mailbox_GET_PWR_INFO(tdp_level, fd):  
+  mailbox_data=int.from_bytes(bitfield.pack("u7 b1 u16 u8", 0, tdp_lock, 0, level), "little")
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, SET_LEVEL)
+  return_code,chunk0=mailboxes.command("os", CONFIG_TDP, SET_LEVEL, data=mailbox_data, target=device)
+  print( "{0:24s} {1:08X}:{2:08X} -> {3:08X}:{4:08X} No output ({5})".format( "SET_LEVEL({})".format(level),
+            mailbox_data,
+            mailbox_interface,
+            chunk0,
+            return_code,
+            mailboxes.completion("os", return_code) ) )
+
+
+def mailbox_GET_PWR_INFO(tdp_level, device):  
   # Although there are no new definitions of SKUs for min and max power associated with
   # the new Intel® SST-PP levels, pcode defaults them to the legacy values and supports a
   # notion of min and max power with the new Intel® SST-PP levels.
-  fd.seek( MAILBOX_DATA_OFFSET)
-
-  buffer=bitstruct.pack("u24 u8", 0, tdp_level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_data)
-
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_PWR_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_interface)
-
-  time.sleep(.1)
-
-  fd.seek(MAILBOX_DATA_OFFSET)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
-  _,MIN_PWR,MAX_PWR=bitstruct.unpack("u2 u15 u15", chunk0)
+  mailbox_data=tdp_level
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_PWR_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_PWR_INFO, data=mailbox_data, target=device)
+  _,MIN_PWR,MAX_PWR=bitfield.unpack_int("u2 u15 u15", chunk0)
   print( "{0:24s} {1:08X}:{2:08X} -> {3:08X}:-------- MIN_PWR={4:3.0f}W MAX_PWR={5:3.0f}W".format(
             "GET_PWR_INFO({})".format(tdp_level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0, 'little',signed=False),
+            mailbox_data,
+            mailbox_interface,
+            chunk0,
             MIN_PWR/8,
             MAX_PWR/8) )
 
 
-def mailbox_GET_TJMAX_INFO(tdp_level,fd):  
+def mailbox_GET_TJMAX_INFO(tdp_level,device):  
   # This command allows software to discover the DTS max (also referred as Tprochot or
   # Tjmax) of the selected SST-PP level.
-  fd.seek( MAILBOX_DATA_OFFSET)
-
-  buffer=bitstruct.pack("u24 u8", 0, tdp_level)
-  mailbox_data=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_data) ; fd.flush()
-
-  buffer=bitstruct.pack("b1 u2 u21 u8", True, 0, GET_TJMAX_INFO, CONFIG_TDP)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.write(mailbox_interface)
-
-  time.sleep(.1)
-  fd.seek(MAILBOX_DATA_OFFSET)
-  tjmax=fd.read(1)
+  mailbox_data=tdp_level
+  mailbox_interface=mailboxes.interface_word("os", CONFIG_TDP, GET_TJMAX_INFO)
+  _,chunk0=mailboxes.command("os", CONFIG_TDP, GET_TJMAX_INFO, data=mailbox_data, target=device)
+  tjmax=chunk0 & 0xFF
   print( "{0:24s} {1:08X}:{2:08X} -> ------{3:02X}:-------- {3}°C".format(
             "GET_TJMAX_INFO({})".format(tdp_level),
-            int.from_bytes(mailbox_data, 'little',signed=False),
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(tjmax, 'little',signed=False)
+            mailbox_data,
+            mailbox_interface,
+            tjmax
             )
         )
 
 
-def mailbox_READ_PM_CONFIG(pm_feature, fd):
+def mailbox_READ_PM_CONFIG(pm_feature, device):
   """This command allows software to discover Intel® SST-CP capability and current state."""  
-  buffer=bitstruct.pack("b1 u2 p13 u8 u8", True, 0, pm_feature, READ_PM_CONFIG)
-  mailbox_interface=bitstruct.byteswap("4",buffer)
-  fd.seek( MAILBOX_INTERFACE_OFFSET )
-  fd.write(mailbox_interface) ; fd.flush()
-  time.sleep(.1)
-  fd.seek(MAILBOX_DATA_OFFSET)
-  chunk0=bitstruct.byteswap("4",fd.read(4))
-  sst_cp_state,sst_cp_capability=bitstruct.unpack("u16 u16", chunk0)
+  mailbox_interface=mailboxes.interface_word("os", READ_PM_CONFIG, pm_feature)
+  _,chunk0=mailboxes.command("os", READ_PM_CONFIG, pm_feature, target=device)
+  sst_cp_state,sst_cp_capability=bitfield.unpack_int("u16 u16", chunk0)
   if sst_cp_state==1:
     CP_STATE=green("SST CP is enabled")
   else:    
@@ -249,8 +206,8 @@ def mailbox_READ_PM_CONFIG(pm_feature, fd):
   print( "{0:24s} {1}:{2:08X} -> {3:08X}:-------- {4} {5}".format(
             "READ_PM_CONFIG({})".format(pm_feature),
             "--------",
-            int.from_bytes(mailbox_interface, 'little',signed=False),
-            int.from_bytes(chunk0,'little',signed=False),
+            mailbox_interface,
+            chunk0,
             CP_STATE,
             CP_CAPABILITY
             )
@@ -298,24 +255,9 @@ def init():
 
   parser.add_argument("--debug",  "-g", action="store_true", default=False)
   
-  # discover where the PCUs are
-  # dirty version using lspci. don't blame me, I have 10min before a meeting
-  PCUTable=[]
-  commande=[ "lspci", "-s", "1e.0" ] 
-  p=subprocess.Popen( commande, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, universal_newlines=True )
-  # typical output, here on 8S :
-  #0000:3f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:7f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:bf:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:ff:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:3f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:7f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:bf:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:ff:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  for dataline in p.stdout:
-    if dataline.strip("\n ") == "": continue
-    PCUTable.append( dataline.split()[0][:-2] )  # cutting ".0" out
+  # discover where the PCUs are, from sysfs (see topology.py)
   # [ "0000:3f:1e", "0000:7f:1e", .... ]
+  PCUTable=topology.pcus()
   return parser.parse_args(),PCUTable
 
 
@@ -329,54 +271,55 @@ def main():
 
   args,PCUTable=init()
   debug = args.debug
+  mailboxes.debug = debug
 
   # hardcoded to CPU0 and RC1
-  with open("/sys/bus/pci/devices/{0}.1/config".format(PCUTable[0]),"r+b", buffering=0) as fd:
-
-    mailbox_GET_LEVELS_INFO(fd)
-    mailbox_GET_TDP_INFO(0, fd)
-    # get info for each TDP levels
-    mailbox_GET_TJMAX_INFO(0,fd)  
-    mailbox_GET_PWR_INFO(0,fd)
-    mailbox_GET_PWR_INFO(3,fd)
-    mailbox_GET_PWR_INFO(4,fd)
-    mailbox_SET_LEVEL(False, 0, fd)
-    mailbox_GET_LEVELS_INFO(fd)
-    mailbox_GET_PWR_INFO(0,fd)
-    mailbox_GET_PWR_INFO(3,fd)
-    mailbox_GET_PWR_INFO(4,fd)
-    mailbox_SET_LEVEL(False, 3, fd)
-    mailbox_GET_LEVELS_INFO(fd)
-    mailbox_GET_PWR_INFO(0,fd)
-    mailbox_GET_PWR_INFO(3,fd)
-    mailbox_GET_PWR_INFO(4,fd)
-    mailbox_SET_LEVEL(False, 4, fd)
-    mailbox_GET_LEVELS_INFO(fd)
-    mailbox_GET_PWR_INFO(0,fd)
-    mailbox_GET_PWR_INFO(3,fd)
-    mailbox_GET_PWR_INFO(4,fd)
-
-    print('-'*15 + " second take " + '-'*15)
+  device=PCUTable[0]
+
+  mailbox_GET_LEVELS_INFO(device)
+  mailbox_GET_TDP_INFO(0, device)
+  # get info for each TDP levels
+  mailbox_GET_TJMAX_INFO(0,device)  
+  mailbox_GET_PWR_INFO(0,device)
+  mailbox_GET_PWR_INFO(3,device)
+  mailbox_GET_PWR_INFO(4,device)
+  mailbox_SET_LEVEL(False, 0, device)
+  mailbox_GET_LEVELS_INFO(device)
+  mailbox_GET_PWR_INFO(0,device)
+  mailbox_GET_PWR_INFO(3,device)
+  mailbox_GET_PWR_INFO(4,device)
+  mailbox_SET_LEVEL(False, 3, device)
+  mailbox_GET_LEVELS_INFO(device)
+  mailbox_GET_PWR_INFO(0,device)
+  mailbox_GET_PWR_INFO(3,device)
+  mailbox_GET_PWR_INFO(4,device)
+  mailbox_SET_LEVEL(False, 4, device)
+  mailbox_GET_LEVELS_INFO(device)
+  mailbox_GET_PWR_INFO(0,device)
+  mailbox_GET_PWR_INFO(3,device)
+  mailbox_GET_PWR_INFO(4,device)
+
+  print('-'*15 + " second take " + '-'*15)
 # EDS p182 10.6.2 Config TDP 1 and 2 functionality
 # 1. The BIOS/SW discovers Intel® SST-PP capability via GET_LEVELS_INFO mailbox
-    mailbox_GET_LEVELS_INFO(fd)
+  mailbox_GET_LEVELS_INFO(device)
 # 2. The BIOS/SW can discover the P1 ratios via GET_P1_INFO mailbox. Note that the
 #    configuration index supported are 0, 3 and 4. (the 0, 1 and 2 performance levels
 #    previously used are now combined to provided ratios for SSE, Intel® AVX2 and
 #    Intel® AVX3)
-    mailbox_GET_PWR_INFO(0,fd)
+  mailbox_GET_PWR_INFO(0,device)
 # 3. The BIOS/SW writes the P1 ratio via FLEX_RATIO MSR.
-    msr.read_VR_CURRENT_CONFIG(core=0)
-    msr.read_FLEX_RATIO(core=0)
-    # OC_lock=False ocbins=0 flexenable=True flexratio=23  246mV 
-    msr.write_FLEX_RATIO(False,0,True,23,246,core=0)
-    msr.read_FLEX_RATIO(core=0)
+  msr.read_VR_CURRENT_CONFIG(core=0)
+  msr.read_FLEX_RATIO(core=0)
+  # OC_lock=False ocbins=0 flexenable=True flexratio=23  246mV 
+  msr.write_FLEX_RATIO(False,0,True,23,246,core=0)
+  msr.read_FLEX_RATIO(core=0)
 # 4. The BIOS/SW writes the min ICCP [SST-CP] license to pre-grant a license using the
 #    WRITE_PM_CONFIG mailbox.
-    mailbox_READ_PM_CONFIG(0, fd)
-    mailbox_READ_PM_CONFIG(1, fd)
-    mailbox_READ_PM_CONFIG(2, fd)
-    mailbox_READ_PM_CONFIG(3, fd)
+  mailbox_READ_PM_CONFIG(0, device)
+  mailbox_READ_PM_CONFIG(1, device)
+  mailbox_READ_PM_CONFIG(2, device)
+  mailbox_READ_PM_CONFIG(3, device)
 
 if __name__ == '__main__':
   main()
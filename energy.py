@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+
+import time
+import collections
+
+from useful_stuff import *
+
+###################################################################################################
+#
+#  0. Energy accounting, per (socket, counter)
+#     the ENERGY STATUS registers are 32 bits counters, in pcu["energy_unit"], that wrap around
+#     every few minutes under load. Each raw sample comes with its time.monotonic_ns() timestamp :
+#     the increment since the previous sample, modulo 2**32, is added to a total that never wraps.
+#     Power is that total over the real elapsed time, on a window of at least WINDOW seconds,
+#     whatever the sampling rate, and for every socket at once.
+#     A counter must be sampled more often than it wraps : a gap longer than that loses 2**32 units.
+#     MSR 612h PACKAGE ENERGY TIME STATUS comes with its own clock : the hardware elapsed time, in
+#     pcu["time_unit"], in its upper 32 bits. update_timed() divides by that time instead : no
+#     scheduling jitter nor GC pause in the readings, which allows windows of a few ms.
+#     The throttle counters (see section 2) are integrated the same way, in pcu["time_unit"].
+#
+###################################################################################################
+MASK=0xFFFFFFFF
+WINDOW=.1          # s, the shortest time a power reading is averaged on
+
+# the counters the collector feeds : (CR, offset) -> name
+COUNTERS={ (0, 0x90): "package",     # PACKAGE ENERGY STATUS
+           (0, 0x88): "pp0",         # PRIMARY PLANE ENERGY STATUS
+           (2, 0x80): "dram" }       # DRAM ENERGY STATUS, counted in the package energy unit, like rate_analysis
+
+# { (socket, name): { "raw", "ns", "total", "window_ns", "window_total", "power", "windows" } }
+# the "power" of a throttle counter is the share of time it counted, 0 to 1
+# update_timed() counts time in hardware ticks : "ticks", "time", "window_time" instead of ns
+# each entry is only ever written by the collector worker that samples its (socket, CR)
+counters={}
+
+# the socket on display : the decoders of PCU_CR0 report its counters
+displayed=0
+
+
+def update(socket, name, raw, timestamp=None, unit="energy_unit"):
+  """accounts for a new raw value of a counter, read at timestamp (time.monotonic_ns()).
+  unit : the pcu unit it counts in. returns the state of the counter"""
+  timestamp=time.monotonic_ns() if timestamp is None else timestamp
+  state=counters.get( (socket, name) )
+  if state is None or timestamp<state["ns"]:
+    # first sample, or time went backwards (a replay seeking back) : start over
+    state={ "raw": raw, "ns": timestamp, "total": 0, "window_ns": timestamp, "window_total": 0,
+            "power": None, "windows": 0 }
+    counters[(socket, name)]=state
+    return state
+
+  state["total"]+=(raw-state["raw"])&MASK
+  state["raw"]=raw
+  state["ns"]=timestamp
+  elapsed=timestamp-state["window_ns"]
+  if elapsed>=WINDOW*1e9:
+    state["power"]=(state["total"]-state["window_total"])*pcu[unit]/(elapsed/1e9)
+    state["window_ns"]=timestamp
+    state["window_total"]=state["total"]
+    state["windows"]+=1
+  return state
+
+
+def update_timed(socket, name, raw, window=WINDOW):
+  """accounts for a new raw value of MSR 612h PACKAGE ENERGY TIME STATUS : elapsed time in
+  the upper 32 bits, energy in the lower 32 bits. Power is averaged on at least window seconds
+  of hardware time. returns the state of the counter, its "windows" count goes up with each
+  new power reading"""
+  energy_raw=raw&MASK
+  ticks=raw>>32&MASK
+  state=counters.get( (socket, name) )
+  if state is None:
+    state={ "raw": energy_raw, "ticks": ticks, "total": 0, "time": 0, "window_time": 0, "window_total": 0,
+            "power": None, "windows": 0 }
+    counters[(socket, name)]=state
+    return state
+
+  state["total"]+=(energy_raw-state["raw"])&MASK
+  state["time"]+=(ticks-state["ticks"])&MASK
+  state["raw"]=energy_raw
+  state["ticks"]=ticks
+  elapsed=(state["time"]-state["window_time"])*pcu["time_unit"]
+  if elapsed>0 and elapsed>=window:
+    state["power"]=(state["total"]-state["window_total"])*pcu["energy_unit"]/elapsed
+    state["window_time"]=state["time"]
+    state["window_total"]=state["total"]
+    state["windows"]+=1
+  return state
+
+
+def feed(socket, cr, config, timestamp=None, ranges=None):
+  """accounts for the counters of CR #cr found in config, its 256 bytes config space.
+  ranges : the [ (offset, size), ... ] actually read at timestamp. None : all of them"""
+  for (counter_cr,offset),name in list(COUNTERS.items())+list(THROTTLE_COUNTERS.items()):
+    if counter_cr!=cr:
+      continue
+    if ranges is not None and not any( start<=offset<start+size for start,size in ranges ):
+      continue
+    update(socket, name, int.from_bytes(config[offset:offset+4], "little"), timestamp,
+           "time_unit" if name in THROTTLE_COUNTERS.values() else "energy_unit")
+
+
+def joules(socket, name):
+  """energy counted since the first sample, in J. None before it"""
+  state=counters.get( (socket, name) )
+  if state is None:
+    return None
+  return state["total"]*pcu["energy_unit"]
+
+
+def power(socket, name):
+  """average power of the last window, in W. None until one window has elapsed"""
+  state=counters.get( (socket, name) )
+  if state is None:
+    return None
+  return state["power"]
+
+
+def reset():
+  counters.clear()
+
+
+###################################################################################################
+#
+#  1. Rolling windows : the average rate of a set of counters over the last W seconds, for a few
+#     W at once (10 ms ... 10 s), at a constant cost per sample. Each window keeps a short history
+#     of (time, totals), one entry every W/BUCKETS at most : the oldest entry is the start of the
+#     window, between W and W*(1+1/BUCKETS) ago. The averages divide by the exact time in between.
+#
+###################################################################################################
+BUCKETS=20
+
+
+def rolling(windows, buckets=BUCKETS):
+  """a new set of rolling windows, in seconds"""
+  return { "windows": list(windows),
+           "step"   : [ window/buckets for window in windows ],
+           "history": [ collections.deque() for window in windows ] }
+
+
+def roll(r, t, totals):
+  """adds the sample totals (a tuple of counter totals) taken at t seconds"""
+  for window,step,history in zip(r["windows"], r["step"], r["history"]):
+    if not history or t-history[-1][0]>=step:
+      history.append( (t, totals) )
+    # keep a single entry at or before t-window : the start of the window
+    while len(history)>=2 and history[1][0]<=t-window:
+      history.popleft()
+
+
+def window_start(r, index):
+  """(t, totals) at the start of window #index, None before the first sample"""
+  history=r["history"][index]
+  return history[0] if history else None
+
+
+###################################################################################################
+#
+#  2. Throttle accounting : PACKAGE RAPL PERF STATUS (MSR 613h, PCU_CR2 88h) and PLATFORM RAPL
+#     SOCKET PERF STATUS (MSR 666h) accumulate the time the package ran below the P-state the OS
+#     requested, because of a RAPL limit, in pcu["time_unit"] like the time field of MSR 612h.
+#     Their increase over an interval, divided by that interval, is the share of time throttled :
+#     what the power cap costs. Read in the same snapshot as MSR 612h, the interval is its hardware
+#     time, and the package power of that interval comes with it.
+#
+###################################################################################################
+# the throttle counters the collector feeds : (CR, offset) -> name
+THROTTLE_COUNTERS={ (2, 0x88): "rapl throttle" }   # PACKAGE RAPL PERF STATUS
+
+
+def throttled(socket, name="rapl throttle"):
+  """share of the last window spent throttled, in %. None until one window has elapsed"""
+  share=power(socket, name)
+  if share is None:
+    return None
+  return share*100
+
+
+def throttle_share(throttle, ticks):
+  """share of time throttled, 0 to 1, from the increase of a throttle counter and of the time
+  field of MSR 612h over the same interval. None when no time elapsed"""
+  if ticks<=0:
+    return None
+  return min(1., throttle/ticks)
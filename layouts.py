@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+import bitfield
+from useful_stuff import *
+
+###################################################################################################
+#
+#  0. Declarative register layouts
+#     Each register is described once, as data :
+#       where      : "cr" and "offset" for a PCU CR register, "msr" for a MSR
+#       size       : in bytes
+#       fields     : ( name, kind+width ), most significant first. name None is reserved
+#       units      : field -> key of the pcu dict ("pwr_unit", "time_unit", "energy_unit")
+#       windows    : time window -> ( x field, y field ), worth (1+x/10) * 2**y * time_unit
+#     decode() / encode() / scale() / decode_array() work from that description only.
+#
+###################################################################################################
+
+# register name -> description
+registry={}
+
+
+def register(name, size, fields, units={}, windows={}, **where):
+  """describes a register once and adds it to the registry"""
+  desc=dict(where)
+  desc.update( { "name": name,
+                 "size": size,
+                 "fields": tuple(fields),
+                 "fmt": " ".join( kind for _,kind in fields ),
+                 "names": tuple( field for field,kind in fields if field is not None ),
+                 "units": dict(units),
+                 "windows": dict(windows) } )
+  nbits,_=bitfield.layout(desc["fmt"])
+  if nbits>8*size:
+    raise ValueError("{} : {} bits do not fit in {} bytes".format(name, nbits, size))
+  registry[name]=desc
+  return desc
+
+
+def decode(desc, reg):
+  """decodes reg (little endian bytes, or the register as an int) into a dict { field: raw value }"""
+  if isinstance(reg, int):
+    nbits,_=bitfield.layout(desc["fmt"])
+    values=bitfield.unpack_int(desc["fmt"], reg>>(8*desc["size"]-nbits))
+  else:
+    values=bitfield.unpack(desc["fmt"], reg)
+  return dict(zip(desc["names"], values))
+
+
+def encode(desc, fields):
+  """encodes a dict { field: raw value } into little endian bytes, ready to be written"""
+  data=bitfield.pack(desc["fmt"], *[ fields[name] for name in desc["names"] ])
+  return data+bytes(desc["size"]-len(data))
+
+
+def scale(desc, fields):
+  """returns a dict of the fields converted to physical units, with the time windows added.
+  fields are either raw values or numpy arrays of raw values"""
+  scaled=dict(fields)
+  for name,unit in desc["units"].items():
+    scaled[name]=fields[name]*pcu[unit]
+  for name,(x,y) in desc["windows"].items():
+    scaled[name]=(1+fields[x]/10)*2.0**fields[y]*pcu["time_unit"]
+  return scaled
+
+
+def decode_array(desc, words, scaled=True):
+  """decodes N samples at once from an array of raw registers (e.g. numpy uint64).
+  returns a dict { field: numpy array }, converted to physical units unless scaled is False"""
+  fields=dict(zip(desc["names"], bitfield.unpack_array(desc["fmt"], words, desc["size"])))
+  if scaled:
+    return scale(desc, fields)
+  return fields
+
+
+###################################################################################################
+#
+#  1. Layouts
+#
+###################################################################################################
+RAPL_LIMIT=( ("lim_lock"    , "b1"),
+             (None          , "p7"),
+             ("lim_2_time_x", "u2"),
+             ("lim_2_time_y", "u5"),
+             ("clmp_lim_2"  , "b1"),
+             ("lim_2_en"    , "b1"),
+             ("lim_2"       , "u15"),
+             (None          , "p8"),
+             ("lim_1_time_x", "u2"),
+             ("lim_1_time_y", "u5"),
+             ("clmp_lim_1"  , "b1"),
+             ("lim_1_en"    , "b1"),
+             ("lim_1"       , "u15") )
+
+RAPL_LIMIT_UNITS={ "lim_1": "pwr_unit",
+                   "lim_2": "pwr_unit" }
+
+RAPL_LIMIT_WINDOWS={ "time_window_1": ("lim_1_time_x", "lim_1_time_y"),
+                     "time_window_2": ("lim_2_time_x", "lim_2_time_y") }
+
+
+PACKAGE_RAPL_LIMIT_CFG=register("PACKAGE RAPL LIMIT CFG", 8, RAPL_LIMIT, RAPL_LIMIT_UNITS, RAPL_LIMIT_WINDOWS,
+                                cr=0, offset=0xE8)
+
+PLATFORM_RAPL_LIMIT=register("PLATFORM RAPL LIMIT", 8, RAPL_LIMIT, RAPL_LIMIT_UNITS, RAPL_LIMIT_WINDOWS,
+                             cr=6, offset=0xA8)
+
+MSR_PACKAGE_RAPL_LIMIT=register("MSR PACKAGE RAPL LIMIT", 8, RAPL_LIMIT, RAPL_LIMIT_UNITS, RAPL_LIMIT_WINDOWS,
+                                msr=0x610)
+
+VR_CURRENT_CONFIG_CFG=register("VR CURRENT CONFIGURATION", 8,
+                               ( (None            , "p2"),
+                                 ("psi3_threshold", "u10"),
+                                 ("psi2_threshold", "u10"),
+                                 ("psi1_threshold", "u10"),
+                                 ("lock"          , "b1"),
+                                 (None            , "p18"),
+                                 ("current_limit" , "u13") ),
+                               cr=0, offset=0xF8)
+
+PACKAGE_POWER_SKU_UNIT_CFG=register("PACKAGE POWER SKU UNIT", 4,
+                                    ( (None         , "p12"),
+                                      ("time_unit"  , "u4"),
+                                      (None         , "p4"),
+                                      ("energy_unit", "u4"),
+                                      (None         , "p4"),
+                                      ("pwr_unit"   , "u4") ),
+                                    cr=0, offset=0x8C)
+
+
+# the registers the collector samples fast, or that the capture tools slice across time :
+# energy counters, temperatures, throttle counters
+PACKAGE_POWER_SKU_CFG=register("PACKAGE POWER SKU", 8,
+                               ( (None         , "p9"),
+                                 ("max_win_x"  , "u2"),
+                                 ("max_win_y"  , "u5"),
+                                 (None         , "p1"),
+                                 ("max_pwr"    , "u15"),
+                                 (None         , "p1"),
+                                 ("min_pwr"    , "u15"),
+                                 (None         , "p1"),
+                                 ("tdp"        , "u15") ),
+                               { "max_pwr": "pwr_unit", "min_pwr": "pwr_unit", "tdp": "pwr_unit" },
+                               { "max_win": ("max_win_x", "max_win_y") },
+                               cr=0, offset=0x80)
+
+PRIP_NRG_STTS_CFG=register("PRIMARY PLANE ENERGY STATUS", 4, ( ("energy", "u32"), ), { "energy": "energy_unit" },
+                           cr=0, offset=0x88)
+
+PACKAGE_ENERGY_STATUS_CFG=register("PACKAGE ENERGY STATUS", 4, ( ("energy", "u32"), ), { "energy": "energy_unit" },
+                                   cr=0, offset=0x90)
+
+PACKAGE_TEMPERATURE_CFG=register("PACKAGE TEMPERATURE", 4, ( (None, "p24"), ("temperature", "u8") ),
+                                 cr=0, offset=0xC8)
+
+PP0_TEMPERATURE_CFG=register("PP0 TEMPERATURE", 4, ( (None, "p24"), ("temperature", "u8") ),
+                             cr=0, offset=0xCC)
+
+PACKAGE_THERM_MARGIN_CFG=register("PACKAGE THERMAL MARGIN", 4, ( (None, "p18"), ("margin", "s14") ),
+                                  cr=0, offset=0xE0)
+
+TEMPERATURE_TARGET_CFG=register("TEMPERATURE TARGET", 4,
+                                ( ("lock"                   , "b1"),
+                                  (None                     , "p1"),
+                                  ("tj_max_tcc_offset"      , "u6"),
+                                  ("ref_temp"               , "u8"),
+                                  ("fan_temp_target_ofst"   , "u8"),
+                                  ("tcc_offset_clamping_bit", "b1"),
+                                  ("tcc_offset_time_window" , "u7") ),
+                                cr=0, offset=0xE4)
+
+DRAM_ENERGY_STATUS=register("DRAM ENERGY STATUS", 4, ( ("energy", "u32"), ), { "energy": "energy_unit" },
+                            cr=2, offset=0x80)
+
+# counts the time spent below the requested P-state because of RAPL, like MSR 613h
+PACKAGE_RAPL_PERF_STATUS=register("PACKAGE RAPL PERF STATUS", 4, ( ("throttled", "u32"), ), { "throttled": "time_unit" },
+                                  cr=2, offset=0x88)
+
+DRAM_POWER_INFO_CFG=register("DRAM POWER INFORMATION", 8,
+                             ( ("lock"        , "b1"),
+                               (None          , "p8"),
+                               ("max_win_x"   , "u2"),
+                               ("max_win_y"   , "u5"),
+                               (None          , "p1"),
+                               ("max_pwr"     , "u15"),
+                               (None          , "p1"),
+                               ("min_pwr"     , "u15"),
+                               (None          , "p1"),
+                               ("tdp"         , "u15") ),
+                             { "max_pwr": "pwr_unit", "min_pwr": "pwr_unit", "tdp": "pwr_unit" },
+                             { "max_win": ("max_win_x", "max_win_y") },
+                             cr=2, offset=0xA8)
+
+MEM_TRML_TEMPERATURE=( (None                   , "p8"),
+                       ("channel2_temperature" , "u8"),
+                       ("channel1_temperature" , "u8"),
+                       ("channel0_temperature" , "u8") )
+
+MEM_TRML_TEMPERATURE_REPORT0=register("MEM TRML TEMPERATURE REPORT 0", 4, MEM_TRML_TEMPERATURE, cr=2, offset=0xC8)
+MEM_TRML_TEMPERATURE_REPORT1=register("MEM TRML TEMPERATURE REPORT 1", 4, MEM_TRML_TEMPERATURE, cr=2, offset=0xCC)
+MEM_TRML_TEMPERATURE_REPORT2=register("MEM TRML TEMPERATURE REPORT 2", 4, MEM_TRML_TEMPERATURE, cr=2, offset=0xD0)
+MEM_TRML_TEMPERATURE_REPORT3=register("MEM TRML TEMPERATURE REPORT 3", 4, MEM_TRML_TEMPERATURE, cr=2, offset=0xD4)
+
+def rapl_units(reg):
+  """decodes PACKAGE POWER SKU UNIT into a dict shaped like the pcu one, in s, J and W"""
+  return { name: 1/2**value for name,value in decode(PACKAGE_POWER_SKU_UNIT_CFG, reg).items() }
@@ -0,0 +1,386 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import atexit
+import struct
+import threading
+import concurrent.futures
+
+from useful_stuff import *
+import msr
+
+###################################################################################################
+#
+#  0. One mailbox layer, several transports
+#       oc      : OC mailbox, MSR 150h. one 64 bits register :
+#                 63 busy, 55-48 param2, 47-40 param1, 39-32 command / completion code, 31-0 data
+#       bios    : BIOS mailbox, MSR 607h (interface) and MSR 608h (data)
+#       os      : OS mailbox, PCU CR1 config space A4h (interface) and A0h (data)
+#       bios_cr : BIOS mailbox, PCU CR1 config space 90h (interface) and 8Ch (data)
+#     the interface of the last three is a 32 bits register :
+#                 31 busy, 23-16 param2, 15-8 param1 (sub command), 7-0 command / completion code
+#     a MSR transport targets a core number, a config space transport targets a PCU device
+#     ("0000:7f:1e"). Descriptors are opened once per target, and every wait polls the busy bit
+#     with a deadline (see msr.poll_busy)
+#
+###################################################################################################
+debug=False
+
+TRANSPORTS={ "oc"     : { "kind": "msr", "interface": 0x150, "data": None , "busy": 63, "shift": 32 },
+             "bios"   : { "kind": "msr", "interface": 0x607, "data": 0x608, "busy": 31, "shift": 0  },
+             "os"     : { "kind": "cr" , "interface": 0xA4 , "data": 0xA0 , "busy": 31, "shift": 0, "cr": 1 },
+             "bios_cr": { "kind": "cr" , "interface": 0x90 , "data": 0x8C , "busy": 31, "shift": 0, "cr": 1 } }
+
+# completion codes, by mailbox family
+OC_COMPLETION={ 0x00: "PASS",
+                0x01: "LOCKED",
+                0x02: "UNSUPPORTED_SERVICE",
+                0x03: "RATIO_EXCEEDS_MAXOC",
+                0x04: "MAX_VOLTAGE",
+                0x05: "NO_OVERCLOCKING",
+                0x06: "FIVR_IN_PROGRESS",
+                0x07: "VR_RAMP_FAILED",
+                0x08: "VOLT_OVERRIDE_DISABLED",
+                0x09: "INVALID_AVX_LEVEL",
+                0x10: "INVALID_PARAMETER",
+                0x1F: "UNRECOGNIZED_COMMAND" }
+
+BIOS_COMPLETION={ 0x00: "PASS",
+                  0x01: "ILLEGAL_COMMAND",
+                  0x02: "TIMEOUT",
+                  0x04: "ILLEGAL_DATA",
+                  0x05: "ILLEGAL_VR_ID",
+                  0x06: "VR_INTERFACE_LOCKED",
+                  0x07: "VR_ERROR",
+                  0x08: "ILLEGAL_SUB_COMMAND",
+                  0x09: "EDRAM_NOT_FUNCTIONAL",
+                  0x10: "EDRAM_UNAVAILABLE" }
+
+COMPLETION={ "oc": OC_COMPLETION, "bios": BIOS_COMPLETION, "os": BIOS_COMPLETION, "bios_cr": BIOS_COMPLETION }
+
+# (PCU device, CR) -> descriptor of its config space
+cr_fds={}
+cr_fds_lock=threading.Lock()
+# (transport, target) -> (command, start) of the command in flight
+pending={}
+
+
+def cr_fd(device, cr):
+  fd=cr_fds.get((device, cr))
+  if fd is None:
+    # the "os" and "bios_cr" queues of a socket share CR1
+    with cr_fds_lock:
+      fd=cr_fds.get((device, cr))
+      if fd is None:
+        fd=os.open(sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(device, cr)), os.O_RDWR)
+        cr_fds[device, cr]=fd
+  return fd
+
+
+def close_cr_fds():
+  for fd in cr_fds.values():
+    os.close(fd)
+  cr_fds.clear()
+
+atexit.register(close_cr_fds)
+
+
+def target_fd(transport, target):
+  t=TRANSPORTS[transport]
+  if t["kind"]=="msr":
+    return msr.msr_fd(target)
+  return cr_fd(target, t["cr"])
+
+
+def register_offset(transport, offset):
+  """file offset of a register : MSR numbers go through msr_offset()"""
+  return msr_offset(offset) if TRANSPORTS[transport]["kind"]=="msr" else offset
+
+
+def read_register(transport, fd, offset):
+  """MSRs are always read 8 bytes at a time, config space registers 4 bytes"""
+  size=8 if TRANSPORTS[transport]["kind"]=="msr" else 4
+  return int.from_bytes(os.pread(fd, size, register_offset(transport, offset)), "little", signed=False)
+
+
+def write_register(transport, fd, offset, value):
+  size=8 if TRANSPORTS[transport]["kind"]=="msr" else 4
+  os.pwrite(fd, value.to_bytes(size, "little", signed=False), register_offset(transport, offset))
+
+
+def interface_word(transport, command, param1=0, param2=0, data=0):
+  """the interface register value of a command, busy bit set"""
+  t=TRANSPORTS[transport]
+  interface=(command | param1<<8 | param2<<16)<<t["shift"] | 1<<t["busy"]
+  if t["data"] is None:
+    interface|=data & 0xFFFFFFFF
+  return interface
+
+
+def completion(transport, code):
+  """name of a completion code"""
+  return COMPLETION[transport].get(code, "UNKNOWN_{0:02X}h".format(code))
+
+
+###################################################################################################
+#
+#  1. Transactions
+#
+###################################################################################################
+def submit(transport, target, command, param1=0, param2=0, data=0, timeout=None):
+  """waits for the mailbox to be idle, then writes data and the command, busy bit set.
+  returns the interface register value written"""
+  t=TRANSPORTS[transport]
+  interface=interface_word(transport, command, param1, param2, data)
+  kind=cache_class(transport, command, param1)
+  key=(target, transport, command, param1, param2, data & 0xFFFFFFFF)
+  entry=cache_lookup(kind, key)
+  if entry is not None:
+    # answered from the cache : complete() returns it without touching the mailbox
+    pending[transport, target]=(command, None, kind, key, entry)
+    return interface
+
+  fd=target_fd(transport, target)
+  msr.poll_busy(lambda: os.pread(fd, 8 if t["kind"]=="msr" else 4, register_offset(transport, t["interface"])), t["busy"], timeout)
+  if t["data"] is not None:
+    write_register(transport, fd, t["data"], data & 0xFFFFFFFF)
+  write_register(transport, fd, t["interface"], interface)
+  pending[transport, target]=(command, time.perf_counter(), kind, key, None)
+  return interface
+
+
+def complete(transport, target, timeout=None):
+  """waits for the command in flight to complete.
+  returns (completion code, data, raw interface register value)"""
+  command,start,kind,key,entry=pending.pop((transport, target), (None, time.perf_counter(), VOLATILE, None, None))
+  if entry is not None:
+    return entry
+  t=TRANSPORTS[transport]
+  fd=target_fd(transport, target)
+  try:
+    chunk,polls=msr.poll_busy(lambda: os.pread(fd, 8 if t["kind"]=="msr" else 4, register_offset(transport, t["interface"])), t["busy"], timeout)
+  except Exception:
+    if command is not None: msr.record_mailbox((transport, command), time.perf_counter()-start, 0, True)
+    raise
+  if command is not None:
+    msr.record_mailbox((transport, command), time.perf_counter()-start, polls)
+
+  interface=int.from_bytes(chunk, "little", signed=False)
+  code=interface>>t["shift"] & 0xFF
+  if t["data"] is None:
+    data=interface & 0xFFFFFFFF
+  else:
+    data=read_register(transport, fd, t["data"]) & 0xFFFFFFFF
+  if key is not None:
+    cache_store(kind, key, code, data, interface)
+  return code, data, interface
+
+
+def command(transport, command, param1=0, param2=0, data=0, target=0, timeout=None):
+  """runs one mailbox command, returns (completion code, data)"""
+  return transaction(transport, target, command, param1, param2, data, timeout)
+
+
+def transaction(transport, target, command, param1=0, param2=0, data=0, timeout=None):
+  submit(transport, target, command, param1, param2, data, timeout)
+  code,data,_=complete(transport, target, timeout)
+  if debug:
+    sys.stdout.write("debug : {0} mailbox [{1}] command={2:02X} param1={3:02X} param2={4:02X} "
+                     "-> {5} data={6:08X}\n".format(transport, target, command, param1, param2,
+                     completion(transport, code), data))
+  return code, data
+
+
+###################################################################################################
+#
+#  2. Response cache
+#     most answers never change while the machine runs : fused ratios, capabilities, SST-PP
+#     levels. Each (transport, command[, param1]) is classified :
+#       immutable : cached for the life of the boot, may be persisted per boot_id
+#       config    : cached until the next write command, on any mailbox
+#       volatile  : never cached, not a write either (status, current frequency)
+#       write     : anything not listed. drops every config entry
+#     entries are keyed by (target, transport, command, param1, param2, data) : the OS mailbox
+#     takes the SST-PP level in data. Only PASS answers are cached
+#
+###################################################################################################
+IMMUTABLE="immutable"
+CONFIG="config"
+VOLATILE="volatile"
+WRITE="write"
+
+CACHE_POLICY={ ("oc", 0x01): IMMUTABLE,        # OC_CAPABILITY
+               ("oc", 0x02): IMMUTABLE,        # PER_CORE_RATIO_LIMITS_CAP
+               ("oc", 0x05): VOLATILE,         # READ_BCLK_FREQUENCY
+               ("oc", 0x06): VOLATILE,         # READ_OC_STATUS
+               ("oc", 0x07): IMMUTABLE,        # READ_FUSED_P0_RATIO
+               ("oc", 0x10): CONFIG,           # READ_VF_OVERRIDE
+               ("oc", 0x12): CONFIG,           # READ_SVID_CONFIG
+               ("oc", 0x14): CONFIG,           # READ_MISC_GLOBAL_CONF
+               ("oc", 0x1A): CONFIG,           # READ_AVX_CONTROL
+               ("os", 0x7F, 0x00): CONFIG,     # CONFIG_TDP GET_LEVELS_INFO : holds the current level
+               ("os", 0x7F, 0x01): CONFIG,     # CONFIG_TDP GET_CONFIG_TDP_CONTROL
+               ("os", 0x7F, 0x03): IMMUTABLE,  # CONFIG_TDP GET_TDP_INFO
+               ("os", 0x7F, 0x04): IMMUTABLE,  # CONFIG_TDP GET_PWR_INFO
+               ("os", 0x7F, 0x05): IMMUTABLE,  # CONFIG_TDP GET_TJMAX_INFO
+               ("os", 0x7F, 0x06): IMMUTABLE,  # CONFIG_TDP GET_CORE_MASK
+               ("os", 0x7F, 0x07): IMMUTABLE,  # CONFIG_TDP GET_TURBO_LIMIT_RATIOS
+               ("os", 0x7F, 0x09): IMMUTABLE,  # CONFIG_TDP GET_UNCORE_P0_P1_INFO
+               ("os", 0x7F, 0x0A): IMMUTABLE,  # CONFIG_TDP GET_P1_INFO
+               ("os", 0x7F, 0x0B): IMMUTABLE,  # CONFIG_TDP GET_MEM_FREQ
+               ("os", 0x7F, 0x0C): IMMUTABLE,  # CONFIG_TDP GET_RATIO_INFO
+               ("os", 0x94): CONFIG,           # READ_PM_CONFIG
+               ("bios_cr", 0x18, 0x00): IMMUTABLE,  # SVID_VR GET_STRAP_CONFIGURATION
+               ("bios_cr", 0x18, 0x01): IMMUTABLE,  # SVID_VR GET_ACDC_LOADLINE
+               ("bios_cr", 0xA5): CONFIG }     # READ_TJMAX_OVERRIDE
+
+caching=True
+cache={}
+cache_lock=threading.Lock()
+cache_stats={ "hits": 0, "misses": 0, "invalidations": 0 }
+CACHE_FILE=os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "pcu", "mailboxes.json")
+
+
+def cache_class(transport, command, param1=0):
+  return CACHE_POLICY.get((transport, command, param1), CACHE_POLICY.get((transport, command), WRITE))
+
+
+def cache_lookup(kind, key):
+  """(completion code, data, interface) of a cached answer, or None"""
+  if not caching or kind not in (IMMUTABLE, CONFIG):
+    return None
+  with cache_lock:
+    entry=cache.get(key)
+    cache_stats["hits" if entry is not None else "misses"]+=1
+  return None if entry is None else entry[1:]
+
+
+def cache_store(kind, key, code, data, interface):
+  with cache_lock:
+    if kind==WRITE:
+      stale=[ k for k,entry in cache.items() if entry[0]==CONFIG ]
+      for k in stale: del cache[k]
+      cache_stats["invalidations"]+=1
+    elif caching and kind in (IMMUTABLE, CONFIG) and code==0:
+      cache[key]=(kind, code, data, interface)
+
+
+def clear_cache():
+  with cache_lock:
+    cache.clear()
+
+
+def load_cache(path=None):
+  """loads the immutable answers saved during the same boot. returns the number of entries"""
+  path=path or CACHE_FILE
+  try:
+    with open(path) as f:
+      saved=json.load(f)
+  except (OSError, ValueError):
+    return 0
+  if saved.get("boot_id") is None or saved.get("boot_id")!=boot_id():
+    return 0
+  with cache_lock:
+    for key,code,data,interface in saved["entries"]:
+      cache[tuple(key)]=(IMMUTABLE, code, data, interface)
+  return len(saved["entries"])
+
+
+def save_cache(path=None):
+  """saves the immutable answers, tagged with the boot id"""
+  path=path or CACHE_FILE
+  current=boot_id()
+  if current is None:
+    return
+  with cache_lock:
+    entries=[ [ list(key), code, data, interface ] for key,(kind,code,data,interface) in cache.items() if kind==IMMUTABLE ]
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path+".tmp", "w") as f:
+    json.dump({ "boot_id": current, "entries": entries }, f)
+  os.replace(path+".tmp", path)
+
+
+def persist_cache(path=None):
+  """loads the saved answers now, saves them back at exit"""
+  load_cache(path)
+  atexit.register(save_cache, path)
+
+
+def cache_report():
+  return "mailbox cache : {0} entries, {1} hits, {2} misses, {3} invalidations".format(
+         len(cache), cache_stats["hits"], cache_stats["misses"], cache_stats["invalidations"])
+
+
+###################################################################################################
+#
+#  3. Command queues
+#     each mailbox (transport, target) gets its own single thread executor : the commands queued
+#     to one mailbox run in order, one at a time, while the mailboxes of all the sockets work in
+#     parallel. A survey of 16 sockets then takes about as long as the one of a single socket
+#
+###################################################################################################
+executors={}
+executors_lock=threading.Lock()
+
+
+def executor(transport, target):
+  with executors_lock:
+    pool=executors.get((transport, target))
+    if pool is None:
+      pool=concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="mailbox-{0}-{1}".format(transport, target))
+      executors[transport, target]=pool
+  return pool
+
+
+def queue(transport, command, param1=0, param2=0, data=0, target=0, timeout=None):
+  """queues one command to the mailbox of target. returns a concurrent.futures.Future,
+  whose result() is (completion code, data) or raises the mailbox timeout"""
+  return executor(transport, target).submit(transaction, transport, target, command, param1, param2, data, timeout)
+
+
+def shutdown():
+  """waits for every queued command, then stops the executors"""
+  with executors_lock:
+    for pool in executors.values():
+      pool.shutdown()
+    executors.clear()
+
+atexit.register(shutdown)
+
+
+###################################################################################################
+#
+#  4. OC mailbox, with the raw interface the survey scripts decode
+#
+###################################################################################################
+def wr_ocmailbox(param2, param1, command, data, core=0):
+  buffer=interface_word("oc", command, param1, param2, data).to_bytes(8, "little", signed=False)
+  if debug:
+    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", buffer)
+    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
+    sys.stdout.write("debug : write to OC_MAILBOX {0}h ( param2={1:02X} "\
+                     "param1={2:02X} command={3:02X} data={4:04X} )\n".format(
+                     blue(hexa),param2,param1,command,data) )
+  try:
+    submit("oc", core, command, param1, param2, data)
+  except Exception:
+    sys.stderr.write("Could not write {} to OC_MAILBOX, leaving.\n".format(buffer))
+    sys.exit(1)
+  return buffer
+
+
+def rd_ocmailbox(core=0):
+  try:
+    _,_,interface=complete("oc", core)
+  except Exception:
+    sys.stderr.write("Could not read the OC_MAILBOX, leaving.\n")
+    sys.exit(1)
+  chunk=interface.to_bytes(8, "little", signed=False)
+  if debug:
+    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", chunk)
+    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
+    sys.stdout.write("debug : read frm OC_MAILBOX {0}h\n".format( blue(hexa)) )
+  return chunk
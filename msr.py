@@ -2,90 +2,296 @@
 
 import os
 import sys
+import time
+import atexit
 import math       # for pow
+import array
 import struct
 import subprocess
-import bitstruct
+import threading
+import concurrent.futures
+import bitfield
+import layouts
+import topology
 from textwrap import wrap
 
 from useful_stuff import *
 
 
+# one descriptor per logical CPU, opened on first use and kept for the life of the process.
+# a full per-core sweep used to pay an open()/close() pair per register read
+MSR_PATH="/dev/cpu/{0:d}/msr"
+msr_fds={}
+
+
+def msr_fd(core=0):
+  """returns the descriptor of /dev/cpu/<core>/msr, opening it on first use.
+  opened read-write when allowed, so that the same descriptor serves rdmsr and wrmsr"""
+  fd=msr_fds.get(core)
+  if fd is None:
+    msrfile=sysfs(MSR_PATH.format(core))
+    try:
+      fd=os.open(msrfile, os.O_RDWR)
+    except PermissionError:
+      fd=os.open(msrfile, os.O_RDONLY)
+    msr_fds[core]=fd
+  return fd
+
+
+def close_msr_fds():
+  for fd in msr_fds.values():
+    os.close(fd)
+  msr_fds.clear()
+
+atexit.register(close_msr_fds)
+
+
 def rdmsr(offset, size, core=0):
   """size = size of data to read, in Byte
   offset = equivalent to the msr number
-  core = each core has its own set of msr
+  core = each core has its own set of msr. package scope MSRs are read on the first CPU of
+  the package of core
   """
-
-  msrfile="/dev/cpu/{0:d}/msr".format(core)
-  with open(msrfile, "rb") as fd:
-    fd.seek(offset)
-    return fd.read(size)
+  if offset in PACKAGE_MSRS: core=package_cpu(core)
+  return os.pread(msr_fd(core), size, msr_offset(offset))
 
 
 def wrmsr(offset, databytes, core=0):
-  msrfile="/dev/cpu/{0:d}/msr".format(core)
+  if offset in PACKAGE_MSRS: core=package_cpu(core)
+  n=0
   try:
-    with open(msrfile, "r+b") as fd:           # w+ erases, then opens. r+ opens for reading and writing
-      fd.seek(offset)
-      n=fd.write(databytes)
+    n=os.pwrite(msr_fd(core), databytes, msr_offset(offset))
   except:
     #sys.exit("wrmsr {0:04X}h : Could not write {1} into {2}\n".format( 
     #  offset, databytes.hex(), msrfile ))
     print("wrmsr {0:X}h : Could not write {1} into {2}\n".format( 
-      offset, databytes.hex(), msrfile ))
+      offset, databytes.hex(), sysfs(MSR_PATH.format(core)) ))
 
   return n
 
 
 def count_cores():
   """return the number of cores, by counting folders in /sys/class/msr"""
-  dirarray=os.listdir("/sys/class/msr/")  # contains [ "msr23", "msr24", ...]
+  dirarray=os.listdir(sysfs("/sys/class/msr/"))  # contains [ "msr23", "msr24", ...]
   return len(dirarray)
 
 
-def read_mailbox(offset, size, core=0):
-  msrfile="/dev/cpu/{0:d}/msr".format(core)
-  with open(msrfile, "rb") as fd:
-    # we poll on the last bit
-    count=0
-    while count<20:
-      fd.seek(offset+size-1)
-      chunk=fd.read(1)
-      if int.from_bytes(chunk, "little", signed=False)>>7 : time.sleep(.1)
-      else: break
-      count+=1
-    if count>=20:
-      raise Exception("mailbox still BUSY")
-    fd.seek(offset)
-    return fd.read(size)
-
-
-def write_mailbox(offset, size, data, core=0):
-  msrfile="/dev/cpu/{0:d}/msr".format(core)
-  with open(msrfile, "r+b") as fd:             # w+ erases, then opens. r+ opens for reading and writing
-    # we poll on the last bit
-    count=0
-    while count<20:
-      fd.seek(offset+size-1)
-      chunk=fd.read(1)
-      if int.from_bytes(chunk, "little", signed=False)>>7 : time.sleep(.1)
-      else: break
-      count+=1
-    if count>=20:
-      raise Exception("mailbox still BUSY")
-    fd.seek(offset)
-    return fd.write(data)
+def count_packages():
+  return len(package_state()["packages"])
+
+
+# package scope MSRs : the same register is seen from every CPU of a package. They are read on
+# one representative CPU per package (the first one of topology.packages()), by a reader
+# thread pinned on that package, so that the IPI of the msr driver stays on the socket
+PACKAGE_MSRS=frozenset( [ 0x0CE,             # PLATFORM INFO
+                          0x1AD,             # TURBO RATIO LIMIT
+                          0x601, 0x603,      # VR CURRENT CONFIG, VR MISC CONFIG
+                          0x606,             # RAPL POWER UNIT
+                          0x610, 0x611, 0x612, 0x613, 0x614,   # PACKAGE RAPL
+                          0x618, 0x619, 0x61B, 0x61C,          # DRAM RAPL
+                          0x638, 0x639,      # PRIMARY PLANE
+                          0x64D, 0x64F,      # PLATFORM ENERGY STATUS, CORE PERF LIMIT REASONS
+                          0x65C, 0x65D, 0x65E, 0x666 ] )       # PLATFORM POWER
+
+# topology the maps below were built from, CPU -> representative CPU, package -> reader pool
+package_topology=None
+package_of={}
+package_pools={}
+
+
+def package_state():
+  """(re)builds the CPU -> representative CPU map when the topology changes"""
+  global package_topology
+  topo=topology.get()
+  if topo is not package_topology:
+    for pool in package_pools.values(): pool.shutdown()
+    package_pools.clear()
+    package_of.clear()
+    for cpus in topo["packages"]:
+      for cpu in cpus: package_of[cpu]=cpus[0]
+    package_topology=topo
+  return topo
+
+
+def package_cpu(core=0):
+  """the CPU package scope MSRs of core are read from"""
+  package_state()
+  return package_of.get(core, core)
+
+
+def package_cpus():
+  """one representative CPU per package, in package order"""
+  return [ cpus[0] for cpus in package_state()["packages"] ]
+
+
+def pin(cpus):
+  try:
+    os.sched_setaffinity(0, cpus)       # 0 : the calling thread
+  except (OSError, ValueError):
+    pass                                # e.g. a simulated tree has more CPUs than the host
+
+
+def package_pool(package):
+  """single thread executor pinned on the CPUs of package"""
+  cpus=package_state()["packages"][package]
+  pool=package_pools.get(package)
+  if pool is None:
+    pool=concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="msr-package{}".format(package),
+                                               initializer=pin, initargs=(cpus,))
+    package_pools[package]=pool
+  return pool
+
+
+def package_snapshot(msr_list, packages=None):
+  """reads every MSR of msr_list once per package, each package from its own pinned thread.
+  returns an array('Q') where the value of msr_list[j] on packages[i] is at index i*len(msr_list)+j"""
+  cpus=package_cpus()
+  if packages is None: packages=range(len(cpus))
+  nmsr=len(msr_list)
+  offsets=[ msr_offset(offset) for offset in msr_list ]
+  result=array.array("Q", bytes(8*nmsr*len(packages)))
+
+  def read_package(i, package):
+    fd=msr_fd(cpus[package])
+    base=i*nmsr
+    for j,offset in enumerate(offsets):
+      result[base+j]=int.from_bytes(os.pread(fd, 8, offset), "little", signed=False)
+
+  for package in packages: msr_fd(cpus[package])
+  futures=[ package_pool(package).submit(read_package, i, package) for i,package in enumerate(packages) ]
+  for future in futures: future.result()
+  return result
+
+
+# MSRs are read 8 bytes at a time, all of them, on all the cores, in one pass. a thread pool
+# can spread the cores over several CPUs so that all sockets are sampled in a tight window
+snapshot_pool=None
+snapshot_workers=0
+
+
+def snapshot(msr_list, cores, workers=0):
+  """reads every MSR of msr_list on every core of cores.
+  returns an array('Q') of raw 64-bit values, where the value of msr_list[j] on cores[i]
+  is found at index i*len(msr_list)+j
+  workers : size of the thread pool spreading the cores. 0 reads sequentially"""
+  global snapshot_pool
+  global snapshot_workers
+  nmsr=len(msr_list)
+  offsets=[ msr_offset(offset) for offset in msr_list ]
+  result=array.array("Q", bytes(8*nmsr*len(cores)))
+
+  def read_core(i):
+    fd=msr_fd(cores[i])
+    base=i*nmsr
+    for j,offset in enumerate(offsets):
+      result[base+j]=int.from_bytes(os.pread(fd, 8, offset), "little", signed=False)
+
+  # open all the descriptors first, from this thread
+  for core in cores: msr_fd(core)
+
+  if workers:
+    if workers!=snapshot_workers:
+      if snapshot_pool is not None: snapshot_pool.shutdown()
+      snapshot_pool=concurrent.futures.ThreadPoolExecutor(workers)
+      snapshot_workers=workers
+    list(snapshot_pool.map(read_core, range(len(cores))))
+  else:
+    for i in range(len(cores)): read_core(i)
+
+  return result
+
+
+# mailbox polling. a command typically completes in a few micro seconds : spin on the busy bit
+# for a few reads, then back off exponentially from 1us up to 1ms, until the deadline.
+MAILBOX_SPIN=32
+MAILBOX_MIN_BACKOFF=1e-6
+MAILBOX_MAX_BACKOFF=1e-3
+mailbox_timeout=.1      # default deadline of a mailbox wait, in seconds
+
+# (mailbox, command) -> { "count", "total", "max", "polls", "timeouts" }, latencies in seconds.
+# mailbox is the MSR ("150h") here, or the transport name for mailboxes.py
+mailbox_stats={}
+mailbox_stats_lock=threading.Lock()     # mailboxes.queue() completes commands from several threads
+# (core, offset) -> (key, start) of the last command written, until its completion is read
+mailbox_pending={}
+
+
+def poll_busy(read, busy_bit, timeout=None):
+  """calls read() until bit busy_bit of the register it returns is clear.
+  returns (register bytes, number of reads). raises an Exception past the deadline"""
+  if timeout is None: timeout=mailbox_timeout
+  deadline=time.perf_counter()+timeout
+  backoff=MAILBOX_MIN_BACKOFF
+  polls=0
+  while True:
+    chunk=read()
+    polls+=1
+    if not int.from_bytes(chunk, "little", signed=False)>>busy_bit & 1:
+      return chunk, polls
+    if time.perf_counter()>=deadline:
+      raise Exception("mailbox still BUSY after {0:.0f} us, {1} reads".format(timeout*1e6, polls))
+    if polls>MAILBOX_SPIN:
+      time.sleep(backoff)
+      backoff=min(2*backoff, MAILBOX_MAX_BACKOFF)
+
+
+def mailbox_command(data):
+  """command byte of a mailbox interface register : 39-32 for a 8 bytes mailbox, 7-0 for 4 bytes"""
+  return data[4] if len(data)==8 else data[0]
+
+
+def record_mailbox(key, latency, polls, timeout=False):
+  with mailbox_stats_lock:
+    stats=mailbox_stats.setdefault(key, { "count": 0, "total": 0., "max": 0., "polls": 0, "timeouts": 0 })
+    stats["count"]+=1
+    stats["total"]+=latency
+    stats["max"]=max(stats["max"], latency)
+    stats["polls"]+=polls
+    if timeout: stats["timeouts"]+=1
+
+
+def mailbox_report():
+  """one line per command : number of transactions, mean and max latency, busy reads, timeouts"""
+  lines=[]
+  for (mailbox,command),stats in sorted(mailbox_stats.items()):
+    lines.append("{0:>7s} mailbox command {1:02X}h : {2:5d} x  mean {3:9.1f} us  max {4:9.1f} us  "
+                 "{5:5.1f} reads  {6} timeouts".format(
+                 mailbox, command, stats["count"], stats["total"]/stats["count"]*1e6, stats["max"]*1e6,
+                 stats["polls"]/stats["count"], stats["timeouts"]))
+  return "\n".join(lines)
+
+
+def read_mailbox(offset, size, core=0, timeout=None):
+  """waits for the mailbox at MSR offset to be idle, and returns it.
+  the busy bit is the most significant bit. the whole register is read, as the msr driver wants"""
+  fd=msr_fd(core)
+  key,start=mailbox_pending.pop((core, offset), (None, None))
+  try:
+    chunk,polls=poll_busy(lambda: os.pread(fd, size, msr_offset(offset)), 8*size-1, timeout)
+  except Exception:
+    if key is not None: record_mailbox(key, time.perf_counter()-start, 0, True)
+    raise
+  if key is not None:
+    record_mailbox(key, time.perf_counter()-start, polls)
+  return chunk
+
+
+def write_mailbox(offset, size, data, core=0, timeout=None):
+  """waits for the mailbox at MSR offset to be idle, then writes data (busy bit set) to it.
+  the next read_mailbox() on the same core and offset completes the transaction statistics"""
+  fd=msr_fd(core)
+  poll_busy(lambda: os.pread(fd, size, msr_offset(offset)), 8*size-1, timeout)
+  mailbox_pending[core, offset]=( ("{0:X}h".format(offset), mailbox_command(data)), time.perf_counter() )
+  return os.pwrite(fd, data, msr_offset(offset))
 
 
 ##### MSR 65Ch PLATFORM_POWER_LIMIT_SRVR ##########################################################
 def read_PLATFORM_POWER_LIMIT_SRVR():
   # Platform power limit
   rd_chunk=rdmsr(0x65C, 8)   # only ready CPU0
-  swapped=bitstruct.byteswap("8",rd_chunk)
   lock,power_limit2_time,critical_power_clamp2,power_limit2_en, power_limit2,\
        power_limit1_time,critical_power_clamp1,power_limit1_en, power_limit1 = \
-    bitstruct.unpack("b1 p5 u7 b1 b1 u5 p6 u7 b1 b1 u17", swapped)
+    bitfield.unpack("b1 p5 u7 b1 b1 u5 p6 u7 b1 b1 u17", rd_chunk)
 
   if lock:
     lock=red("LOCKED")  
@@ -131,8 +337,7 @@ def read_VR_CURRENT_CONFIG(core=0):
   # Package-level maximum power limit (in Watts)
   # It is a proactive, instantaneous limit.
   rd_chunk=rdmsr(0x601, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  lock,current_limit = bitstruct.unpack("p32 b1 p18 u13", swapped)
+  lock,current_limit = bitfield.unpack("p32 b1 p18 u13", rd_chunk)
 
   if lock:
     lock=red("LOCKED")  
@@ -148,8 +353,7 @@ def read_VR_CURRENT_CONFIG(core=0):
 
 def write_VR_CURRENT_CONFIG(current_limit, core=0):
   """current_limit : in unit A"""
-  swapped=bitstruct.pack("p32 b1 p18 u13", False, current_limit * 8 )
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
+  wr_chunk=bitfield.pack("p32 b1 p18 u13", False, current_limit * 8 )
   wrmsr(0x601, wr_chunk, core)
 
 
@@ -166,10 +370,9 @@ def write_VR_CURRENT_CONFIG(current_limit, core=0):
 def read_VR_MISC_CONFIG(core=0):
   # Input voltage regulator configuration parameters
   rd_chunk=rdmsr(0x603, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
   idle_entry_decay_enable,idle_entry_ramp_rate,idle_exit_ramp_rate,iout_slope,iout_offset,min_vid, \
-  leak_load_line_r,idle_load_line_r,dynamic_load_line_r = bitstruct.unpack(
-          "p11 b1 b1 b1 u10 s8 u8 u8 u8 u8", swapped)
+  leak_load_line_r,idle_load_line_r,dynamic_load_line_r = bitfield.unpack(
+          "p11 b1 b1 b1 u10 s8 u8 u8 u8 u8", rd_chunk)
 
   # IOUT_SLOPE is a scalar applied to dIout before it is consumed by the CPU
   # it represents a 1.x number in u10.1.9 format (0.0 to 2.0)
@@ -197,9 +400,8 @@ def write_VR_MISC_CONFIG(idle_entry_decay_enable,idle_entry_ramp_rate,idle_exit_
   # encode iout_offset as x.11 integer
   iout_offset=math.floor(iout_offset*math.pow(2,11))
 
-  swapped=bitstruct.pack("p11 b1 b1 b1 u10 s8 u8 u8 u8 u8",idle_entry_decay_enable,idle_entry_ramp_rate,idle_exit_ramp_rate,iout_slope,
+  wr_chunk=bitfield.pack("p11 b1 b1 b1 u10 s8 u8 u8 u8 u8",idle_entry_decay_enable,idle_entry_ramp_rate,idle_exit_ramp_rate,iout_slope,
                          iout_offset,min_vid, leak_load_line_r,idle_load_line_r,dynamic_load_line_r)
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
   wrmsr(0x603, wr_chunk, core)
 
 
@@ -212,9 +414,8 @@ def read_FLEX_RATIO(core=0):
           "processors in the system. The value in the FLEX_RATIO take effect on the next "\
           "reset based on the value of FLEX_EN."
   rd_chunk=rdmsr(0x194, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
   oc_lock,oc_bins,enable,flex_ratio,oc_extra_voltage = \
-    bitstruct.unpack("p43 b1 u3 b1 u8 u8", swapped)
+    bitfield.unpack("p43 b1 u3 b1 u8 u8", rd_chunk)
 
   result=[ oc_lock,oc_bins,enable,flex_ratio,oc_extra_voltage ]
 
@@ -247,9 +448,8 @@ def write_FLEX_RATIO(oc_lock,oc_bins,enable,flex_ratio,oc_extra_voltage, core=0)
 #  oc_lock=True
 #  oc_bins=7
 #  enable=False
-  swapped=bitstruct.pack("p43 b1 u3 b1 u8 u8",
+  wr_chunk=bitfield.pack("p43 b1 u3 b1 u8 u8",
                           oc_lock,oc_bins,enable,flex_ratio,oc_extra_voltage )
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
   wrmsr(0x194, wr_chunk, core)
 
     
@@ -258,9 +458,8 @@ def read_TEMPERATURE_TARGET(core=0):
   # I used info from 20.143 TEMPERATURE_TARGET
   comment="Legacy register holding temperature related constants for Platform use."
   rd_chunk=rdmsr(0x1A2, 4, core)
-  swapped=bitstruct.byteswap("4",rd_chunk)
   locked,tj_max_tcc_offset,ref_temp,temperature,tcc_offset_clamping_bit,tcc_offset_time_window = \
-    bitstruct.unpack("b1 p1 u6 u8 u8 b1 u7", swapped)
+    bitfield.unpack("b1 p1 u6 u8 u8 b1 u7", rd_chunk)
 
   result=[ locked,tj_max_tcc_offset,ref_temp,temperature,
            tcc_offset_clamping_bit,tcc_offset_time_window ]
@@ -314,14 +513,13 @@ def read_TURBO_RATIO_LIMIT(core=0):
 ##### MSR 1FCh POWER CTL ##########################################################################
 def read_POWER_CTL(core=0):
   rd_chunk=rdmsr(0x1FC, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
   pch_neg_disable, ltr_iio_disable, pwr_perf_tuning_cfg_mode, pwr_perf_tuning_enable_dyn_switching, \
   pwr_perf_tuning_disable_sapm_ctrl, therm_rsvd_en, cstate_prewake_disable, disable_autonomous, \
   disable_ook, disable_sa_optimization, disable_ring_ee, vr_therm_alert_disable, prochot_lock, \
   prochot_response, dis_prochot_out, rth_disable, ee_turbo_disable, pwr_perf_platfrm_ovr, \
   phold_sr_disable, phold_cst_prevention_init, fast_brk_int_en, fast_brk_snp_en, \
-  sapm_imc_c2_policy, c1e_enable, enable_bidir_prochot = bitstruct.unpack(
-          "p27 b1b1b1b1b1b1b1 p1 b1b1b1b1b1b1b1b1b1b1b1b1 u11 p1"+"b1"*5, swapped)
+  sapm_imc_c2_policy, c1e_enable, enable_bidir_prochot = bitfield.unpack(
+          "p27 b1b1b1b1b1b1b1 p1 b1b1b1b1b1b1b1b1b1b1b1b1 u11 p1"+"b1"*5, rd_chunk)
   flags=[]
   if pch_neg_disable: flags.append(  red("PCH_NEG"))
   else:               flags.append(green("PCH_NEG"))
@@ -341,16 +539,15 @@ def read_POWER_CTL(core=0):
 
 def write_POWER_CTL(VR_THERM_ALERT_DISABLE, core=0):
   rd_chunk=rdmsr(0x1FC, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
   pch_neg_disable, ltr_iio_disable, pwr_perf_tuning_cfg_mode, pwr_perf_tuning_enable_dyn_switching, \
   pwr_perf_tuning_disable_sapm_ctrl, therm_rsvd_en, cstate_prewake_disable, disable_autonomous, \
   disable_ook, disable_sa_optimization, disable_ring_ee, vr_therm_alert_disable, prochot_lock, \
   prochot_response, dis_prochot_out, rth_disable, ee_turbo_disable, pwr_perf_platfrm_ovr, \
   phold_sr_disable, phold_cst_prevention_init, fast_brk_int_en, fast_brk_snp_en, \
-  sapm_imc_c2_policy, c1e_enable, enable_bidir_prochot = bitstruct.unpack(
-          "p27 b1b1b1b1b1b1b1 p1 b1b1b1b1b1b1b1b1b1b1b1b1 u11 p1"+"b1"*5, swapped)
+  sapm_imc_c2_policy, c1e_enable, enable_bidir_prochot = bitfield.unpack(
+          "p27 b1b1b1b1b1b1b1 p1 b1b1b1b1b1b1b1b1b1b1b1b1 u11 p1"+"b1"*5, rd_chunk)
 
-  swapped=bitstruct.pack("p27 b1b1b1b1b1b1b1 p1 b1b1b1b1b1b1b1b1b1b1b1b1 u11 p1"+"b1"*5, 
+  wr_chunk=bitfield.pack("p27 b1b1b1b1b1b1b1 p1 b1b1b1b1b1b1b1b1b1b1b1b1 u11 p1"+"b1"*5, 
     pch_neg_disable, ltr_iio_disable, pwr_perf_tuning_cfg_mode, pwr_perf_tuning_enable_dyn_switching,
     pwr_perf_tuning_disable_sapm_ctrl, therm_rsvd_en, cstate_prewake_disable, disable_autonomous,
     disable_ook, disable_sa_optimization, disable_ring_ee, VR_THERM_ALERT_DISABLE, prochot_lock,
@@ -358,16 +555,14 @@ def write_POWER_CTL(VR_THERM_ALERT_DISABLE, core=0):
     phold_sr_disable, phold_cst_prevention_init, fast_brk_int_en, fast_brk_snp_en,
     sapm_imc_c2_policy, c1e_enable, enable_bidir_prochot)
 
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
   wrmsr(0x1FC, wr_chunk, core)
     
 
 ##### MSR 2A0h PRMRR BASE 0 #######################################################################
 def read_PRMRR_BASE_0(core=0):
   rd_chunk=rdmsr(0x2A0, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -375,9 +570,8 @@ def read_PRMRR_BASE_0(core=0):
 ##### MSR 2A1h PRMRR BASE 1 #######################################################################
 def read_PRMRR_BASE_1(core=0):
   rd_chunk=rdmsr(0x2A1, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -385,9 +579,8 @@ def read_PRMRR_BASE_1(core=0):
 ##### MSR 2A2h PRMRR BASE 2 #######################################################################
 def read_PRMRR_BASE_2(core=0):
   rd_chunk=rdmsr(0x2A2, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -395,9 +588,8 @@ def read_PRMRR_BASE_2(core=0):
 ##### MSR 2A3h PRMRR BASE 3 #######################################################################
 def read_PRMRR_BASE_3(core=0):
   rd_chunk=rdmsr(0x2A3, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -405,9 +597,8 @@ def read_PRMRR_BASE_3(core=0):
 ##### MSR 2A4h PRMRR BASE 4 #######################################################################
 def read_PRMRR_BASE_4(core=0):
   rd_chunk=rdmsr(0x2A4, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -415,9 +606,8 @@ def read_PRMRR_BASE_4(core=0):
 ##### MSR 2A5h PRMRR BASE 5 #######################################################################
 def read_PRMRR_BASE_5(core=0):
   rd_chunk=rdmsr(0x2A5, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -425,9 +615,8 @@ def read_PRMRR_BASE_5(core=0):
 ##### MSR 2A6h PRMRR BASE 6 #######################################################################
 def read_PRMRR_BASE_6(core=0):
   rd_chunk=rdmsr(0x2A6, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -435,9 +624,8 @@ def read_PRMRR_BASE_6(core=0):
 ##### MSR 2A7h PRMRR BASE 7 #######################################################################
 def read_PRMRR_BASE_7(core=0):
   rd_chunk=rdmsr(0x2A7, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
-  base,configured,memtype = bitstruct.unpack(
-          "p12 u40 p8 b1 u3", swapped)
+  base,configured,memtype = bitfield.unpack(
+          "p12 u40 p8 b1 u3", rd_chunk)
 
   return base,configured,memtype
 
@@ -468,12 +656,11 @@ def read_PRMRR_BASE(prmrr=0, core=0):
 def read_PLATFORM_INFO(core=0):
   comment="This register contains read_only package level ratio information"
   rd_chunk=rdmsr(0xCE, 8, core)
-  swapped=bitstruct.byteswap("8",rd_chunk)
   smm_supovr_state,optane_2lm,edram,min_operating_ratio,max_efficiency_ratio,asa,timed_mwait,\
   peg2dmidis,bios_guard,config_tdp_levels,lpm,cpuid_faulting,prg_tj_offset,prg_tdp_lim,\
   prg_turbo_ratio,sample,fivr_rfi_tuning,ocvolt_ovrd,ppin,rar,smm_save_cap,\
   max_non_turbo_lim_ratio= \
-    bitstruct.unpack("p4 b1 b1 b1 p1 u8 u8 p1 b1 b1 b1 b1 u2 b1 b1 b1 b1 b1 b1 p1 b1 b1 b1 p5 b1 b1 u8 p8", swapped)
+    bitfield.unpack("p4 b1 b1 b1 p1 u8 u8 p1 b1 b1 b1 b1 u2 b1 b1 b1 b1 b1 b1 p1 b1 b1 b1 p5 b1 b1 u8 p8", rd_chunk)
 
   flags=[]
 
@@ -558,36 +745,32 @@ def read_PACKAGE_RAPL_LIMIT_CFG(core=0):
 "                                        Secondary Power Plane (GT) via PRIMARY_PLANE_TURBO_POWER_LIMIT_MSR\n" \
 "                                        and SECONDARY_PLANE_TURBO_POWER_LIMIT_MSR"
   rd_chunk=rdmsr(0x610, 8, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  lim_lock,_,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,_,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 = \
-    bitstruct.unpack("b1 u7 u2 u5 b1 b1 u15 u8 u2 u5 b1 b1 u15", swapped)
-  if lim_lock:
+  limit=layouts.scale(layouts.MSR_PACKAGE_RAPL_LIMIT, layouts.decode(layouts.MSR_PACKAGE_RAPL_LIMIT, rd_chunk))
+  if limit["lim_lock"]:
     lock=red("LOCKED")
   else:
     lock=green("UNLOCKED")
 
-  if clmp_lim_2:
+  if limit["clmp_lim_2"]:
     clamp2=green("can go below P1")
   else:
     clamp2=red("is limited between P0 and P1")
 
-  if clmp_lim_1:
+  if limit["clmp_lim_1"]:
     clamp1=green("can go below P1")
   else:
     clamp1=red("is limited between P0 and P1")
 
-  if lim_2_en:
+  if limit["lim_2_en"]:
     pl2enable=red("ENABLED")
   else:
     pl2enable=green("DISABLED")
 
-  if lim_1_en:
+  if limit["lim_1_en"]:
     pl1enable=red("ENABLED")
   else:
     pl1enable=green("DISABLED")
 
-  time_window2=(1+lim_2_time_x/10)*2**lim_2_time_y
-  time_window1=(1+lim_1_time_x/10)*2**lim_1_time_y
   print( "read_PACKAGE_RAPL_LIMIT_CFG[{0}] 610h = {1:016X}h".format(
          core, int.from_bytes(rd_chunk,"little",signed=False)))
   return "{0}\n" \
@@ -596,10 +779,10 @@ def read_PACKAGE_RAPL_LIMIT_CFG(core=0):
   "  PBM2               : {4}\n" \
   "  PKG_PWR_LIM_1_TIME : {5:7.1f} ms\t\tThe maximal time window is bounded by PKG_PWR_SKU_MSR[PKG_MAX_WIN]\n" \
   "  PKG_PWR_LIM_1      : {6:3.0f} W ({7})\tPPL1/Package Power Limitation 1\n" \
-  "  PBM1               : {8}".format(lock,time_window2*pcu["time_unit"],
-                                           lim_2       *pcu["pwr_unit"], pl2enable, clamp2,
-                                           time_window1*pcu["time_unit"]*1000,
-                                           lim_1       *pcu["pwr_unit"], pl1enable, clamp1)
+  "  PBM1               : {8}".format(lock,limit["time_window_2"],
+                                           limit["lim_2"], pl2enable, clamp2,
+                                           limit["time_window_1"]*1000,
+                                           limit["lim_1"], pl1enable, clamp1)
 
 
 def write_PACKAGE_RAPL_LIMIT_CFG(lim_1_time_x, lim_1_time_y, lim_1,
@@ -614,21 +797,23 @@ ppl1_time, ppl2_time : tau (?), time window (ms)"""
   clmp_lim_1=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
   clmp_lim_2=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
 
-  swapped=bitstruct.pack("b1 p7 u2 u5 b1 b1 u15 p8 u2 u5 b1 b1 u15", 
-                          lim_lock,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 )
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
+  wr_chunk=layouts.encode(layouts.MSR_PACKAGE_RAPL_LIMIT,
+                          { "lim_lock": lim_lock,
+                            "lim_2_time_x": lim_2_time_x, "lim_2_time_y": lim_2_time_y,
+                            "clmp_lim_2": clmp_lim_2, "lim_2_en": lim_2_en, "lim_2": lim_2,
+                            "lim_1_time_x": lim_1_time_x, "lim_1_time_y": lim_1_time_y,
+                            "clmp_lim_1": clmp_lim_1, "lim_1_en": lim_1_en, "lim_1": lim_1 } )
   wrmsr(0x610, wr_chunk, core)
 
     
 ##### MSR 611h PACKAGE ENERGY STATUS ########################################################
-def read_PACKAGE_ENERGY_TIME_STATUS(core=0):
+def read_PACKAGE_ENERGY_STATUS(core=0):
   """Package energy consumed by the entire CPU (including IA, GT, and uncore).
   Expressed in unit = PACKAGE_POWER_SKU[ ENERGY_UNIT ] ( 61 uJ )
   """
 
   rd_chunk=rdmsr(0x611, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  total_energy_consumed= bitstruct.unpack("u32", swapped)
+  total_energy_consumed= bitfield.unpack("u32", rd_chunk)[0]
 
   return total_energy_consumed * pcu[ "energy_unit" ]
   
@@ -641,9 +826,8 @@ def read_PACKAGE_ENERGY_TIME_STATUS(core=0):
   """
 
   rd_chunk=rdmsr(0x612, 8, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-#  total_time_elapsed, total_energy_consumed= bitstruct.unpack("u32 u32", swapped)
-  total_time_elapsed, high, low= bitstruct.unpack("u32 u18 u14", swapped)
+#  total_time_elapsed, total_energy_consumed= bitfield.unpack("u32 u32", rd_chunk)
+  total_time_elapsed, high, low= bitfield.unpack("u32 u18 u14", rd_chunk)
 
   u18_14=high + low * pcu[ "energy_unit" ] 
   return total_time_elapsed    * pcu[   "time_unit" ], \
@@ -653,31 +837,27 @@ def read_PACKAGE_ENERGY_TIME_STATUS(core=0):
 
 def write_PACKAGE_ENERGY_TIME_STATUS(elapsed_time, consumed_energy, core=0):
   # i skipped the unit conversion, because i only intent to write 0  
-  swapped=bitstruct.pack("u32 u32", elapsed_time, consumed_energy)
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
+  wr_chunk=bitfield.pack("u32 u32", elapsed_time, consumed_energy)
   wrmsr(0x612, wr_chunk, core)
 
 
 ##### MSR 613h PACKAGE RAPL PERF STATUS #####################################################
 def read_PACKAGE_RAPL_PERF_STATUS(core=0):
-  """counts time spent in lower than requested P-state, due to power constraint. unknown unit.
-  guessing pcu[ "time_unit" ] but using text :
-  resolution of 1/1024 s  
+  """time spent in lower than requested P-state, due to power constraint, in s.
+  counts in pcu[ "time_unit" ], like the time field of MSR 612h (1/1024 s on SPR)
   """
 
   rd_chunk=rdmsr(0x613, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  count= bitstruct.unpack("u32", swapped)[0]
+  count= bitfield.unpack("u32", rd_chunk)[0]
 
-  return count * 1024
+  return count * pcu[ "time_unit" ]
   
 
 ##### MSR 614h PACKAGE_POWER_SKU ############################################################
 def read_PACKAGE_POWER_SKU(core=0):
   rd_chunk=rdmsr(0x614, 8, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
   pkg_max_win_x, pkg_max_win_y,pkg_max_pwr, pkg_min_pwr, pkg_tdp= \
-    bitstruct.unpack("p9 u2 u5 p1 u15 p1 u15 p1 u15", swapped)
+    bitfield.unpack("p9 u2 u5 p1 u15 p1 u15 p1 u15", rd_chunk)
   pkg_max_win = (1+pkg_max_win_x/10)*2**pkg_max_win_y
 
   return """maximal time window = {0:3.2f} ms    maximal package power = {1:3.0f}W
@@ -695,8 +875,7 @@ def read_DRAM_ENERGY_STATUS(core=0):
   """
 
   rd_chunk=rdmsr(0x619, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  high, low= bitstruct.unpack("u18 u14", swapped)
+  high, low= bitfield.unpack("u18 u14", rd_chunk)
   # Old school u18.14 fixed-point fractional representation
   # the fractional part on 14 bits, corresponds to the energy unit, defined as 1/2^14 in Joule.
   # they are 2^14 buckets of 61uJ each, totalizing 1J when all buckets are used.
@@ -716,8 +895,7 @@ def read_PRIMARY_PLANE_ENERGY_STATUS(core=0):
   """
 
   rd_chunk=rdmsr(0x639, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  energy_value= bitstruct.unpack("u32", swapped)[0]
+  energy_value= bitfield.unpack("u32", rd_chunk)[0]
 
   return energy_value * pcu[ "energy_unit" ] # in Joule
   
@@ -725,10 +903,9 @@ def read_PRIMARY_PLANE_ENERGY_STATUS(core=0):
 ##### MSR 1A0h IA32_MISC_ENABLE #############################################################
 def read_IA32_MISC_ENABLE(core=0):
   rd_chunk=rdmsr(0x1A0, 8, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
   turbo_mode, tpr_message, limit_cpuid_maxval,monitor_fsm,enhanced_speedstep,pebs,bts,perfmon,\
   tcc, fast_strings= \
-    bitstruct.unpack("p25 b1 p14 b1 b1 p3 b1 p1 b1 p3 b1 b1 p3 b1 p3 b1 p2 b1", swapped)
+    bitfield.unpack("p25 b1 p14 b1 b1 p3 b1 p1 b1 p3 b1 b1 p3 b1 p3 b1 p2 b1", rd_chunk)
   flags=[]  
   if turbo_mode: flags.append(          "[TURBO]" )
   else:          flags.append(highlight("[TURBO]"))
@@ -777,18 +954,16 @@ def read_IA32_MISC_ENABLE(core=0):
 # testé, la fonction marche
 def write_IA32_MISC_ENABLE(turbo_mode, tpr_message, limit_cpuid_maxval, monitor_fsm, enhanced_speedstep,\
                            pebs,bts,perfmon, tcc, fast_strings, core=0):
-  swapped=bitstruct.pack("p25 b1 p14 b1 b1 p3 b1 p1 b1 p3 b1 b1 p3 b1 p3 b1 p2 b1",
+  wr_chunk=bitfield.pack("p25 b1 p14 b1 b1 p3 b1 p1 b1 p3 b1 b1 p3 b1 p3 b1 p2 b1",
                          turbo_mode, tpr_message, limit_cpuid_maxval,monitor_fsm,enhanced_speedstep,\
                          pebs,bts,perfmon, False, fast_strings)
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
   wrmsr(0x1A0, wr_chunk, core)
 
 
 ##### MSR 64Ch TURBO ACTIVATION RATIO (TAR) #################################################
 def read_TURBO_ACTIVATION_RATIO(core=0):
   rd_chunk=rdmsr(0x64C, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  tar_lock,max_tar= bitstruct.unpack("b1 p23 u8", swapped)
+  tar_lock,max_tar= bitfield.unpack("b1 p23 u8", rd_chunk)
 
   if tar_lock: tar_lock=red("LOCKED")
   else:        tar_lock=green("UNLOCKED")
@@ -810,8 +985,7 @@ def write_TURBO_ACTIVATION_RATIO(max_tar, core=0):
 ##### MSR 64Dh PLATFORM ENERGY STATUS ################################################################
 def read_PLATFORM_ENERGY_STATUS(core=0):
   rd_chunk=rdmsr(0x64D, 8, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  timestamp, energy= bitstruct.unpack("u32 u32", swapped)
+  timestamp, energy= bitfield.unpack("u32 u32", rd_chunk)
 
   # not pultiplying by energy unit because ... am not sure of the unit
   return timestamp, energy
@@ -820,11 +994,10 @@ def read_PLATFORM_ENERGY_STATUS(core=0):
 ##### MSR 64Fh CORE PERF LIMIT REASONS ###############################################################
 def read_CORE_PERF_LIMIT_REASONS(core=0):
   rd_chunk=rdmsr(0x64F, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
   clipped_any_log,tvb_log,turbo_atten_log,max_turbo_limit_log,pbm_pl2_log,pbm_pl1_log,_, \
     other_log,vr_tdc_log,vr_thermalert_log,ratl_log,rsr_limit_log,peci_pcs_limit_log,_, \
     thermal_log,prochot_log,clipped_any,tvb,turbo_atten,max_turbo_limit,pbm_pl2,pbm_pl1,_, \
-    other,vr_tdc,vr_thermalert,ratl,rsr_limit,peci_pcs,_,thermal,prochot= bitstruct.unpack("b1"*32, swapped)
+    other,vr_tdc,vr_thermalert,ratl,rsr_limit,peci_pcs,_,thermal,prochot= bitfield.unpack("b1"*32, rd_chunk)
 
   # 31
   if clipped_any_log:
@@ -914,8 +1087,7 @@ def read_CORE_PERF_LIMIT_REASONS(core=0):
 
 def reset_CORE_PERF_LIMIT_REASONS(core=0):
   rd_chunk=rdmsr(0x64F, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  myint=bitstruct.unpack("u32", swapped)[0]
+  myint=bitfield.unpack("u32", rd_chunk)[0]
   wrmsr(0x64F, ((myint <<1)>>1).to_bytes(4,byteorder="little",signed=False), core)
   # wrmsr(0x64F, int(0).to_bytes(4,byteorder='little',signed=False), core)
 
@@ -923,8 +1095,7 @@ def reset_CORE_PERF_LIMIT_REASONS(core=0):
 ##### MSR 665h PLATFORM_POWER_INFO ###################################################################
 def read_PLATFORM_POWER_INFO(core=0):
   rd_chunk=rdmsr(0x665, 8, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  max_tw,max_ppl2,min_ppl1,max_ppl1= bitstruct.unpack("p8 u7 u17 u15 u17", swapped)
+  max_tw,max_ppl2,min_ppl1,max_ppl1= bitfield.unpack("p8 u7 u17 u15 u17", rd_chunk)
   
   return max_tw   * pcu[ "time_unit" ], \
          max_ppl2 * pcu[  "pwr_unit" ], \
@@ -938,19 +1109,19 @@ def write_PLATFORM_POWER_INFO( max_tw, max_ppl2, min_ppl1, max_ppl1, core=0):
   min_ppl1 = int( min_ppl1 / pcu[ "pwr_unit" ] )
   max_ppl1 = int( max_ppl1 / pcu[ "pwr_unit" ] )
 
-  swapped=bitstruct.pack("p8 u7 u17 u15 u17", max_tw, max_ppl2, min_ppl1, max_ppl1)
-  wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
+  wr_chunk=bitfield.pack("p8 u7 u17 u15 u17", max_tw, max_ppl2, min_ppl1, max_ppl1)
   wrmsr(0x665, wr_chunk, core)
 
 
 ##### MSR 666h PLATFORM RAPL SOCKET PERF STATUS ######################################################
 def read_PLATFORM_RAPL_SOCKET_PERF_STATUS(core=0):
+  """time the socket was throttled by the platform RAPL limit, in s.
+  counts in pcu[ "time_unit" ], like MSR 613h
+  """
   rd_chunk=rdmsr(0x666, 4, core)
-  swapped=bitstruct.byteswap("{}".format(len(rd_chunk)),rd_chunk)
-  count= bitstruct.unpack("u32", swapped)[0]
+  count= bitfield.unpack("u32", rd_chunk)[0]
 
-  # not multiplying by energy unit because ... am not sure of the unit
-  return count
+  return count * pcu[ "time_unit" ]
   
 
 ###################################################################################################
@@ -962,8 +1133,7 @@ def read_PLATFORM_RAPL_SOCKET_PERF_STATUS(core=0):
 def init():
   # let's read the MSR_RAPL_POWER_UNIT to initialize the fundamental units
   msr=rdmsr(0x606, 4)
-  msr=bitstruct.byteswap("{}".format(len(msr)),msr)
-  msr_time_unit,msr_energy_unit,msr_pwr_unit = bitstruct.unpack("p12 u4 p4 u4 p4 u4", msr)
+  msr_time_unit,msr_energy_unit,msr_pwr_unit = bitfield.unpack("p12 u4 p4 u4 p4 u4", msr)
   pcu[  "time_unit"]=1/2**msr_time_unit
   pcu["energy_unit"]=1/2**msr_energy_unit
   pcu[   "pwr_unit"]=1/2**msr_pwr_unit
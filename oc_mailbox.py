@@ -11,6 +11,8 @@ import bitstruct
 
 from useful_stuff import *
 import msr
+import mailboxes
+from mailboxes import wr_ocmailbox, rd_ocmailbox
 
 ###################################################################################################
 #
@@ -50,35 +52,6 @@ VCC_DDRD      = 8
 VCC_DDRA      = 9
 
 
-def wr_ocmailbox(param2, param1, command, data, core=0):
-  buffer=struct.pack("IBBBB", data, command, param1, param2, 0b10000000)
-  if debug:
-    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", buffer)
-    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
-    sys.stdout.write("debug : write to OC_MAILBOX {0}h ( param2={1:02X} "\
-                     "param1={2:02X} command={3:02X} data={4:04X} )\n".format(
-                     blue(hexa),param2,param1,command,data) )
-  try:
-    msr.write_mailbox(0x150, 8, buffer, core)
-  except:
-    sys.stderr.write("Could not write {} to OC_MAILBOX, leaving.\n".format(buffer))
-    sys.exit(1)
-  return buffer  
-
-
-def rd_ocmailbox(core=0):
-  try:
-    chunk=msr.read_mailbox(0x150, 8, core)
-  except:
-    sys.stderr.write("Could not read the OC_MAILBOX, leaving.\n")
-    sys.exit(1)
-  if debug:
-    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", chunk)
-    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
-    sys.stdout.write("debug : read frm OC_MAILBOX {0}h\n".format( blue(hexa)) )
-  return chunk
-
-
 def mailbox_OC_CAPABILITY(domain):
     wr_chunk=wr_ocmailbox(0,domain,0x01, 0)
     rd_chunk=rd_ocmailbox()
@@ -523,6 +496,9 @@ def init():
            epilog="(c) 2023 HA Quoc Viet" )
 
   parser.add_argument("--debug",  "-g", action="store_true", default=False)
+  parser.add_argument("--cache",  "-c", action="store_true", default=False,
+           help="keeps the fused and SKU answers of the mailboxes on disk until the next reboot "
+                "(see mailboxes.CACHE_FILE)")
   parser.add_argument("--device", "-d",                      default="0000:7f:1e",
            help="Device to read. Defaults to first module, first socket. "\
            "Use \"lspci -n | grep 3258\" to find yours. "
@@ -544,6 +520,8 @@ def main():
 
   args=init()
   debug = args.debug
+  mailboxes.debug = debug
+  if args.cache: mailboxes.persist_cache()
 
   print( "━"*35+" IA_CORE domain "+"━"*55 )
   domain=IA_CORE
@@ -615,5 +593,9 @@ def main():
   [ msr.write_VR_CURRENT_CONFIG(900, core) for core in range(NCPU) ]  # current_limit = 900A
   print( msr.read_VR_CURRENT_CONFIG(core=NCPU-1) )
 
+  if debug:
+    print( msr.mailbox_report() )
+    print( mailboxes.cache_report() )
+
 if __name__ == '__main__':
   main()
@@ -8,9 +8,15 @@ import struct
 import termios
 from textwrap import wrap
 import argparse
-import bitstruct
+import bitfield
+import layouts
+import capture
+import topology
+import ring
+import collector
+import energy
+import stats
 import threading
-import subprocess
 import multiprocessing
 
 from useful_stuff import *
@@ -79,6 +85,13 @@ wip=[
  (0x00, "────▀▄▄▀▀▀▀▀▄▄▀▀▀▀▀▀▀▄▄▀▀▀▀▀▄▄▀────────", 8, "")
  ]
 
+# register tables, indexed by CR number
+CRTable=[ PCU_CR0.registers,  PCU_CR1.registers, PCU_CR2.registers, PCU_CR3.registers,
+          PCU_CR4.registers, wip, PCU_CR6.registers, wip]
+# sampling intervals of their registers, see collector.py
+CRSampling=[ PCU_CR0.sampling, PCU_CR1.sampling, PCU_CR2.sampling, PCU_CR3.sampling,
+             PCU_CR4.sampling, {}, PCU_CR6.sampling, {}]
+
 
 ###################################################################################################
 #
@@ -121,6 +134,22 @@ def update_display(config, registers):
       print( "{0:24s}{1}".format( text, comment(reg) ) )
   
   
+def draw_frame(snapshot, CRindex, PCUindex, nPCU, status=None):
+  """clears the terminal, prints the CPU and CR headers, then decodes snapshot,
+  the 256 bytes of CR #CRindex of one PCU"""
+  CPUheader=[ "[CPU{}]".format(i) for i in range(1,nPCU+1) ]
+  CPUheader[PCUindex]=highlight(CPUheader[PCUindex])
+  CRheader=["[CR0]", "[CR1]", "[CR2]", "[CR3]", "[CR4]", "[CR5]", "[CR6]", "[CR7]"][:nCR]
+  if debug: print("draw_frame: CRindex={0} CRheader={1}".format(CRindex, CRheader))
+  CRheader[CRindex]=highlight(CRheader[CRindex])
+  energy.displayed=PCUindex   # the power the PCU_CR0 decoders report
+  #move cursor to upper left corner
+  print( '\033[0;37;40m;\033[1;1f\033[2J'+"Dumping registers for :", " ".join(CPUheader))
+  print( "PCU registers :", " ".join(CRheader))
+  if status is not None: print(status)
+  update_display(snapshot, CRTable[CRindex])
+
+
 ###################################################################################################
 #
 #  1. The orchestrator is the backend. launches threads and processus as necessary
@@ -138,41 +167,31 @@ def orchestrator( args, PCUTable ):
   nPCU=len(PCUTable)
   if debug : print("orchestrator: nCR={0} nPCU={1}".format(nCR,nPCU))
 
-  # a pair of communication pipes, for each readers. one reader per RC field (8)
-  rcvcmd_pipe=[]
-  sndcmd_pipe=[]
-  # for each reader_slave, I.E. for each RC ...
-  for i in range(nCR):
-    rcvcmd_p,sndcmd_p = multiprocessing.Pipe(False)
-    rcvcmd_pipe.append(rcvcmd_p)
-    sndcmd_pipe.append(sndcmd_p)
-    #preload the pipe with the first PCU/CPU
-    sndcmd_p.send(PCUTable[0])
+  # the RAPL units of the first PCU, before the first sample reaches energy.feed : without the
+  # CR0 display, nothing else would set them
+  desc=layouts.PACKAGE_POWER_SKU_UNIT_CFG
+  with open(collector.config_path(PCUTable[0], 0), "rb") as f:
+    pcu.update(layouts.rapl_units(os.pread(f.fileno(), desc["size"], desc["offset"])))
 
-  bar1 = multiprocessing.Barrier(nCR+1)
-
-  config     = multiprocessing.RawArray('B', 256*nCR )        # unsigned chars (1 byte each)
-  new_config = multiprocessing.RawArray('B', 256*nCR )        # unsigned chars (1 byte each)
-
-  p=[ multiprocessing.Process( target=reader_slave,
-                               args  =(i, new_config, bar1, rcvcmd_pipe[i]) )
-      for i in range(nCR)
-    ]
-  for i in range(nCR): p[i].start()
+  # every CR of every PCU is sampled all the time, into one ring per (PCU, CR). see collector.py
+  # each sample feeds the energy counters, then the statistics of its socket
+  samples=collector.start(PCUTable, nCR, workers=args.workers, tables=CRTable, sampling=CRSampling,
+                          on_sample=stats.on_sample)
+  if debug:
+    for cr,plan in enumerate(samples["plans"]):
+      print("orchestrator: CR{0} reads {1} ranges, {2:.0f} bytes/s at most".format(cr, len(plan), collector.plan_rate(plan)))
+  rings=samples["rings"]
+  empty=bytes(ring.SLOT_SIZE)   # until the first sample of a ring
 
 
   # keyboard management in a separate process, because it mostly waits on input
   pkr = threading.Thread( target=keyreader, args=(sndkey_pipe,) )
   pkr.start()
 
-  CRTable=[ PCU_CR0.registers,  PCU_CR1.registers, PCU_CR2.registers, PCU_CR3.registers,
-            PCU_CR4.registers, wip, PCU_CR6.registers, wip]
   CRindex =0  # up to nCR-1
   PCUindex=0  # up to nCPU-1
   while True:
     time.sleep(.08)  # 12Hz
-    bar1.wait()
-    # while slaves are writing to new_config ...
 
     # process keyboard input, if there are any
     if rcvkey_pipe.poll():
@@ -187,173 +206,244 @@ def orchestrator( args, PCUTable ):
         else: CRindex=kk
       elif k=="right":
         PCUindex=(PCUindex+1)%nPCU
-        # for all eight RC reader_slaves, update the file/CPU to read  
-        [ sndcmd_pipe[i].send(PCUTable[PCUindex]) for i in range(nCR) ]  
       elif k=="left":
         PCUindex=(PCUindex-1)%nPCU
-        # for all eight RC reader_slaves, update the file/CPU to read  
-        [ sndcmd_pipe[i].send(PCUTable[PCUindex]) for i in range(nCR) ]  
       elif k=="a":
-        sndcmd_pipe[CRindex].send("HACK1")  
+        hack("HACK1", PCUTable[PCUindex], CRindex)
       elif k=="b":
-        sndcmd_pipe[CRindex].send("HACK2")  
+        hack("HACK2", PCUTable[PCUindex], CRindex)
       elif k=="esc":
         break  
 
       else:
         print("Could not decode "+k)
 
-    CPUheader=[ "[CPU{}]".format(i) for i in range(1,nPCU+1) ]
-    CPUheader[PCUindex]=highlight(CPUheader[PCUindex])
-    CRheader=["[CR0]", "[CR1]", "[CR2]", "[CR3]", "[CR4]", "[CR5]", "[CR6]", "[CR7]"][:nCR]
-    if debug: print("orchestrator: CRindex={0} CRheader={1}".format(CRindex, CRheader))
-    CRheader[CRindex]=highlight(CRheader[CRindex])
-    #move cursor to upper left corner
-    print( '\033[0;37;40m;\033[1;1f\033[2J'+"Dumping registers for :", " ".join(CPUheader))
-    print( "PCU registers :", " ".join(CRheader))
-    update_display(config[256*CRindex:256*(CRindex+1)], CRTable[CRindex]) 
-    for i in range(nCR): config[256*i:256*(i+1)]=new_config[256*i:256*(i+1)]
+    # decodes the last sample straight from the shared memory. Should the collector come back to
+    # that slot meanwhile (NSLOT samples later), the frame is torn : the next one will not be
+    current=ring.latest(rings[PCUindex][CRindex])
+    if current is None:
+      draw_frame(empty, CRindex, PCUindex, nPCU, "waiting for the first sample")
+    else:
+      seq,timestamp,snapshot=current
+      status=None
+      if debug: status="sample #{0}, {1:.1f} ms old".format(seq, (time.monotonic_ns()-timestamp)/1e6)
+      draw_frame(snapshot, CRindex, PCUindex, nPCU, status)
+      if debug and not ring.valid(rings[PCUindex][CRindex], seq): print("orchestrator: torn frame")
 
   # loop was exited
-  [ sndcmd_pipe[i].send("ESC") for i in range(nCR) ]  
-  bar1.abort()
-  [ p[i].join()                for i in range(nCR) ]  
+  collector.stop(samples)
   pkr.join()
   return
 
 
-# one reader per RC ; i is the RC number. (1-8) rcvcmd_pipe will bring the file name to
-# open, which is related the the CPU we will be reading on (2-32)
-def reader_slave(i, config, barrier, rcvcmd_pipe):
-  fd=None  
+###################################################################################################
+#
+#  5. offline replay : feeds the snapshots of a capture file to the display, as if they came from
+#     the collector. No root, no sysfs needed.
+#     keys : 0-9 CR, left/right PCU, space pause, up/down seek 10s, +/- playback speed, esc quit
+#
+###################################################################################################
+def replayer( args ):
+  global debug
+  global nCR
+
+  header,records=capture.load(args.replay)
+  nCR=header["nCR"]
+  nPCU=len(header["PCUTable"])
+  pcu.update(header["units"])
+
+  # the recorder appends one frame (every CR of every PCU) at a time
+  nframe=capture.frame_count(header, records)
+  if nframe==0:
+    print("{} : no complete frame recorded".format(args.replay))
+    return
+  timestamps=capture.frame_timestamps(header, records)
+  start=int(timestamps[0])
+  end=int(timestamps[-1])
+  if debug: print("replayer: nCR={0} nPCU={1} frames={2}".format(nCR, nPCU, nframe))
+
+  rcvkey_pipe,sndkey_pipe = multiprocessing.Pipe(False)
+  pkr = threading.Thread( target=keyreader, args=(sndkey_pipe,) )
+  pkr.start()
+
+  CRindex =0
+  PCUindex=0
+  position=start
+  speed=args.speed
+  paused=False
   while True:
-    try:  
-      barrier.wait()
-    except:
-      break  
-        
-    # process the command channel first
-    if rcvcmd_pipe.poll():
-      cmd=rcvcmd_pipe.recv()
-      if cmd=="ESC":
-        break  
-      elif cmd=="HACK1":
-        """
-        command,subcommand =rcvcmd_pipe.recv()
-        mailbox_data,mailbox_interface=format_mail(0, command, subcommand)
-        fd.seek(0xA4)   # offset to MAILBOX_INTERFACE
-        # fd.write(mailbox_data)
-        fd.write(mailbox_interface)
-        """
-
-        # HACK : writing PACKAGE RAPL LIMIT CFG to increase PL1 and PL2 TDP, and time windows
-        if i == 0:               # if the user is watching RC0
-          fd.seek(0xE8)          # go to RAPL LIMIT CFG
-          reg=fd.read(8)
-          reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-          lim_lock,_,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,_,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 = \
-          bitstruct.unpack("b1 u7 u2 u5 b1 b1 u15 u8 u2 u5 b1 b1 u15", reg)
-          if not lim_lock:
-            # local constants
-            lim_lock=False  # When set, all settings in this register are locked and are treated as Read Only.
-            lim_1_en=True   # Because the cpu must maintain the power consumption to TDP, lim_1_en is always True
-            lim_2_en=True   # The Package PL2 is always enabled. Writing a 0 to the bit will have no effect.
-            clmp_lim_1=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
-            clmp_lim_2=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
-
-            lim_1=500*8
-            lim_2=764*8
-            lim_2_time_x=3
-            lim_1_time_x=3
-            lim_1_time_y=31
-            lim_2_time_y=31
-
-            swapped=bitstruct.pack("b1 p7 u2 u5 b1 b1 u15 p8 u2 u5 b1 b1 u15",
-                   lim_lock,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 )
-            wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
-            fd.seek(0xE8)
-            fd.write(wr_chunk)
-
-        # HACK : writing PLATFORM RAPL LIMIT, to maximize Plateform TDP and time window
-        # PLATEFORM is core + GT + uncore
-        elif i == 6:
-        # if the user is watching RC6
-          fd.seek(0xA8) 
-          # go to PLATEFORM RAPL LIMIT CFG
-          reg=fd.read(8)
-          reg=bitstruct.byteswap("{}".format(len(reg)),reg)
-          lim_lock,_,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,_,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 = \
-          bitstruct.unpack("b1 u7 u2 u5 b1 b1 u15 u8 u2 u5 b1 b1 u15", reg)
-          if not lim_lock:
-            # local constants
-            lim_lock=False  # When set, all settings in this register are locked and are treated as Read Only.
-            lim_1_en=True   # Because the cpu must maintain the power consumption to TDP, lim_1_en is always True
-            lim_2_en=True   # The Package PL2 is always enabled. Writing a 0 to the bit will have no effect.
-            clmp_lim_1=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
-            clmp_lim_2=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
-
-            lim_1=32767
-            lim_2=32767
-            lim_2_time_x=3
-            lim_1_time_x=3
-            lim_1_time_y=31
-            lim_2_time_y=31
-
-            swapped=bitstruct.pack("b1 p7 u2 u5 b1 b1 u15 p8 u2 u5 b1 b1 u15",
-                   lim_lock,lim_2_time_x,lim_2_time_y,clmp_lim_2,lim_2_en,lim_2,lim_1_time_x,lim_1_time_y,clmp_lim_1,lim_1_en,lim_1 )
-            wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
-            fd.seek(0xA8)
-            fd.write(wr_chunk)
-
-        # HACK : writing CONFIG TDP NOMINAL[TDP_RATIO]
-        elif i == 3:       # if the user is watching RC3
-          fd.seek(0xDC)    # go to CONFIG TDP NOMINAL
-          swapped=bitstruct.pack("u8", 40)
-          wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
-          fd.write(wr_chunk)
-
-      elif cmd=="HACK2":
-        if i==0:          # if the user is watching RC0
-
-          # HACK : increase CURRENT LIMIT from 550A to 700A. inactive, didn't work  
-          fd.seek(0xF8)   # go to VR CURRENT CONFIG CFG
-          psi3_threshold=0
-          psi2_threshold=0
-          psi1_threshold=0
-          lock=False
-          current_limit=700 * 8     # in units of .125A
-          swapped=bitstruct.pack("p2 u10 u10 u10 b1 p18 u13",
-                                 psi3_threshold,
-                                 psi2_threshold,
-                                 psi1_threshold,
-                                 lock,
-                                 current_limit)
-          wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
-          fd.write(wr_chunk)
-
-          # HACK : modify Pmax control bits
-          fd.seek(0xC0)   # go to VR CURRENT CONFIG CFG
-          swapped=bitstruct.pack("p29 b1 b1 b1", True, False, False)
-          wr_chunk=bitstruct.byteswap("{}".format(len(swapped)),swapped)
-          fd.write(wr_chunk)
+    time.sleep(.08)  # 12Hz, the pace of the live display
+    if not paused:
+      position=min(end, position+int(.08e9*speed))
 
+    if rcvkey_pipe.poll():
+      k=rcvkey_pipe.recv()
+      if k in "0123456789":
+        kk=int(k)
+        if kk>=nCR: continue    # ignore out of range requests
+        else: CRindex=kk
+      elif k=="right":
+        PCUindex=(PCUindex+1)%nPCU
+      elif k=="left":
+        PCUindex=(PCUindex-1)%nPCU
+      elif k=="space":
+        paused=not paused
+      elif k=="up":
+        position=min(end, position+10**10)
+      elif k=="down":
+        position=max(start, position-10**10)
+      elif k=="+":
+        speed*=2
+      elif k=="-":
+        speed/=2
+      elif k=="esc":
+        break
       else:
-        # it's a PCI bus device name
-        if fd is not None: fd.close()
-        # example : fd=open("/sys/bus/pci/devices/0001:3f:1e.{}/config".format(i),"rb")
-        fd=open("/sys/bus/pci/devices/{0}.{1}/config".format(cmd, i),"w+b", buffering=0)
-
-    # allowing for some un predicted misshaps
-    if fd is not None:
-      fd.seek(0)
-      config[256*i:256*(i+1)]= fd.read(256)
-
-  # the loop was escaped  
-  if fd is not None: fd.close()
-  if debug: print("reader #{} has exited".format(i) )
+        print("Could not decode "+k)
+
+    iframe=max(0, int(timestamps.searchsorted(position, "right"))-1)
+    status="replay {0} : {1:9.3f} / {2:.3f} s   speed x{3:g}   {4}".format(
+           args.replay, (position-start)/1e9, (end-start)/1e9, speed,
+           highlight("PAUSED") if paused else "")
+    config=capture.frame(header, records, iframe, PCUindex)
+    # the energy counters and statistics of the recorded frame, at their recorded time
+    for cr in range(nCR):
+      stats.on_sample(PCUindex, cr, config[256*cr:256*(cr+1)], int(timestamps[iframe]))
+    draw_frame(config[256*CRindex:256*(CRindex+1)], CRindex, PCUindex, nPCU, status)
+
+  pkr.join()
   return
 
 
+###################################################################################################
+#
+#  4. headless recorder : no terminal, no barrier. samples the config space of every CR of every
+#     PCU, and appends timestamped raw snapshots to a capture file. The statistics of every socket
+#     (see stats.py) are printed at the end
+#
+###################################################################################################
+def recorder( args, PCUTable ):
+  global debug
+  global nCR
+
+  # one descriptor per CR of each PCU, opened once. pread() avoids a seek() per sample
+  fds=[ (socket, cr, os.open(sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(device, cr)), os.O_RDONLY))
+        for socket,device in enumerate(PCUTable)
+        for cr in range(nCR) ]
+  nrecords=len(fds)
+  buffer=bytearray(capture.RECORD.size*nrecords)
+  period=int(1e9/args.rate)
+  if debug: print("recorder: {0} snapshots every {1} ns into {2}".format(nrecords, period, args.record))
+
+  # the RAPL units of the first PCU go in the capture header, for the offline decoders
+  desc=layouts.PACKAGE_POWER_SKU_UNIT_CFG
+  units=layouts.rapl_units(os.pread(fds[0][2], desc["size"], desc["offset"]))
+  pcu.update(units)
+
+  samples=0
+  overruns=0
+  with capture.open_writer(args.record, nCR, PCUTable, units) as f:
+    start=time.monotonic_ns()
+    deadline=start
+    try:
+      while args.duration==0 or deadline-start<args.duration*1e9:
+        for index,(socket,cr,fd) in enumerate(fds):
+          timestamp=time.monotonic_ns()
+          config=os.pread(fd, capture.CONFIG_SIZE, 0)
+          capture.pack_record(buffer, index, timestamp, socket, cr, config)
+          stats.on_sample(socket, cr, config, timestamp)
+        f.write(buffer)
+        samples+=1
+
+        # fixed rate : sleep until the next deadline. when late, skip the missed periods
+        deadline+=period
+        now=time.monotonic_ns()
+        if now<deadline:
+          time.sleep((deadline-now)/1e9)
+        else:
+          overruns+=1
+          deadline=now
+    except KeyboardInterrupt:
+      pass
+    elapsed=(time.monotonic_ns()-start)/1e9
+
+  for _,_,fd in fds: os.close(fd)
+  print("recorded {0} samples of {1} snapshots in {2:.1f} s ({3:.0f} Hz), {4} overruns".format(
+        samples, nrecords, elapsed, samples/elapsed if elapsed else 0, overruns))
+  print(stats.report(range(len(PCUTable))))
+
+
+def rapl_limit_hack(fd, desc, lim_1, lim_2):
+  """rewrites a RAPL LIMIT register (package or platform), unless it's locked :
+  PL1 and PL2 set to lim_1 and lim_2 (in pwr_unit), both enabled and clamped, longest time windows"""
+  fd.seek(desc["offset"])
+  limit=layouts.decode(desc, fd.read(desc["size"]))
+  if limit["lim_lock"]:
+    return
+
+  limit["lim_lock"]=False  # When set, all settings in this register are locked and are treated as Read Only.
+  limit["lim_1_en"]=True   # Because the cpu must maintain the power consumption to TDP, lim_1_en is always True
+  limit["lim_2_en"]=True   # The Package PL2 is always enabled. Writing a 0 to the bit will have no effect.
+  limit["clmp_lim_1"]=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
+  limit["clmp_lim_2"]=True # This bit is writable only when CPUID.(EAX=6):EAX[4] is set
+
+  limit["lim_1"]=lim_1
+  limit["lim_2"]=lim_2
+  limit["lim_1_time_x"]=3
+  limit["lim_2_time_x"]=3
+  limit["lim_1_time_y"]=31
+  limit["lim_2_time_y"]=31
+
+  fd.seek(desc["offset"])
+  fd.write(layouts.encode(desc, limit))
+
+
+def hack(cmd, device, i):
+  """the "a" (HACK1) and "b" (HACK2) keys : writes to CR #i of PCU device, the one on display"""
+  with open(sysfs("/sys/bus/pci/devices/{0}.{1}/config".format(device, i)),"r+b", buffering=0) as fd:
+    if cmd=="HACK1":
+      """
+      command,subcommand =rcvcmd_pipe.recv()
+      mailbox_data,mailbox_interface=format_mail(0, command, subcommand)
+      fd.seek(0xA4)   # offset to MAILBOX_INTERFACE
+      # fd.write(mailbox_data)
+      fd.write(mailbox_interface)
+      """
+
+      # HACK : writing PACKAGE RAPL LIMIT CFG to increase PL1 and PL2 TDP, and time windows
+      if i == 0:               # if the user is watching RC0
+        rapl_limit_hack(fd, layouts.PACKAGE_RAPL_LIMIT_CFG, 500*8, 764*8)
+
+      # HACK : writing PLATFORM RAPL LIMIT, to maximize Plateform TDP and time window
+      # PLATEFORM is core + GT + uncore
+      elif i == 6:             # if the user is watching RC6
+        rapl_limit_hack(fd, layouts.PLATFORM_RAPL_LIMIT, 32767, 32767)
+
+      # HACK : writing CONFIG TDP NOMINAL[TDP_RATIO]
+      elif i == 3:       # if the user is watching RC3
+        fd.seek(0xDC)    # go to CONFIG TDP NOMINAL
+        wr_chunk=bitfield.pack("u8", 40)
+        fd.write(wr_chunk)
+
+    elif cmd=="HACK2":
+      if i==0:          # if the user is watching RC0
+
+        # HACK : increase CURRENT LIMIT from 550A to 700A. inactive, didn't work  
+        fd.seek(0xF8)   # go to VR CURRENT CONFIG CFG
+        wr_chunk=layouts.encode(layouts.VR_CURRENT_CONFIG_CFG,
+                                { "psi3_threshold": 0,
+                                  "psi2_threshold": 0,
+                                  "psi1_threshold": 0,
+                                  "lock": False,
+                                  "current_limit": 700 * 8 })    # in units of .125A
+        fd.write(wr_chunk)
+
+        # HACK : modify Pmax control bits
+        fd.seek(0xC0)   # go to VR CURRENT CONFIG CFG
+        wr_chunk=bitfield.pack("p29 b1 b1 b1", True, False, False)
+        fd.write(wr_chunk)
+
+
 def init():
   # process cntl+C
   # signal.signal(signal.SIGINT, signal_handler)
@@ -362,56 +452,45 @@ def init():
            epilog="(c) 2023 HA Quoc Viet" )
 
   parser.add_argument("--debug",  "-g", action="store_true", default=False)
+  parser.add_argument("--record", "-r", metavar="FILE",      default=None,
+           help="headless mode : appends raw config space snapshots of every PCU to FILE" )
+  parser.add_argument("--rate",         type=float,          default=1000,
+           help="sampling rate of --record, in Hz. Defaults to 1000" )
+  parser.add_argument("--replay", "-p", metavar="FILE",      default=None,
+           help="offline mode : displays the snapshots recorded in FILE with --record" )
+  parser.add_argument("--speed",        type=float,          default=1,
+           help="playback speed of --replay. Defaults to 1" )
+  parser.add_argument("--duration",     type=float,          default=0,
+           help="duration of --record, in seconds. Defaults to 0 : until Ctrl+C" )
+  parser.add_argument("--workers","-w", type=int,            default=collector.WORKERS,
+           help="number of collector threads sampling the PCUs. Defaults to {}".format(collector.WORKERS) )
   #parser.add_argument("--device", "-d",                      default="0000:7f:1e",
   #         help="Device to read. Defaults to first module, first socket. "\
   #         "Use \"lspci -n | grep 3258\" to find yours. "
   #         "Example : --device 0000:ff:1e" )
   
-  # discover where the PCUs are
-  # dirty version using lspci. don't blame me, I have 10min before a meeting
-  PCUTable=[]
-  commande=[ "lspci", "-Ds", "1e.0" ] 
-  p=subprocess.Popen( commande, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, universal_newlines=True )
-  # typical output, here on 8S :
-  #0000:3f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:7f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:bf:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0000:ff:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:3f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:7f:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:bf:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  #0001:ff:1e.0 System peripheral: Intel Corporation Device 3258 (rev 06)
-  # BUT, true 2S EMR replies
-  # 7f:1e.0 0880: 8086:3258 (rev 02)
-  # ff:1e.0 0880: 8086:3258 (rev 02)
-  # option "-D" solves this
-  for dataline in p.stdout:
-    if dataline.strip("\n ") == "": continue
-    PCUTable.append( dataline.split()[0][:-2] )  # cutting ".0" out
+  args=parser.parse_args()
+  # a replay takes nCR and PCUTable from the capture file
+  if args.replay:
+    return args,[]
 
+  # discover where the PCUs are, from sysfs (see topology.py)
   # [ "0000:3f:1e", "0000:7f:1e", .... ]
   # full path will be like :  /sys/devices/pci0000:ff/0000:ff:1e.2
   # or equivalent             /sys/bus/pci/devices/0000:7f:1e.2
+  PCUTable=topology.pcus()
 
   # checking whether RC7 exists or not . SPR has it; CascadeLake doesn't
   global nCR
+  nCR=topology.get()["nCR"]
 
-  nCR=0
-  # debug=True
-  # if debug : print("init: PCUTable={}".format(PCUTable))
-  for i in range(8):
-    pathname="/sys/bus/pci/devices/"+PCUTable[0]+".{}".format(i)
-    # if debug : print("init: testing "+pathname)
-    if os.path.isdir(pathname):
-      nCR+=1
-  
   # trap for strange unforseen pathnames
   if nCR==0:
       print("fatal error : could not find any register for the PCU devices at {}.\n"
             "Check code and system at /sys/bus/pci/devices/\nExiting.".format(PCUTable))  
       sys.exit(1)
 
-  return parser.parse_args(),PCUTable
+  return args,PCUTable
 
 
 ###################################################################################################
@@ -427,7 +506,12 @@ def main():
 
   # backbone program: holds the global logic, launches the genomic threads, blocks on input, sets
   # flags appropriately for the GUI
-  orchestrator(args, PCUTable)
+  if args.replay:
+    replayer(args)
+  elif args.record:
+    recorder(args, PCUTable)
+  else:
+    orchestrator(args, PCUTable)
 
 
 if __name__ == '__main__':
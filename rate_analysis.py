@@ -11,6 +11,9 @@ import bitstruct
 
 from useful_stuff import *
 import msr
+import energy
+import mailboxes
+from mailboxes import wr_ocmailbox, rd_ocmailbox
 
 ###################################################################################################
 #
@@ -19,7 +22,6 @@ import msr
 ###################################################################################################
 
 debug=None
-NSOCKET=2
 
 MAILBOX_DATA_OFFSET=0xA0
 MAILBOX_INTERFACE_OFFSET=0xA4
@@ -49,35 +51,6 @@ VCC_DDRD      = 8
 VCC_DDRA      = 9
 
 
-def wr_ocmailbox(param2, param1, command, data, core=0):
-  buffer=struct.pack("IBBBB", data, command, param1, param2, 0b10000000)
-  if debug:
-    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", buffer)
-    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
-    sys.stdout.write("debug : write to OC_MAILBOX {0}h ( param2={1:02X} "\
-                     "param1={2:02X} command={3:02X} data={4:04X} )\n".format(
-                     blue(hexa),param2,param1,command,data) )
-  try:
-    msr.write_mailbox(0x150, 8, buffer, core)
-  except:
-    sys.stderr.write("Could not write {} to OC_MAILBOX, leaving.\n".format(buffer))
-    sys.exit(1)
-  return buffer  
-
-
-def rd_ocmailbox(core=0):
-  try:
-    chunk=msr.read_mailbox(0x150, 8, core)
-  except:
-    sys.stderr.write("Could not read the OC_MAILBOX, leaving.\n")
-    sys.exit(1)
-  if debug:
-    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", chunk)
-    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
-    sys.stdout.write("debug : read frm OC_MAILBOX {0}h\n".format( blue(hexa)) )
-  return chunk
-
-
 def mailbox_OC_CAPABILITY(domain):
     wr_chunk=wr_ocmailbox(0,domain,0x01, 0)
     rd_chunk=rd_ocmailbox()
@@ -473,6 +446,22 @@ def mailbox_READ_SVID_CONFIG(svid):
   return return_code
 
 
+# PACKAGE ENERGY TIME STATUS, DRAM ENERGY STATUS, PRIMARY PLANE ENERGY STATUS,
+# PLATFORM ENERGY STATUS, PLATFORM RAPL SOCKET PERF STATUS, PACKAGE RAPL PERF STATUS
+ENERGY_MSRS=[ 0x612, 0x619, 0x639, 0x64D, 0x666, 0x613 ]
+
+def energies(raw, row):
+  """converts one row of a msr.snapshot(ENERGY_MSRS, ...) or msr.package_snapshot(ENERGY_MSRS)
+  into the values returned by the msr.read_* helpers"""
+  pkg,dram,ppl,platform,socket,_=raw[row*len(ENERGY_MSRS):(row+1)*len(ENERGY_MSRS)]
+  pkg_energy  = (pkg>>14 & 0x3FFFF) + (pkg & 0x3FFF) * pcu[ "energy_unit" ]
+  dram_energy = (dram>>14 & 0x3FFFF) + (dram & 0x3FFF) * pcu[ "energy_unit" ]
+  ppl_energy  = (ppl & 0xFFFFFFFF) * pcu[ "energy_unit" ]
+  platform_nrj= platform & 0xFFFFFFFF
+  socket_nrj  = socket & 0xFFFFFFFF
+  return pkg_energy, dram_energy, ppl_energy, platform_nrj, socket_nrj
+
+
 ###################################################################################################
 #
 #  3. main routine that deals with displaying things on the terminal
@@ -513,6 +502,156 @@ def update_display(config, registers):
         print( "{0:24s}: {1}h {2}".format( text, blue(hexa), blue(comment) ) )
   
   
+###################################################################################################
+#
+#  4. power mode : package power of every socket, divided by the hardware elapsed time of
+#     MSR 612h, not by the time python thinks it slept. Windows of a few ms catch the PL2 bursts.
+#     The time field counts in pcu["time_unit"] (~1 ms) : shorter windows are rounded up to it.
+#
+###################################################################################################
+def watch_power(window, duration=0):
+  """prints one line per window : the package power of each socket, then the peaks"""
+  sockets=range(msr.count_packages())
+  start=time.monotonic()
+  seen=[ 0 for socket in sockets ]
+  peaks=[ 0 for socket in sockets ]
+  readings=[ None for socket in sockets ]
+  print("{0:>9s}  ".format("time")+" ".join( "{0:>7s}".format("PKG[{}]".format(socket)) for socket in sockets ))
+  try:
+    while duration==0 or time.monotonic()-start<duration:
+      raw=msr.package_snapshot([ 0x612 ])
+      for socket in sockets:
+        state=energy.update_timed(socket, "612h", raw[socket], window)
+        if state["windows"]!=seen[socket]:
+          seen[socket]=state["windows"]
+          readings[socket]=state["power"]
+          peaks[socket]=max(peaks[socket], state["power"])
+      # one line once every socket has a new reading
+      if all( r is not None for r in readings ):
+        print("{0:8.3f}s  ".format(time.monotonic()-start)+" ".join( "{0:6.1f}W".format(r) for r in readings ))
+        readings=[ None for socket in sockets ]
+      time.sleep(max(window/4, .001))
+  except KeyboardInterrupt:
+    pass
+  print("{0:>9s}  ".format("peak")+" ".join( "{0:6.1f}W".format(p) for p in peaks ))
+
+
+###################################################################################################
+#
+#  5. dashboard : package, DRAM, PP0 and platform power of every socket, averaged over rolling
+#     windows (see energy.rolling). One msr.package_snapshot(ENERGY_MSRS) every SAMPLE_PERIOD,
+#     unwrapped by energy.py, then rolled : the work per sample does not depend on the windows.
+#     The package divides by the hardware time of MSR 612h, the other domains by the time of
+#     the snapshots. The table is redrawn every REFRESH seconds.
+#     Next to the power, the share of time throttled by RAPL (MSR 613h, by the package limits, and
+#     666h, by the platform limits) over the same hardware time : what the power caps cost.
+#     On exit, the whole run is summed up per socket : run it around a job.
+#
+###################################################################################################
+SAMPLE_PERIOD=.001
+REFRESH=.25
+WINDOWS=[ .01, .1, 1, 10 ]
+
+# columns : name, index of the energy total in the totals of a socket
+DOMAINS=[ ("PACKAGE", 0), ("DRAM", 2), ("PP0", 3), ("PLATFORM", 4) ]
+# columns : name, index of the throttle counter in the totals of a socket
+THROTTLES=[ ("PKG THROTTLED %", 6), ("PLATFORM THROTTLED %", 5) ]
+
+
+def totals(socket, raw, timestamp):
+  """unwrapped totals of the row of socket in msr.package_snapshot(ENERGY_MSRS) :
+  (package energy, package hardware time, dram, pp0, platform, platform throttle, package throttle)"""
+  row=raw[socket*len(ENERGY_MSRS):(socket+1)*len(ENERGY_MSRS)]
+  package=energy.update_timed(socket, "612h", row[0])
+  others=[ energy.update(socket, "{:X}h".format(number), value & energy.MASK, timestamp)["total"]
+           for number,value in zip(ENERGY_MSRS[1:], row[1:]) ]
+  return tuple( [ package["total"], package["time"] ] + others )
+
+
+def interval_power(old, now, t0, t):
+  """[ W of each of DOMAINS, % of time of each of THROTTLES ] between two totals of a socket"""
+  readings=[]
+  for name,i in DOMAINS:
+    if i==0:
+      elapsed=(now[1]-old[1])*pcu["time_unit"]
+    else:
+      elapsed=t-t0
+    readings.append( (now[i]-old[i])*pcu["energy_unit"]/elapsed if elapsed>0 else None )
+  for name,i in THROTTLES:
+    share=energy.throttle_share(now[i]-old[i], now[1]-old[1])
+    readings.append( None if share is None else share*100 )
+  return readings
+
+
+def window_power(r, index, t, now):
+  """interval_power over window #index, None until it's full"""
+  start=energy.window_start(r, index)
+  if start is None or start[0]>t-r["windows"][index]:
+    return None
+  t0,old=start
+  return interval_power(old, now, t0, t)
+
+
+def window_label(window):
+  return "{0:g}ms".format(window*1000) if window<1 else "{0:g}s".format(window)
+
+
+def draw_dashboard(rolls, last, t, windows):
+  width=7*len(windows)
+  lines=[ '\033[1;1f\033[2J'+bold("power per socket, in W, and time throttled by RAPL, in %")+" averaged over "+" / ".join( window_label(w) for w in windows ),
+          "socket"+"".join( " \u2502{0:^{1}s}".format(name, width) for name,_ in DOMAINS+THROTTLES ) ]
+  for socket,r in enumerate(rolls):
+    readings=[ window_power(r, index, t, last[socket]) for index in range(len(windows)) ]
+    line="{0:6d}".format(socket)
+    for column in range(len(DOMAINS+THROTTLES)):
+      line+=" \u2502"+"".join( "      -" if reading is None or reading[column] is None else "{0:7.1f}".format(reading[column])
+                               for reading in readings )
+    lines.append(line)
+  print("\n".join(lines))
+
+
+def throttle_report(first, last, t0, t):
+  """the whole run, per socket : power, and share of time throttled"""
+  lines=[ bold("{0:.1f} s".format(t-t0))+", per socket :" ]
+  for socket in range(len(first)):
+    readings=interval_power(first[socket], last[socket], t0, t)
+    lines.append( "{0:6d}  ".format(socket)+"  ".join( "{0} {1}".format(name.replace(" %", ""),
+                  "-" if value is None else "{0:.1f}{1}".format(value, "%" if name in dict(THROTTLES) else "W"))
+                  for (name,_),value in zip(DOMAINS+THROTTLES, readings) ) )
+  return "\n".join(lines)
+
+
+def dashboard(windows=WINDOWS, duration=0):
+  """redraws the power table of every socket until Ctrl+C, or for duration seconds"""
+  sockets=range(msr.count_packages())
+  rolls=[ energy.rolling(windows) for socket in sockets ]
+  first=None
+  last=[ None for socket in sockets ]
+  start=time.monotonic()
+  deadline=start
+  redraw=start
+  try:
+    while duration==0 or time.monotonic()-start<duration:
+      raw=msr.package_snapshot(ENERGY_MSRS)
+      timestamp=time.monotonic_ns()
+      t=timestamp/1e9
+      for socket in sockets:
+        last[socket]=totals(socket, raw, timestamp)
+        energy.roll(rolls[socket], t, last[socket])
+      if first is None:
+        first=(t, list(last))
+      if t>=redraw:
+        draw_dashboard(rolls, last, t, windows)
+        redraw=t+REFRESH
+
+      # fixed rate. when late, skip the missed periods
+      deadline=max(deadline+SAMPLE_PERIOD, time.monotonic())
+      time.sleep(max(0, deadline-time.monotonic()))
+  except KeyboardInterrupt:
+    pass
+  if first is not None:
+    print(throttle_report(first[1], last, first[0], t))
+
 
 def init():
   # process cntl+C
@@ -522,6 +661,15 @@ def init():
            epilog="(c) 2023 HA Quoc Viet" )
 
   parser.add_argument("--debug",  "-g", action="store_true", default=False)
+  parser.add_argument("--window", "-w", type=float,          default=None, metavar="MS",
+           help="power mode : package power of every socket over windows of MS milliseconds "\
+           "of hardware time (MSR 612h), until Ctrl+C" )
+  parser.add_argument("--dashboard", "-D", action="store_true", default=False,
+           help="continuous mode : package, DRAM, PP0 and platform power of every socket, over rolling windows" )
+  parser.add_argument("--windows",      default="10,100,1000,10000", metavar="MS,MS,...",
+           help="rolling windows of --dashboard, in milliseconds. Defaults to 10,100,1000,10000" )
+  parser.add_argument("--duration",     type=float,          default=0,
+           help="duration of the power mode or of the dashboard, in seconds. Defaults to 0 : until Ctrl+C" )
   parser.add_argument("--device", "-d",                      default="0000:7f:1e",
            help="Device to read. Defaults to first module, first socket. "\
            "Use \"lspci -n | grep 3258\" to find yours. "
@@ -543,12 +691,14 @@ def main():
 
   args=init()
   debug = args.debug
+  mailboxes.debug = debug
 
-  old_pkg_energy  = [ None for _ in range(8) ]
-  old_dram_energy = [ None for _ in range(8) ]
-  old_ppl_energy  = [ None for _ in range(8) ]
-  old_platform_nrj= [ None for _ in range(8) ]
-  old_socket_nrj  = [ None for _ in range(8) ]
+  if args.window is not None:
+    watch_power(args.window/1000, args.duration)
+    return
+  if args.dashboard:
+    dashboard([ float(ms)/1000 for ms in args.windows.split(",") ], args.duration)
+    return
 
   max_tw,max_ppl2,min_ppl1,max_ppl1=msr.read_PLATFORM_POWER_INFO(core=0)
   print("""max time window = {0:4.2f}s
@@ -557,37 +707,43 @@ min PPL1 value = {2:3.0f}W
 max PPL1 value = {3:3.0f}W""".format(max_tw,max_ppl2,min_ppl1,max_ppl1)
   )
 
+  # one CPU per package : package scope MSRs read from any other CPU give the same values
+  cpus=msr.package_cpus()
+
   msr.read_POWER_CTL(0)
-  [ msr.write_POWER_CTL(False,core) for core in range(NSOCKET) ]
+  [ msr.write_POWER_CTL(False,core) for core in cpus ]
 
   print( "━"*35+" WHERE IS MY ENERGY GOING ? "+"━"*55 )
   # make one measurement, sleep 1s, do another one, compare, done.
 
-  for core in range(8):
-    # msr.reset_CORE_PERF_LIMIT_REASONS(core)
-    old_pkg_energy  [core]= msr.read_PACKAGE_ENERGY_TIME_STATUS(core)[1]
-    old_dram_energy [core]= msr.read_DRAM_ENERGY_STATUS(core)
-    old_ppl_energy  [core]= msr.read_PRIMARY_PLANE_ENERGY_STATUS(core)
-    old_platform_nrj[core]= msr.read_PLATFORM_ENERGY_STATUS(core)[1]
-    old_socket_nrj  [core]= msr.read_PLATFORM_RAPL_SOCKET_PERF_STATUS(core)
-
-    print( old_socket_nrj[core] )
+  sockets=list(range(len(cpus)))
+  old=msr.package_snapshot(ENERGY_MSRS)
+  start=time.monotonic()
+  for socket in sockets:
+    # msr.reset_CORE_PERF_LIMIT_REASONS(cpus[socket])
+    energy.update_timed(socket, "612h", old[socket*len(ENERGY_MSRS)])
   time.sleep(1)
+  new=msr.package_snapshot(ENERGY_MSRS)
+  # the package has its own clock, in MSR 612h. The other domains have the time we measured
+  elapsed=time.monotonic()-start
 
-  for core in range(8):
-    pkg_energy  = msr.read_PACKAGE_ENERGY_TIME_STATUS(core)[1]
-    dram_energy = msr.read_DRAM_ENERGY_STATUS(core)
-    ppl_energy  = msr.read_PRIMARY_PLANE_ENERGY_STATUS(core)
-    platform_nrj= msr.read_PLATFORM_ENERGY_STATUS(core)[1]
-    socket_nrj  = msr.read_PLATFORM_RAPL_SOCKET_PERF_STATUS(core)
+  for socket in sockets:
+    pkg_energy, dram_energy, ppl_energy, platform_nrj, socket_nrj = energies(new, socket)
+    old_pkg_energy, old_dram_energy, old_ppl_energy, old_platform_nrj, old_socket_nrj = energies(old, socket)
     
-    print("PACKAGE       PWR[{0}]={1:5.1f}W".format(core,  pkg_energy  - old_pkg_energy[core] ))  # no division by time difference, because we slept for 1s
-    print("DRAM          PWR[{0}]={1:5.1f}W".format(core, dram_energy  -old_dram_energy[core] ))  # ... and also, we don't understand time, at this point
-    print("PRIMARY PLANE PWR[{0}]={1}W".format(core,  ppl_energy  - old_ppl_energy[core] ))
-    print("PLATEFORM     PWR[{0}]={1}W".format(core, platform_nrj - old_platform_nrj[core] ))
-    print("SOCKET        PWR[{0}]={1}W".format(core, socket_nrj   - old_socket_nrj[core] ))
-
-    msr.read_CORE_PERF_LIMIT_REASONS(core)
+    package=energy.update_timed(socket, "612h", new[socket*len(ENERGY_MSRS)], window=0)
+    print("PACKAGE       PWR[{0}]={1:5.1f}W".format(socket, package["power"] or 0 ))
+    print("DRAM          PWR[{0}]={1:5.1f}W".format(socket, (dram_energy  -old_dram_energy)/elapsed ))
+    print("PRIMARY PLANE PWR[{0}]={1}W".format(socket,  (ppl_energy  - old_ppl_energy)/elapsed ))
+    print("PLATEFORM     PWR[{0}]={1:5.1f}W".format(socket, ((platform_nrj-old_platform_nrj)&0xFFFFFFFF)*pcu[ "energy_unit" ]/elapsed ))
+    # the throttle counters, over the hardware time of the package power
+    ticks=(new[socket*len(ENERGY_MSRS)]>>32)-(old[socket*len(ENERGY_MSRS)]>>32) & energy.MASK
+    for name,i in [ ("PACKAGE ", 5), ("PLATFORM", 4) ]:
+      throttle=(new[socket*len(ENERGY_MSRS)+i]-old[socket*len(ENERGY_MSRS)+i]) & energy.MASK
+      share=energy.throttle_share(throttle, ticks)
+      print("{0} RAPL THROTTLED[{1}]={2}".format(name, socket, "-" if share is None else "{0:5.1f}%".format(share*100) ))
+
+    msr.read_CORE_PERF_LIMIT_REASONS(cpus[socket])
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+import time
+import multiprocessing
+
+###################################################################################################
+#
+#  0. Shared memory rings : one writer, any number of readers, no lock, no barrier
+#     a ring holds the last NSLOT samples of one (socket, CR). Sample #seq (1, 2, ...) goes in
+#     slot seq%NSLOT. Each slot has a sequence word, a seqlock :
+#       2*seq-1  while the writer fills the slot
+#       2*seq    once sample #seq is complete
+#     the head holds the seq of the last complete sample, 0 before the first one.
+#     Readers get memoryviews straight into the shared memory, and check with valid() after use
+#     that the writer did not come back to that slot meanwhile. With NSLOT samples in the ring,
+#     this takes the writer NSLOT periods : a display or a recorder reading the latest sample
+#     never waits for, nor blocks, the collector.
+#     The rings are RawArrays : created before the processes are started, passed as arguments.
+#
+###################################################################################################
+NSLOT=64   # 64 ms of the energy counters, sampled every ms by the collector
+SLOT_SIZE=256   # one config space
+
+# meta : [ head, seq word of slot 0, timestamp of slot 0, seq word of slot 1, ... ]
+HEAD=0
+
+
+def create(nslot=NSLOT, size=SLOT_SIZE):
+  """a new, empty ring of nslot samples of size bytes"""
+  return { "nslot": nslot,
+           "size" : size,
+           "data" : multiprocessing.RawArray('B', nslot*size),   # unsigned chars (1 byte each)
+           "meta" : multiprocessing.RawArray('Q', 1+2*nslot) }   # unsigned 64 bits words
+
+
+def slot_view(ring, slot):
+  """memoryview of the bytes of one slot, no copy"""
+  size=ring["size"]
+  return memoryview(ring["data"]).cast("B")[slot*size:(slot+1)*size]
+
+
+###################################################################################################
+#
+#  1. writer side. A single writer per ring
+#
+###################################################################################################
+def begin(ring):
+  """opens the next sample : returns (seq, view), view being the slot to fill in place,
+  e.g. with fd.readinto(view). Then commit(ring, seq)"""
+  seq=ring["meta"][HEAD]+1
+  slot=seq%ring["nslot"]
+  ring["meta"][1+2*slot]=2*seq-1      # readers of this slot now see it as torn
+  return seq, slot_view(ring, slot)
+
+
+def commit(ring, seq, timestamp=None):
+  """publishes sample #seq, with its time.monotonic_ns() timestamp"""
+  slot=seq%ring["nslot"]
+  meta=ring["meta"]
+  meta[2+2*slot]=time.monotonic_ns() if timestamp is None else timestamp
+  meta[1+2*slot]=2*seq
+  meta[HEAD]=seq
+
+
+def publish(ring, data, timestamp=None):
+  """copies data into the next sample and publishes it. returns its seq"""
+  seq,view=begin(ring)
+  view[:len(data)]=data
+  commit(ring, seq, timestamp)
+  return seq
+
+
+###################################################################################################
+#
+#  2. reader side. Nothing here writes to the ring
+#
+###################################################################################################
+def head(ring):
+  """seq of the last published sample, 0 when there is none yet"""
+  return ring["meta"][HEAD]
+
+
+def valid(ring, seq):
+  """True while sample #seq is still in the ring, untouched"""
+  return ring["meta"][1+2*(seq%ring["nslot"])]==2*seq
+
+
+def sample(ring, seq):
+  """(seq, timestamp, view) of sample #seq, or None when it's overwritten or not there yet"""
+  slot=seq%ring["nslot"]
+  meta=ring["meta"]
+  if seq==0 or meta[1+2*slot]!=2*seq:
+    return None
+  timestamp=meta[2+2*slot]
+  # the timestamp was read after the seq word : check that the writer did not start over
+  if meta[1+2*slot]!=2*seq:
+    return None
+  return seq, timestamp, slot_view(ring, slot)
+
+
+def latest(ring):
+  """(seq, timestamp, view) of the last published sample, None when there is none.
+  view is the shared memory itself : check valid(ring, seq) once done with it"""
+  while True:
+    seq=head(ring)
+    if seq==0:
+      return None
+    found=sample(ring, seq)
+    if found is not None:
+      return found
+    # overwritten between the head and the slot reads : a whole lap late, try the new head
+
+
+def since(ring, after):
+  """[ (seq, timestamp, view), ... ] of the samples published after #after, oldest first.
+  Samples already overwritten are skipped : a consumer that's more than NSLOT samples late
+  sees gaps in the seq numbers"""
+  last=head(ring)
+  first=max(after+1, last-ring["nslot"]+1, 1)
+  found=( sample(ring, seq) for seq in range(first, last+1) )
+  return [ s for s in found if s is not None ]
+
+
+def copy(ring, out=None):
+  """consistent copy of the last sample, into out (a bytearray) when given.
+  returns (seq, timestamp, bytes), or None when there is none"""
+  while True:
+    found=latest(ring)
+    if found is None:
+      return None
+    seq,timestamp,view=found
+    if out is None:
+      data=bytes(view)
+    else:
+      out[:len(view)]=view
+      data=out
+    if valid(ring, seq):
+      return seq, timestamp, data
@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+
+import os
+import time
+import uuid
+import random
+import struct
+import argparse
+
+import layouts
+import capture
+
+###################################################################################################
+#
+#  0. Simulated device tree
+#     Builds, under a sysroot directory, what the tools read on a Sapphire Rapids box :
+#       sys/bus/pci/devices/<domain>:<bus>:1e.<CR>/config      256 bytes, plus vendor and device
+#       sys/bus/pci/devices/<domain>:<bus-1>:0<link>.0        UPI links 1-4, device 3240
+#       dev/cpu/<N>/msr                                        MSR number*8 = file offset
+#       sys/class/msr/msr<N>
+#       sys/devices/system/cpu/cpu<N>/topology/physical_package_id, core_id
+#       proc/sys/kernel/random/boot_id
+#     then, optionally, keeps it alive : energy and throttle counters tick, mailboxes complete.
+#     Point the tools to it with PCU_SYSROOT=<sysroot>.
+#
+#     All the CPUs of a socket share one MSR file (hard links) : package scope MSRs are then
+#     coherent for free, and a 1000 cores tree only costs one update per socket and per tick.
+#
+###################################################################################################
+MSR_STRIDE=8      # bytes per MSR in the msr files, see useful_stuff.msr_offset : MSRs 611h and 612h don't overlap
+MSR_FILE_SIZE=0x800*MSR_STRIDE
+BUSES=[ 0x3f, 0x7f, 0xbf, 0xff ]
+UPI_LINKS=4
+
+# SPR RAPL units : time 1/2**10 s, energy 1/2**14 J, power 1/2**3 W
+UNITS_REG=(10<<16)|(14<<8)|3
+
+# simulated power draw per socket, in W. a small jitter is added at each tick
+POWER={ "package" : 250,
+        "pp0"     : 200,
+        "dram"    : 30,
+        "platform": 300 }
+
+# energy counters : (power, where). where is ("msr", number) or ("cr", CR, offset)
+COUNTERS=[ ("package" , ("msr", 0x611)),
+           ("package" , ("msr", 0x612)),
+           ("pp0"     , ("msr", 0x639)),
+           ("dram"    , ("msr", 0x619)),
+           ("platform", ("msr", 0x64D)),
+           ("pp0"     , ("cr" , 0, 0x88)),
+           ("package" , ("cr" , 0, 0x90)),
+           ("dram"    , ("cr" , 2, 0x80)) ]
+
+# RAPL throttle counters, in time units : the simulated package spends THROTTLE of its time
+# below the requested P-state
+THROTTLE=.2
+THROTTLE_COUNTERS=[ ("msr", 0x613), ("msr", 0x666), ("cr", 2, 0x88) ]
+
+# mailboxes : (where, size, busy bit, command byte). the completion code is written in the command byte
+MAILBOXES=[ (("msr", 0x150), 8, 63, 32),       # OC mailbox
+            (("msr", 0x607), 8, 31, 0),        # BIOS mailbox interface, data at MSR 608h
+            (("cr" , 1, 0xA4), 4, 31, 0),      # OS mailbox interface, data at 0xA0
+            (("cr" , 1, 0x90), 4, 31, 0) ]     # BIOS mailbox interface, data at 0x8C
+
+
+def pcu_device(socket):
+  """PCI name of the PCU of socket, like lspci -D : 0000:3f:1e ... 0003:ff:1e"""
+  return "{0:04x}:{1:02x}:1e".format(socket//len(BUSES), BUSES[socket%len(BUSES)])
+
+
+def default_config(cr):
+  """a plausible 256 bytes config space for CR #cr, when no dump is given"""
+  config=bytearray(capture.CONFIG_SIZE)
+  struct.pack_into("<HH", config, 0, 0x8086, 0x3258+cr)
+  if cr==0:
+    struct.pack_into("<I", config, 0x8C, UNITS_REG)
+    limit={ "lim_lock": False,
+            "lim_2_time_x": 0, "lim_2_time_y": 0, "clmp_lim_2": True, "lim_2_en": True, "lim_2": 420*8,
+            "lim_1_time_x": 0, "lim_1_time_y": 10, "clmp_lim_1": True, "lim_1_en": True, "lim_1": 350*8 }
+    config[0xE8:0xF0]=layouts.encode(layouts.PACKAGE_RAPL_LIMIT_CFG, limit)
+  return bytes(config)
+
+
+def write_file(path, data):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "wb") as f:
+    f.write(data)
+
+
+def build(sysroot, sockets=2, cpus=16, nCR=8, dump=None):
+  """creates the simulated tree. dump is a capture file whose first frame gives the config
+  spaces (recycled when it has fewer sockets). returns PCUTable"""
+  frames=None
+  if dump is not None:
+    header,records=capture.load(dump)
+    nCR=header["nCR"]
+    frames=[ capture.frame(header, records, 0, socket) for socket in range(len(header["PCUTable"])) ]
+
+  PCUTable=[ pcu_device(socket) for socket in range(sockets) ]
+  for socket,device in enumerate(PCUTable):
+    for cr in range(nCR):
+      devdir=os.path.join(sysroot, "sys/bus/pci/devices/{0}.{1}".format(device, cr))
+      if frames is not None:
+        config=frames[socket%len(frames)][256*cr:256*(cr+1)]
+      else:
+        config=default_config(cr)
+      write_file(os.path.join(devdir, "config"), config)
+      write_file(os.path.join(devdir, "vendor"), "0x{:04x}\n".format(struct.unpack_from("<H", config, 0)[0]).encode())
+      write_file(os.path.join(devdir, "device"), "0x{:04x}\n".format(struct.unpack_from("<H", config, 2)[0]).encode())
+    # UPI misc functions, device 1-4 function 0, on the bus below the PCU
+    domain,bus,_=device.split(":")
+    for link in range(1, UPI_LINKS+1):
+      devdir=os.path.join(sysroot, "sys/bus/pci/devices/{0}:{1:02x}:{2:02x}.0".format(domain, int(bus, 16)-1, link))
+      write_file(os.path.join(devdir, "config"), struct.pack("<HH", 0x8086, 0x3240)+bytes(capture.CONFIG_SIZE-4))
+      write_file(os.path.join(devdir, "vendor"), b"0x8086\n")
+      write_file(os.path.join(devdir, "device"), b"0x3240\n")
+
+  # a new boot id per tree : the mailbox answers persisted by mailboxes.save_cache() are per boot
+  write_file(os.path.join(sysroot, "proc/sys/kernel/random/boot_id"), "{}\n".format(uuid.uuid4()).encode())
+
+  per_socket=(cpus+sockets-1)//sockets
+  for cpu in range(cpus):
+    socket=cpu//per_socket
+    first=socket*per_socket
+    msrfile=os.path.join(sysroot, "dev/cpu/{}/msr".format(cpu))
+    os.makedirs(os.path.dirname(msrfile), exist_ok=True)
+    if os.path.exists(msrfile): os.remove(msrfile)
+    if cpu==first:
+      with open(msrfile, "wb") as f:
+        f.truncate(MSR_FILE_SIZE)
+      fd=os.open(msrfile, os.O_WRONLY)
+      os.pwrite(fd, struct.pack("<Q", UNITS_REG), 0x606*MSR_STRIDE)
+      os.close(fd)
+    else:
+      os.link(os.path.join(sysroot, "dev/cpu/{}/msr".format(first)), msrfile)
+    os.makedirs(os.path.join(sysroot, "sys/class/msr/msr{}".format(cpu)), exist_ok=True)
+    topodir=os.path.join(sysroot, "sys/devices/system/cpu/cpu{}/topology".format(cpu))
+    write_file(os.path.join(topodir, "physical_package_id"), "{}\n".format(socket).encode())
+    write_file(os.path.join(topodir, "core_id"), "{}\n".format(cpu-first).encode())
+  return PCUTable
+
+
+###################################################################################################
+#
+#  1. Keeping the tree alive
+#
+###################################################################################################
+def open_tree(sysroot):
+  """returns one descriptor per socket for the MSRs, and per (socket, CR) for the config spaces"""
+  PCUTable=sorted( name[:-2] for name in os.listdir(os.path.join(sysroot, "sys/bus/pci/devices"))
+                   if name.endswith(":1e.0") )
+  msr_fds=[]
+  for cpu in sorted( int(n) for n in os.listdir(os.path.join(sysroot, "dev/cpu")) ):
+    with open(os.path.join(sysroot, "sys/devices/system/cpu/cpu{}/topology/physical_package_id".format(cpu))) as f:
+      socket=int(f.read())
+    if socket==len(msr_fds):
+      msr_fds.append(os.open(os.path.join(sysroot, "dev/cpu/{}/msr".format(cpu)), os.O_RDWR))
+  cr_fds={}
+  for socket,device in enumerate(PCUTable):
+    cr=0
+    while os.path.isdir(os.path.join(sysroot, "sys/bus/pci/devices/{0}.{1}".format(device, cr))):
+      cr_fds[socket,cr]=os.open(os.path.join(sysroot, "sys/bus/pci/devices/{0}.{1}/config".format(device, cr)), os.O_RDWR)
+      cr+=1
+  return msr_fds, cr_fds
+
+
+def locate(msr_fds, cr_fds, socket, where):
+  """(fd, offset) of a register, or None when the CR does not exist"""
+  if where[0]=="msr":
+    return msr_fds[socket], where[1]*MSR_STRIDE
+  if (socket, where[1]) in cr_fds:
+    return cr_fds[socket, where[1]], where[2]
+  return None
+
+
+def tick(msr_fds, cr_fds, energy, dt, jitter=.05):
+  """advances every energy and throttle counter by dt seconds, and completes the pending mailbox commands"""
+  energy_unit=1/2**14
+  time_unit=1/2**10
+  for socket in range(len(msr_fds)):
+    draw={ name: watts*(1+random.uniform(-jitter, jitter)) for name,watts in POWER.items() }
+    for index,(name,where) in enumerate(COUNTERS):
+      location=locate(msr_fds, cr_fds, socket, where)
+      if location is None: continue
+      fd,offset=location
+      key=(socket, index)
+      energy[key]=energy.get(key, 0)+draw[name]*dt/energy_unit
+      counter=int(energy[key])&0xFFFFFFFF
+      if where==("msr", 0x612):
+        # PACKAGE ENERGY TIME STATUS : elapsed time in the upper 32 bits
+        energy[socket, "time"]=energy.get((socket, "time"), 0)+dt/time_unit
+        counter|=(int(energy[socket, "time"])&0xFFFFFFFF)<<32
+        os.pwrite(fd, struct.pack("<Q", counter), offset)
+      else:
+        os.pwrite(fd, struct.pack("<I", counter), offset)
+
+    for index,where in enumerate(THROTTLE_COUNTERS):
+      location=locate(msr_fds, cr_fds, socket, where)
+      if location is None: continue
+      fd,offset=location
+      key=(socket, "throttle", index)
+      energy[key]=energy.get(key, 0)+THROTTLE*dt/time_unit
+      os.pwrite(fd, struct.pack("<I", int(energy[key])&0xFFFFFFFF), offset)
+
+    for where,size,busy,command in MAILBOXES:
+      location=locate(msr_fds, cr_fds, socket, where)
+      if location is None: continue
+      fd,offset=location
+      value=int.from_bytes(os.pread(fd, size, offset), "little")
+      if value>>busy&1:
+        value&=~(1<<busy | 0xFF<<command)   # command byte -> PASS
+        os.pwrite(fd, value.to_bytes(size, "little"), offset)
+
+
+def run(sysroot, rate=1000, duration=0):
+  """ticks the tree at rate Hz, for duration seconds (0 : until Ctrl+C)"""
+  msr_fds,cr_fds=open_tree(sysroot)
+  energy={}
+  period=1/rate
+  start=time.monotonic()
+  last=start
+  try:
+    while duration==0 or last-start<duration:
+      time.sleep(period)
+      now=time.monotonic()
+      tick(msr_fds, cr_fds, energy, now-last)
+      last=now
+  except KeyboardInterrupt:
+    pass
+  for fd in msr_fds+list(cr_fds.values()): os.close(fd)
+
+
+###################################################################################################
+#
+#  2. main
+#
+###################################################################################################
+def main():
+  parser = argparse.ArgumentParser(description="Builds a simulated sysfs and /dev/cpu/*/msr tree, "
+                                   "then ticks its energy counters and completes its mailboxes. "
+                                   "Use with PCU_SYSROOT=SYSROOT pcu.py",
+           epilog="(c) 2023 HA Quoc Viet" )
+  parser.add_argument("sysroot")
+  parser.add_argument("--sockets", "-s", type=int,   default=2)
+  parser.add_argument("--cpus",    "-c", type=int,   default=16,   help="total number of logical CPUs")
+  parser.add_argument("--ncr",           type=int,   default=8,    help="number of PCU CRs, 8 on SPR, 7 on Cascade Lake")
+  parser.add_argument("--dump",    "-d",             default=None, help="capture file (pcu.py --record) to take the config spaces from")
+  parser.add_argument("--rate",          type=float, default=1000, help="tick rate, in Hz")
+  parser.add_argument("--duration",      type=float, default=0,    help="in seconds. 0 : until Ctrl+C")
+  parser.add_argument("--build-only",    action="store_true", default=False)
+  args=parser.parse_args()
+
+  PCUTable=build(args.sysroot, args.sockets, args.cpus, args.ncr, args.dump)
+  print("simulated {0} sockets, {1} cpus under {2}\n"
+        "export PCU_SYSROOT={3}".format(len(PCUTable), args.cpus, args.sysroot, os.path.abspath(args.sysroot)))
+  if not args.build_only:
+    run(args.sysroot, args.rate, args.duration)
+
+
+if __name__ == '__main__':
+  main()
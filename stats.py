@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+import math
+import time
+
+from useful_stuff import *
+import bitfield
+import energy
+
+###################################################################################################
+#
+#  0. Streaming statistics, per (socket, series)
+#     each new value of a series updates, in constant time and memory :
+#       count, min, max, mean and variance (Welford), an EWMA of time constant TAU seconds,
+#       the rate of change since the previous value, per second,
+#       a log histogram for the percentiles : one bucket per PRECISION relative step, created on
+#       first use. From 1 mW to 1 MW at 1%, that's 2000 buckets at most, however long the capture.
+#     The values come with their time.monotonic_ns() timestamp, like energy.py : a series whose
+#     time goes backwards (a replay seeking back) starts over.
+#
+###################################################################################################
+TAU=1.          # s, time constant of the EWMA
+PRECISION=.01   # relative width of a histogram bucket
+LOG_BASE=math.log1p(PRECISION)
+
+# { (socket, name): { "count", "min", "max", "mean", "m2", "ewma", "value", "ns", "rate", "histogram" } }
+# like energy.counters, each entry is only ever written by the collector worker of its (socket, CR)
+series={}
+
+
+def bucket(value):
+  """histogram key of value : (sign, log index)"""
+  if value==0:
+    return (0, 0)
+  sign=1 if value>0 else -1
+  return (sign, math.floor(math.log(abs(value))/LOG_BASE))
+
+
+def bucket_value(key):
+  """the middle of a histogram bucket"""
+  sign,index=key
+  return sign*math.exp((index+.5)*LOG_BASE)
+
+
+def update(socket, name, value, timestamp=None):
+  """accounts for a new value of a series, at timestamp (time.monotonic_ns()). returns its state"""
+  timestamp=time.monotonic_ns() if timestamp is None else timestamp
+  state=series.get( (socket, name) )
+  if state is None or timestamp<state["ns"]:
+    state={ "count": 0, "min": value, "max": value, "mean": 0., "m2": 0., "ewma": value,
+            "value": value, "ns": timestamp, "rate": None, "histogram": {} }
+    series[(socket, name)]=state
+  else:
+    elapsed=(timestamp-state["ns"])/1e9
+    if elapsed==0:
+      # the same sample again, e.g. a paused replay
+      return state
+    state["rate"]=(value-state["value"])/elapsed
+    state["ewma"]+=(value-state["ewma"])*(1-math.exp(-elapsed/TAU))
+    state["value"]=value
+    state["ns"]=timestamp
+    state["min"]=min(state["min"], value)
+    state["max"]=max(state["max"], value)
+
+  state["count"]+=1
+  delta=value-state["mean"]
+  state["mean"]+=delta/state["count"]
+  state["m2"]+=delta*(value-state["mean"])
+  key=bucket(value)
+  state["histogram"][key]=state["histogram"].get(key, 0)+1
+  return state
+
+
+def percentile(state, p):
+  """the p-th percentile (0-100) of a series, within PRECISION. None before the first value"""
+  if state is None or state["count"]==0:
+    return None
+  rank=p/100*state["count"]
+  seen=0
+  for key,count in sorted(list(state["histogram"].items()), key=lambda item: bucket_value(item[0])):
+    seen+=count
+    if seen>=rank:
+      # the extreme buckets hold the exact min and max
+      return min(state["max"], max(state["min"], bucket_value(key)))
+  return state["max"]
+
+
+def stddev(state):
+  if state is None or state["count"]<2:
+    return None
+  return math.sqrt(state["m2"]/(state["count"]-1))
+
+
+def summary(socket, name):
+  """{ count, min, max, mean, stddev, ewma, p50, p99, rate, value } of a series, None before the first value"""
+  state=series.get( (socket, name) )
+  if state is None:
+    return None
+  return { "count": state["count"], "min": state["min"], "max": state["max"], "mean": state["mean"],
+           "stddev": stddev(state), "ewma": state["ewma"], "p50": percentile(state, 50),
+           "p99": percentile(state, 99), "rate": state["rate"], "value": state["value"] }
+
+
+def brief(socket, name, unit=""):
+  """one line summary for the decoders, empty before the first value"""
+  s=summary(socket, name)
+  if s is None:
+    return ""
+  return "min {0:.0f}{4} max {1:.0f}{4} avg {2:.1f}{4} p99 {3:.0f}{4}".format(
+         s["min"], s["max"], s["mean"], s["p99"], unit)
+
+
+def names():
+  """the names of the series of every socket"""
+  return sorted(set( name for socket,name in list(series) ))
+
+
+def reset():
+  series.clear()
+  counters.clear()
+  windows.clear()
+
+
+###################################################################################################
+#
+#  1. Collector stage : like energy.feed, called with each new sample of a (socket, CR), after
+#     energy.feed. Gauges are taken as they are, counters (32 bits, wrap around) as their rate per
+#     second since the previous sample. The power of the energy counters, and the share of time
+#     throttled of the throttle counters, come from energy.py, once per energy window.
+#
+###################################################################################################
+# (CR, offset) -> (name, kind, bitfield layout of the value). PACKAGE RAPL PERF STATUS (CR2 88h)
+# is not a counter series : energy.THROTTLE_COUNTERS gives its share of time throttled, in %
+SERIES={ (0, 0xC8): ("package temperature", "gauge",   "u24 u8"),   # PACKAGE TEMPERATURE, like PCU_CR0
+         (0, 0xCC): ("pp0 temperature",     "gauge",   "u24 u8") }  # PP0 TEMPERATURE
+
+# { (socket, name): (raw, ns) } : the previous value of the counters
+counters={}
+
+# { (socket, energy counter): windows } : the last energy window accounted for
+windows={}
+
+
+def feed(socket, cr, config, timestamp=None, ranges=None):
+  """accounts for the series of CR #cr found in config, its 256 bytes config space.
+  ranges : the [ (offset, size), ... ] actually read at timestamp. None : all of them"""
+  timestamp=time.monotonic_ns() if timestamp is None else timestamp
+  for (series_cr,offset),(name,kind,fmt) in SERIES.items():
+    if series_cr!=cr:
+      continue
+    if ranges is not None and not any( start<=offset<start+size for start,size in ranges ):
+      continue
+    value=bitfield.unpack(fmt, config[offset:offset+4])[-1]
+    if kind=="gauge":
+      update(socket, name, value, timestamp)
+      continue
+    previous=counters.get( (socket, name) )
+    counters[(socket, name)]=(value, timestamp)
+    if previous is not None and timestamp>previous[1]:
+      update(socket, name, ((value-previous[0])&energy.MASK)/((timestamp-previous[1])/1e9), timestamp)
+
+  for (counter_cr,offset),name in list(energy.COUNTERS.items())+list(energy.THROTTLE_COUNTERS.items()):
+    if counter_cr!=cr:
+      continue
+    state=energy.counters.get( (socket, name) )
+    if state is None or state["windows"]==windows.get( (socket, name) ):
+      continue
+    windows[(socket, name)]=state["windows"]
+    if state["power"] is None:
+      continue
+    if name in energy.THROTTLE_COUNTERS.values():
+      update(socket, name+" %", state["power"]*100, state["window_ns"])
+    else:
+      update(socket, name+" power", state["power"], state["window_ns"])
+
+
+def on_sample(socket, cr, config, timestamp=None, ranges=None):
+  """the collector hook : energy, then statistics"""
+  energy.feed(socket, cr, config, timestamp, ranges)
+  feed(socket, cr, config, timestamp, ranges)
+
+
+def report(sockets, selected=None):
+  """text table of the series of sockets : one line per (socket, series). selected : the names
+  of the series to report, all of them by default"""
+  lines=[ "{0:6s} {1:22s} {2:>9s} {3:>10s} {4:>10s} {5:>10s} {6:>10s} {7:>10s} {8:>10s}".format(
+          "socket", "series", "count", "min", "mean", "stddev", "p50", "p99", "max") ]
+  for socket in sockets:
+    for name in selected or names():
+      s=summary(socket, name)
+      if s is None:
+        continue
+      lines.append( "{0:6d} {1:22s} {2:9d} {3:10.1f} {4:10.1f} {5:>10s} {6:10.1f} {7:10.1f} {8:10.1f}".format(
+                    socket, name, s["count"], s["min"], s["mean"],
+                    "-" if s["stddev"] is None else "{0:.1f}".format(s["stddev"]), s["p50"], s["p99"], s["max"]) )
+  return "\n".join(lines)
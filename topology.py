@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from useful_stuff import *
+
+###################################################################################################
+#
+#  0. Platform discovery, from sysfs only
+#     /sys/bus/pci/devices/*/vendor and device are read once :
+#       PCU : the functions of slot 1e, one CR per function. SPR has CR0-7, Cascade Lake CR0-6
+#       UPI : the 3240 functions (UPI misc, device 1-4 function 0), one per link
+#     /sys/devices/system/cpu/cpu*/topology/physical_package_id gives the CPUs of each socket.
+#     Sockets are numbered in the PCI order of their PCU, like lspci -D lists them. A UPI link
+#     belongs to the socket whose PCU sits on the nearest bus at or above its own, same domain
+#     (SPR : UPI on bus 7e, PCU on bus 7f).
+#     The result is kept in memory, and on disk until the next reboot (CACHE_FILE).
+#
+###################################################################################################
+PCI_DEVICES="/sys/bus/pci/devices"
+CPU_DEVICES="/sys/devices/system/cpu"
+INTEL=0x8086
+PCU_SLOT=0x1e
+UPI_DEVICE=0x3240
+VERSION=2          # of the cached topology : bumped when its content changes
+CACHE_FILE=os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "pcu", "topology.json")
+
+# the topology of the current process, once scanned
+cached=None
+
+
+def read_id(path):
+  """vendor or device file : "0x8086\n" -> 0x8086. None when it can not be read"""
+  try:
+    with open(path) as f:
+      return int(f.read(), 16)
+  except (OSError, ValueError):
+    return None
+
+
+def split_bdf(name):
+  """ "0000:7f:1e.2" -> (0x0000, 0x7f, 0x1e, 2) """
+  domain,bus,devfn=name.split(":")
+  device,function=devfn.split(".")
+  return int(domain, 16), int(bus, 16), int(device, 16), int(function, 16)
+
+
+def scan_pci():
+  """returns { name: (vendor, device) } of every PCI function"""
+  root=sysfs(PCI_DEVICES)
+  devices={}
+  if not os.path.isdir(root):
+    return devices
+  for name in os.listdir(root):
+    devices[name]=( read_id(os.path.join(root, name, "vendor")), read_id(os.path.join(root, name, "device")) )
+  return devices
+
+
+def scan_cpus():
+  """returns { socket: [ cpu, ... ] } from the topology of each online CPU"""
+  root=sysfs(CPU_DEVICES)
+  cpus={}
+  if not os.path.isdir(root):
+    return cpus
+  for name in os.listdir(root):
+    if not name.startswith("cpu") or not name[3:].isdigit():
+      continue
+    try:
+      with open(os.path.join(root, name, "topology/physical_package_id")) as f:
+        package=int(f.read())
+    except (OSError, ValueError):
+      continue   # offline CPU
+    cpus.setdefault(package, []).append(int(name[3:]))
+  for package in cpus: cpus[package].sort()
+  return cpus
+
+
+def scan():
+  """builds the topology :
+     { "PCUTable": [ "0000:7f:1e", ... ],   PCU of each socket, in socket order
+       "nCR"     : number of CRs of the first PCU,
+       "UPITable": [ "0000:7e:02", ... ],   every UPI link, cut of its ".0"
+       "packages": [ [ cpu, ... ], ... ],    CPUs of each physical package, in package order
+       "sockets" : [ { "pcu", "functions": { CR: (name, device id) }, "upi": [ ... ], "cpus": [ ... ] } ] }"""
+  devices=scan_pci()
+
+  pcus={}
+  upis=[]
+  for name,(vendor,device) in devices.items():
+    if vendor!=INTEL: continue
+    domain,bus,slot,function=split_bdf(name)
+    if slot==PCU_SLOT:
+      pcus.setdefault(name[:-2], {})[function]=(name, device)
+    elif device==UPI_DEVICE:
+      upis.append(name[:-2])
+
+  PCUTable=sorted(pcus, key=lambda name: split_bdf(name+".0"))
+  cpus=scan_cpus()
+  packages=sorted(cpus)
+  sockets=[]
+  for socket,pcu in enumerate(PCUTable):
+    sockets.append( { "pcu": pcu,
+                      "functions": pcus[pcu],
+                      "upi": [],
+                      "cpus": cpus[packages[socket]] if socket<len(packages) else [] } )
+
+  UPITable=sorted(upis, key=lambda name: split_bdf(name+".0"))
+  for upi in UPITable:
+    domain,bus,_,_=split_bdf(upi+".0")
+    candidates=[ (split_bdf(pcu+".0")[1], socket) for socket,pcu in enumerate(PCUTable)
+                 if split_bdf(pcu+".0")[0]==domain and split_bdf(pcu+".0")[1]>=bus ]
+    if candidates:
+      sockets[min(candidates)[1]]["upi"].append(upi)
+
+  # CRs are numbered from 0, without holes
+  nCR=0
+  if PCUTable:
+    while nCR in pcus[PCUTable[0]]: nCR+=1
+
+  return { "PCUTable": PCUTable, "nCR": nCR, "UPITable": UPITable, "sockets": sockets,
+           "packages": [ cpus[package] for package in packages ] }
+
+
+###################################################################################################
+#
+#  1. Cache
+#
+###################################################################################################
+def load(path=None):
+  """the topology saved during the same boot, on the same sysroot, or None"""
+  path=path or CACHE_FILE
+  try:
+    with open(path) as f:
+      saved=json.load(f)
+  except (OSError, ValueError):
+    return None
+  if saved.get("version")!=VERSION or saved.get("boot_id") is None or saved.get("boot_id")!=boot_id() \
+     or saved.get("sysroot")!=backend["sysroot"]:
+    return None
+  topo=saved["topology"]
+  # json keys are strings, and tuples become lists
+  for socket in topo["sockets"]:
+    socket["functions"]={ int(cr): tuple(function) for cr,function in socket["functions"].items() }
+  return topo
+
+
+def save(topo, path=None):
+  path=path or CACHE_FILE
+  current=boot_id()
+  if current is None:
+    return
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path+".tmp", "w") as f:
+      json.dump({ "version": VERSION, "boot_id": current, "sysroot": backend["sysroot"], "topology": topo }, f)
+    os.replace(path+".tmp", path)
+  except OSError:
+    pass      # a read only home : the next run scans again
+
+
+def get(refresh=False, path=None):
+  """the topology : from memory, else from the disk cache, else scanned (then saved)"""
+  global cached
+  if cached is not None and not refresh:
+    return cached
+  topo=None if refresh else load(path)
+  if topo is None:
+    topo=scan()
+    save(topo, path)
+  cached=topo
+  return topo
+
+
+def forget():
+  """drops the topology of the current process, e.g. after a change of sysroot"""
+  global cached
+  cached=None
+
+
+###################################################################################################
+#
+#  2. Shortcuts for the tools
+#
+###################################################################################################
+def pcus():
+  """[ "0000:3f:1e", "0000:7f:1e", .... ], what lspci -Ds 1e.0 used to give"""
+  return get()["PCUTable"]
+
+
+def upis():
+  """[ "0001:be:02", "0001:be:03", .... ], what lspci | grep 3240 used to give"""
+  return get()["UPITable"]
+
+
+def cpus(socket):
+  return get()["sockets"][socket]["cpus"]
+
+
+def packages():
+  """[ [ cpu, ... ], ... ] : the CPUs of each physical package"""
+  return get()["packages"]
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Lists the PCUs, UPI links and CPUs of each socket, from sysfs.",
+           epilog="(c) 2023 HA Quoc Viet" )
+  parser.add_argument("--refresh", "-r", action="store_true", default=False, help="ignores the cache")
+  args=parser.parse_args()
+
+  start=time.perf_counter()
+  topo=get(args.refresh)
+  elapsed=time.perf_counter()-start
+  for index,socket in enumerate(topo["sockets"]):
+    print( "{0} {1}  CR{2}  UPI {3}  {4} cpus".format(
+           bold("socket {0:2d}".format(index)), socket["pcu"],
+           ",".join( "{0}:{1:04x}".format(cr, device or 0) for cr,(name,device) in sorted(socket["functions"].items()) ),
+           " ".join(socket["upi"]) or "-", len(socket["cpus"])) )
+  print("{0} sockets, {1} CRs, {2} UPI links in {3:.1f} ms".format(
+        len(topo["sockets"]), topo["nCR"], len(topo["UPITable"]), elapsed*1000))
+
+
+if __name__ == '__main__':
+  main()
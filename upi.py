@@ -1,7 +1,6 @@
 #!/usr/bin/python3
 
 import os
-import re
 import sys
 import tty
 import time
@@ -11,10 +10,10 @@ from textwrap import wrap
 import argparse
 import bitstruct
 import threading
-import subprocess
 import multiprocessing
 
 from useful_stuff import *
+import topology
 import PCU_CR0
 import PCU_CR1
 import PCU_CR2
@@ -370,25 +369,8 @@ def init():
   # UPI Mesh stop M2UPI 3245 device 5-8, function 0
   # UPI PMON0           3246 device 5-8, function 1
   # UPI PMON1           3247 device 5-8, function 2
-  # dirty version using lspci. don't blame me, I have 10min before a meeting
-  UPITable=[]
-  p=subprocess.Popen( [ "lspci", ] , stderr=subprocess.STDOUT, stdout=subprocess.PIPE, universal_newlines=True )
-  compiled_regexp=re.compile("3240$")
-  
-  # typical output, here on 16S :
-  # 0001:be:02.0 System peripheral: Intel Corporation Device 3240
-  # 0001:be:03.0 System peripheral: Intel Corporation Device 3240
-  # 0001:be:04.0 System peripheral: Intel Corporation Device 3240
-  # 0001:fe:01.0 System peripheral: Intel Corporation Device 3240
-  # 0001:fe:02.0 System peripheral: Intel Corporation Device 3240
-  # 0001:fe:03.0 System peripheral: Intel Corporation Device 3240
-  for dataline in p.stdout:
-    if dataline.strip("\n ") == "": continue
-    o=compiled_regexp.match(dataline)
-    if o is None: continue
-    PCUTable.append( dataline.split()[0][:-2] )  # cutting ".0" out
-  # [ "0001:be:02", "0001:be:03", .... ]
-
+  # [ "0001:be:02", "0001:be:03", .... ], from sysfs (see topology.py)
+  PCUTable=topology.upis()
 
   return parser.parse_args(),PCUTable
 
@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import os
 import time
 import textwrap
 
@@ -48,6 +49,28 @@ pcu={ "energy_unit": 0,
       "pwr_unit": 0
     }
 
+# where the devices are read from. sysroot is prepended to every /sys and /dev path, so that
+# PCU_SYSROOT=/tmp/spr16 points all the tools to a simulated tree (see simulator.py)
+backend={ "sysroot": os.environ.get("PCU_SYSROOT", "")
+        }
+
+def sysfs(path):
+  """returns path, under the sysroot of the current backend"""
+  return backend["sysroot"]+path
+
+def msr_offset(msr):
+  """file offset of MSR number msr in /dev/cpu/N/msr. The msr driver takes the number itself ;
+  a simulated tree is a plain file, where each MSR has 8 bytes of its own"""
+  return msr*8 if backend["sysroot"] else msr
+
+def boot_id():
+  """the kernel boot id, None when it can not be read"""
+  try:
+    with open(sysfs("/proc/sys/kernel/random/boot_id")) as f:
+      return f.read().strip()
+  except OSError:
+    return None
+
 def format_array( data ):
   """
      formats an array for display on console.
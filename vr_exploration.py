@@ -13,6 +13,8 @@ import bitstruct
 
 from useful_stuff import *
 import msr
+import mailboxes
+from mailboxes import wr_ocmailbox, rd_ocmailbox
 
 ###################################################################################################
 #
@@ -51,35 +53,6 @@ VCC_DDRD      = 8
 VCC_DDRA      = 9
 
 
-def wr_ocmailbox(param2, param1, command, data, core=0):
-  buffer=struct.pack("IBBBB", data, command, param1, param2, 0b10000000)
-  if debug:
-    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", buffer)
-    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
-    sys.stdout.write("debug : write to OC_MAILBOX {0}h ( param2={1:02X} "\
-                     "param1={2:02X} command={3:02X} data={4:04X} )\n".format(
-                     blue(hexa),param2,param1,command,data) )
-  try:
-    msr.write_mailbox(0x150, 8, buffer, core)
-  except:
-    sys.stderr.write("Could not write {} to OC_MAILBOX, leaving.\n".format(buffer))
-    sys.exit(1)
-  return buffer  
-
-
-def rd_ocmailbox(core=0):
-  try:
-    chunk=msr.read_mailbox(0x150, 8, core)
-  except:
-    sys.stderr.write("Could not read the OC_MAILBOX, leaving.\n")
-    sys.exit(1)
-  if debug:
-    a,b,c,d,e,f,g,h = struct.unpack("<BBBBBBBB", chunk)
-    hexa = "{7:02X}{6:02X}{5:02X}{4:02X}{3:02X}{2:02X}{1:02X}{0:02X}".format( a,b,c,d,e,f,g,h )
-    sys.stdout.write("debug : read frm OC_MAILBOX {0}h\n".format( blue(hexa)) )
-  return chunk
-
-
 def mailbox_OC_CAPABILITY(domain):
     wr_chunk=wr_ocmailbox(0,domain,0x01, 0)
     rd_chunk=rd_ocmailbox()
@@ -547,6 +520,7 @@ def main():
 
 #  args=init()
 #  debug = args.debug
+  mailboxes.debug = debug
 
   for core in range(NCPU):
     comment, \